@@ -0,0 +1,9 @@
+"""
+Benchmark suites.
+
+Each module can be run from the repository root, e.g.:
+    python -m benchmarks.create_dataset --help
+
+Results are written as JSON files which can be compared between commits with
+the --compare option.
+"""
@@ -0,0 +1,293 @@
+"""
+This module generates synthetic corpora for the benchmarks.
+"""
+import os
+import numpy as np
+import soundfile as sf
+
+# Formats soundfile is able to write
+FORMATS = ['wav', 'flac', 'ogg', 'aiff']
+
+
+def durations(n: int, distribution: str = 'uniform', low: float = 1.,
+              high: float = 5., seed: int = 0) -> np.ndarray:
+    """
+    Draws audio durations.
+
+    :param n: int
+        Number of durations.
+    :param distribution: str
+        'uniform' (between low and high), 'lognormal' (median at the middle of
+        the range, clipped to it) or 'fixed' (all equal to high).
+    :param low: float
+        Minimum duration in seconds.
+    :param high: float
+        Maximum duration in seconds.
+    :param seed: int
+        Random seed.
+
+    :return: numpy.ndarray
+        Durations in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    if distribution == 'uniform':
+        return rng.uniform(low, high, n)
+    elif distribution == 'lognormal':
+        return np.clip(rng.lognormal(np.log((low + high) / 2), 0.5, n), low,
+                       high)
+    elif distribution == 'fixed':
+        return np.full(n, float(high))
+    raise ValueError('Invalid distribution: {}'.format(distribution))
+
+
+def speech_like(duration: float, rate: int, rng) -> np.ndarray:
+    """
+    Synthesizes a speech like signal: harmonic bursts separated by silence.
+
+    :param duration: float
+        Duration in seconds.
+    :param rate: int
+        Sample rate.
+    :param rng: numpy.random.Generator
+        Random generator.
+
+    :return: numpy.ndarray
+        The signal (float32).
+    """
+    n = int(duration * rate)
+    t = np.arange(n) / rate
+    f0 = rng.uniform(100, 250)
+    signal = sum(np.sin(2 * np.pi * f0 * h * t) / h for h in range(1, 6))
+    # Syllable like envelope, with about a third of the audio silent
+    envelope = np.repeat(rng.random(int(duration * 5) + 1) > 0.33,
+                         int(np.ceil(rate / 5)))[:n]
+    signal = 0.3 * signal * envelope + \
+        0.001 * rng.standard_normal(n)
+    return signal.astype(np.float32)
+
+
+def make_corpus(directory: str, n_files: int, distribution: str = 'uniform',
+                low: float = 1., high: float = 5., rate: int = 16000,
+                channels: int = 1, audio_format: str = 'wav',
+                seed: int = 0) -> list:
+    """
+    Writes a synthetic corpus of audio files.
+
+    :param directory: str
+        Output directory.
+    :param n_files: int
+        Number of files.
+    :param distribution: str
+        Distribution of the durations. See durations.
+    :param low: float
+        Minimum duration in seconds.
+    :param high: float
+        Maximum duration in seconds.
+    :param rate: int
+        Sample rate.
+    :param channels: int
+        Number of channels (copies of the same signal).
+    :param audio_format: str
+        One of FORMATS.
+    :param seed: int
+        Random seed.
+
+    :return: list
+        Paths of the generated files.
+    """
+    if audio_format not in FORMATS:
+        raise ValueError('Invalid format: {}. Choose one of {}'.
+                         format(audio_format, FORMATS))
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i, d in enumerate(durations(n_files, distribution, low, high, seed)):
+        path = os.path.join(directory, 'audio_{:06d}.{}'.format(i,
+                                                                audio_format))
+        signal = speech_like(d, rate, rng)
+        sf.write(path, np.repeat(signal[:, None], channels, axis=1), rate)
+        paths.append(path)
+    return paths
+
+
+def make_noises(directory: str, n_files: int = 2, duration: float = 3.,
+                rate: int = 16000, seed: int = 0) -> list:
+    """
+    Writes synthetic noise files (white and brown noise).
+
+    :param directory: str
+        Output directory.
+    :param n_files: int
+        Number of files.
+    :param duration: float
+        Duration in seconds.
+    :param rate: int
+        Sample rate.
+    :param seed: int
+        Random seed.
+
+    :return: list
+        Paths of the generated files.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(n_files):
+        noise = rng.standard_normal(int(duration * rate))
+        if i % 2 == 1:
+            noise = np.cumsum(noise)
+            noise -= noise.mean()
+        noise = 0.1 * noise / np.abs(noise).max()
+        path = os.path.join(directory, 'noise_{:03d}.wav'.format(i))
+        sf.write(path, noise.astype(np.float32), rate)
+        paths.append(path)
+    return paths
+
+
+def write_csv(csv_path: str, paths: list, labels: list):
+    """
+    Writes a CSV file with paths and labels (see util.datasets.csv).
+
+    :param csv_path: str
+        Output path.
+    :param paths: list
+        Paths of the data files.
+    :param labels: list
+        Label of each file.
+    """
+    with open(csv_path, 'w') as csv_file:
+        for p, l in zip(paths, labels):
+            csv_file.write(p + ',' + str(l) + '\n')
+
+
+def _corrupt(paths: list, shapes: list, missing: float, wrong_shape: float,
+             rng) -> (list, list):
+    """Marks a fraction of the files as missing and of wrong shape"""
+    draw = rng.random(len(paths))
+    removed = draw < missing
+    wrong = (draw >= missing) & (draw < missing + wrong_shape)
+    paths = [p + '.missing' if r else p for p, r in zip(paths, removed)]
+    shapes = [tuple(s + 1 for s in shape) if w else shape
+              for shape, w in zip(shapes, wrong)]
+    return paths, shapes
+
+
+def make_npy_dataset(directory: str, n_files: int, shape: tuple,
+                     dtype: str = 'float32', n_classes: int = 10,
+                     missing: float = 0., wrong_shape: float = 0.,
+                     seed: int = 0) -> str:
+    """
+    Writes a synthetic data set of .npy files and its CSV file.
+
+    :param directory: str
+        Output directory.
+    :param n_files: int
+        Number of files.
+    :param shape: tuple
+        Shape of each array.
+    :param dtype: str
+        Data type of the arrays.
+    :param n_classes: int
+        Number of labels.
+    :param missing: float
+        Fraction of the CSV entries pointing to files that do not exist.
+    :param wrong_shape: float
+        Fraction of the files with an unexpected shape.
+    :param seed: int
+        Random seed.
+
+    :return: str
+        Path of the CSV file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = [os.path.join(directory, 'data_{:06d}.npy'.format(i))
+             for i in range(n_files)]
+    paths, shapes = _corrupt(paths, [tuple(shape)] * n_files, missing,
+                             wrong_shape, rng)
+    for p, s in zip(paths, shapes):
+        if not p.endswith('.missing'):
+            np.save(p, rng.random(s).astype(dtype))
+    csv_path = os.path.join(directory, 'data.csv')
+    write_csv(csv_path, paths, rng.integers(0, n_classes, n_files))
+    return csv_path
+
+
+def make_image_dataset(directory: str, n_files: int, size: tuple,
+                       channels: int = 3, n_classes: int = 10,
+                       missing: float = 0., wrong_shape: float = 0.,
+                       seed: int = 0) -> str:
+    """
+    Writes a synthetic data set of PNG images and its CSV file.
+
+    :param directory: str
+        Output directory.
+    :param n_files: int
+        Number of files.
+    :param size: tuple, shape=(height, width)
+        Size of the images.
+    :param channels: int
+        Number of channels.
+    :param n_classes: int
+        Number of labels.
+    :param missing: float
+        Fraction of the CSV entries pointing to files that do not exist.
+    :param wrong_shape: float
+        Fraction of the images with an unexpected size.
+    :param seed: int
+        Random seed.
+
+    :return: str
+        Path of the CSV file.
+    """
+    import imageio
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = [os.path.join(directory, 'image_{:06d}.png'.format(i))
+             for i in range(n_files)]
+    paths, sizes = _corrupt(paths, [tuple(size)] * n_files, missing,
+                            wrong_shape, rng)
+    for p, s in zip(paths, sizes):
+        if not p.endswith('.missing'):
+            shape = s + (channels,) if channels > 1 else s
+            imageio.imwrite(p, rng.integers(0, 256, shape, dtype=np.uint8))
+    csv_path = os.path.join(directory, 'data.csv')
+    write_csv(csv_path, paths, rng.integers(0, n_classes, n_files))
+    return csv_path
+
+
+def make_wav_dataset(directory: str, n_files: int, duration: float,
+                     rate: int = 16000, n_classes: int = 10,
+                     missing: float = 0., seed: int = 0) -> str:
+    """
+    Writes a synthetic data set of WAV files of fixed duration and its CSV
+    file.
+
+    :param directory: str
+        Output directory.
+    :param n_files: int
+        Number of files.
+    :param duration: float
+        Duration of each file in seconds.
+    :param rate: int
+        Sample rate.
+    :param n_classes: int
+        Number of labels.
+    :param missing: float
+        Fraction of the CSV entries pointing to files that do not exist.
+    :param seed: int
+        Random seed.
+
+    :return: str
+        Path of the CSV file.
+    """
+    rng = np.random.default_rng(seed)
+    paths = make_corpus(directory, n_files, 'fixed', duration, duration, rate,
+                        seed=seed)
+    paths, _ = _corrupt(paths, [()] * n_files, missing, 0., rng)
+    for p in paths:
+        if p.endswith('.missing'):
+            os.remove(p[:-len('.missing')])
+    csv_path = os.path.join(directory, 'data.csv')
+    write_csv(csv_path, paths, rng.integers(0, n_classes, n_files))
+    return csv_path
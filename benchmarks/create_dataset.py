@@ -0,0 +1,247 @@
+"""
+Benchmarks the stages of script_create_dataset.py.
+
+A synthetic corpus is generated and each processing function is timed on every
+file (per stage latency and files/sec). The whole pre processing is then run
+through create_dataset with 1..N workers to measure the scaling efficiency.
+
+Usage:
+    python -m benchmarks.create_dataset --files 100 --workers 8 \\
+        --output bench_create_dataset.json --compare previous.json
+
+Note: most stages depend on sox. Stages whose tools are not installed are
+skipped, and stages (or runs) that fail or write no file are reported with
+their error instead of timings.
+"""
+import os
+import shutil
+import tempfile
+import script_create_dataset as scd
+from benchmarks import corpus, report
+from util.timing import Timer
+
+# External tools called by each stage (the other stages only use python)
+TOOLS = {
+    'remix': ('sox',),
+    'convert_rate': ('sox',),
+    'trim': ('sox',),
+    'speed': ('sox',),
+    'pitch': ('sox',),
+    'lowpass': ('sox',),
+    'phone_voice': ('sox',),
+    'robot_voice': ('sox',),
+    'add_noise': ('sox',),
+    'pre_process': ('sox', 'soxi')
+}
+
+
+def missing_tools(stage: str) -> list:
+    """Returns the external tools of a stage that are not installed"""
+    return [tool for tool in TOOLS.get(stage, ())
+            if shutil.which(tool) is None]
+
+
+def count_outputs(directory: str) -> int:
+    """Returns the number of files written under a directory"""
+    return sum(len(files) for _, _, files in os.walk(directory))
+
+
+def stages(noise_path: str) -> dict:
+    """
+    Builds the benchmarked stages.
+
+    :param noise_path: str
+        Path of the noise mixed by the add_noise stage.
+
+    :return: dict
+        Stage names and callables(file_path, output_dir, file_name) -> path.
+    """
+    return {
+        'remix': lambda f, o, n: scd.remix(f, o, n),
+        'convert_rate': lambda f, o, n: scd.convert_rate(8000, f, o, n),
+        'norm_default': lambda f, o, n: scd.norm(f, o, n, None, 'default'),
+        'norm_peak': lambda f, o, n: scd.norm(f, o, n, None, 'peak'),
+        'norm_loudness': lambda f, o, n: scd.norm(f, o, n, None, 'loudness'),
+        'trim_silence': lambda f, o, n: scd.trim_silence_audio(1., f, o, n),
+        'trim': lambda f, o, n: scd.trim(f, o, n, 0, 1),
+        'speed': lambda f, o, n: scd.speed(1.1, f, o, n),
+        'pitch': lambda f, o, n: scd.pitch(100, f, o, n),
+        'lowpass': lambda f, o, n: scd.lowpass(f, o, 3000, n),
+        'phone_voice': lambda f, o, n: scd.phone_voice(f, o, n),
+        'robot_voice': lambda f, o, n: scd.robot_voice(f, o, n),
+        'add_noise': lambda f, o, n: scd.add_noise(noise_path, f, o, n),
+        'pre_process': lambda f, o, n: scd.pre_process(
+            f, o, name=n, min_length=1, trim_interval=(0, 1),
+            remix_channels=True, rate=8000, trim_silence_threshold=1.)
+    }
+
+
+def bench_stages(files: list, work_dir: str, noise_path: str,
+                 selected: list = None) -> dict:
+    """
+    Times each stage on every file.
+
+    :param files: list
+        Paths of the audio files.
+    :param work_dir: str
+        Directory for the generated files.
+    :param noise_path: str
+        Path of the noise used by the add_noise stage.
+    :param selected: list
+        Names of the stages to run. Default to None (all stages).
+
+    :return: dict
+        Latency summary of each stage (see report.latency) with the number of
+        files written, the error raised by the stage (or the missing output),
+        or the tools missing to run it.
+    """
+    results = dict()
+    for name, stage in stages(noise_path).items():
+        if selected is not None and name not in selected:
+            continue
+        missing = missing_tools(name)
+        if missing:
+            print('[WARN] skipping stage {}: {} not found'.
+                  format(name, ', '.join(missing)))
+            results[name] = {'skipped': 'missing ' + ', '.join(missing)}
+            continue
+        print('[INFO] benchmarking stage', name)
+        output_dir = os.path.join(work_dir, name)
+        os.makedirs(output_dir, exist_ok=True)
+        times = []
+        try:
+            for i, file_path in enumerate(files):
+                with Timer() as timer:
+                    out = stage(file_path, output_dir, 'out_{}'.format(i))
+                times.append(timer.interval)
+                if out is not None and not os.path.isfile(out):
+                    raise RuntimeError('no output generated for {}'.
+                                       format(file_path))
+            outputs = count_outputs(output_dir)
+            if outputs == 0:
+                raise RuntimeError('no output generated')
+        except Exception as error:
+            results[name] = {'error': str(error)}
+            continue
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        results[name] = report.latency(times)
+        results[name]['outputs'] = outputs
+    return results
+
+
+def bench_scaling(files: list, work_dir: str, max_workers: int) -> list:
+    """
+    Runs create_dataset with an increasing number of workers.
+
+    :param files: list
+        Paths of the audio files.
+    :param work_dir: str
+        Directory for the generated data sets.
+    :param max_workers: int
+        Maximum number of workers. Powers of two up to this value (and the
+        value itself) are measured.
+
+    :return: list
+        A dict per number of workers with the elapsed time and the number of
+        files written. The files/sec are computed from the files written,
+        the speedup is relative to the first run (with the fewest workers)
+        writing files and the efficiency is the speedup divided by the ratio
+        of workers. A run writing no file is reported with an error instead.
+    """
+    counts = sorted({2 ** i for i in range(max_workers.bit_length())
+                     if 2 ** i <= max_workers} | {max_workers})
+    results = []
+    for workers in counts:
+        print('[INFO] benchmarking create_dataset with {} workers'.
+              format(workers))
+        dataset_dir = os.path.join(work_dir, 'scaling_{}'.format(workers))
+        with Timer() as timer:
+            scd.create_dataset(dataset_dir, files, num_workers=workers,
+                               pre_processing=scd.pre_process, min_length=1,
+                               trim_interval=(0, 1), remix_channels=True,
+                               rate=8000)
+        outputs = count_outputs(dataset_dir)
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+        result = {'workers': workers, 'elapsed': timer.interval,
+                  'outputs': outputs}
+        if outputs == 0:
+            print('[ERROR] create_dataset with {} workers wrote no file'.
+                  format(workers))
+            result['error'] = 'no output generated'
+        else:
+            result['per_sec'] = outputs / timer.interval
+        results.append(result)
+    valid = [r for r in results if 'error' not in r]
+    for r in valid:
+        r['speedup'] = r['per_sec'] / valid[0]['per_sec']
+        r['efficiency'] = r['speedup'] * valid[0]['workers'] / r['workers']
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmarks the dataset '
+                                                 'creation stages.')
+    parser.add_argument('--files', help='Number of synthetic files.',
+                        type=int, default=50)
+    parser.add_argument('--distribution', help='Distribution of the '
+                                               'durations.',
+                        choices=['uniform', 'lognormal', 'fixed'],
+                        default='uniform')
+    parser.add_argument('--min_duration', help='Minimum duration (seconds).',
+                        type=float, default=1.)
+    parser.add_argument('--max_duration', help='Maximum duration (seconds).',
+                        type=float, default=5.)
+    parser.add_argument('--format', help='Format of the audio files.',
+                        choices=corpus.FORMATS, default='wav')
+    parser.add_argument('--rate', help='Sample rate of the audio files.',
+                        type=int, default=16000)
+    parser.add_argument('--channels', help='Number of channels.',
+                        type=int, default=2)
+    parser.add_argument('--noises', help='Number of synthetic noise files.',
+                        type=int, default=2)
+    parser.add_argument('--stages', help='Stages to benchmark. Default to '
+                                         'all.',
+                        nargs='+')
+    parser.add_argument('--workers', help='Maximum number of workers of the '
+                                          'scaling benchmark. Set 0 to skip '
+                                          'it.',
+                        type=int, default=os.cpu_count())
+    parser.add_argument('--seed', help='Random seed.', type=int, default=0)
+    parser.add_argument('--work_dir', help='Directory of the synthetic '
+                                           'corpus. Default to a temporary '
+                                           'directory.')
+    parser.add_argument('--output', help='Output JSON file. Default to '
+                                         'stdout.')
+    parser.add_argument('--compare', help='JSON file of a previous run to '
+                                          'compare with.')
+    args = parser.parse_args()
+
+    work = args.work_dir or tempfile.mkdtemp(prefix='bench_create_dataset_')
+    os.makedirs('logs/scripts', exist_ok=True)
+    try:
+        audio_files = corpus.make_corpus(os.path.join(work, 'corpus'),
+                                         args.files, args.distribution,
+                                         args.min_duration, args.max_duration,
+                                         args.rate, args.channels, args.format,
+                                         args.seed)
+        noise_files = corpus.make_noises(os.path.join(work, 'noises'),
+                                         args.noises, rate=args.rate,
+                                         seed=args.seed)
+        res = {'meta': report.metadata(vars(args)),
+               'stages': bench_stages(audio_files, work, noise_files[0],
+                                      args.stages)}
+        missing = ', '.join(missing_tools('pre_process'))
+        if args.workers > 0 and missing:
+            print('[WARN] skipping the scaling benchmark: {} not found'.
+                  format(missing))
+            res['scaling'] = {'skipped': 'missing ' + missing}
+        elif args.workers > 0:
+            res['scaling'] = bench_scaling(audio_files, work, args.workers)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work, ignore_errors=True)
+    report.write(res, args.output)
+    if args.compare is not None:
+        report.compare(res, args.compare)
@@ -0,0 +1,281 @@
+"""
+Benchmarks the throughput of the data loaders.
+
+Synthetic .npy, image and WAV data sets are written to a local directory and
+read through util.dataloader.batching.sequence.Generator,
+util.dataloader.numpyloader.load_dataset and util.dataloader.imgload.img_load.
+Each case runs in a new process, so the peak RSS of a case is not affected by
+the previous ones. Batch size, file size and the not_found_ok/expected_shape
+options (with a fraction of missing and wrong shaped files) are varied.
+
+Usage:
+    python -m benchmarks.dataloader --batch_sizes 16 64 \\
+        --shapes 64x64 256x256 --output bench_dataloader.json \\
+        --compare previous.json
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from benchmarks import corpus, report
+
+# Options of each case: (name, not_found_ok, expected_shape, missing, wrong)
+OPTIONS = [('plain', False, False, 0., 0.),
+           ('not_found_ok', True, False, 0.05, 0.),
+           ('expected_shape', False, True, 0., 0.05),
+           ('both', True, True, 0.05, 0.05)]
+
+
+def _rss() -> int:
+    """Peak resident set size of the process in bytes"""
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _load_wav(path: str) -> np.ndarray:
+    import soundfile as sf
+    # soundfile does not raise FileNotFoundError, expected by not_found_ok
+    if not os.path.isfile(path):
+        raise FileNotFoundError(path)
+    return sf.read(path, dtype='float32')[0]
+
+
+def _loader(kind: str):
+    """Loader function of a kind of data"""
+    if kind == 'npy':
+        return np.load
+    elif kind == 'image':
+        from util.dataloader.imgload import img_load
+        return img_load
+    elif kind == 'wav':
+        return _load_wav
+    raise ValueError('Invalid kind: {}'.format(kind))
+
+
+def _iterate(generator, n_batches: int) -> int:
+    samples = 0
+    for i in range(n_batches):
+        samples += len(generator[i][0])
+    return samples
+
+
+def run_generator(kind: str, csv_path: str, batch_size: int,
+                  expected_shape: tuple, not_found_ok: bool,
+                  max_batches: int, traced_batches: int) -> dict:
+    """
+    Measures the Generator throughput.
+
+    :param kind: str
+        'npy', 'image' or 'wav'.
+    :param csv_path: str
+        CSV file of the data set.
+    :param batch_size: int
+        Batch size.
+    :param expected_shape: tuple
+        Expected shape passed on to the generator (None to disable).
+    :param not_found_ok: bool
+        not_found_ok option of the generator.
+    :param max_batches: int
+        Maximum number of timed batches.
+    :param traced_batches: int
+        Number of batches read with tracemalloc enabled.
+
+    :return: dict
+        Batches/sec, samples/sec, peak RSS and allocation measurements.
+    """
+    from util.dataloader.batching.sequence import Generator
+    from util.datasets.csv import CSVParser
+    paths, labels = CSVParser(csv_path)()
+    generator = Generator(paths, labels, batch_size, loader_fn=_loader(kind),
+                          shuffle=False, expected_shape=expected_shape,
+                          not_found_ok=not_found_ok)
+    n_batches = min(len(generator), max_batches)
+    rss_start = _rss()
+    start = time.perf_counter()
+    samples = _iterate(generator, n_batches)
+    elapsed = time.perf_counter() - start
+    results = {'batches': n_batches, 'elapsed': elapsed,
+               'batches_per_sec': n_batches / elapsed,
+               'per_sec': samples / elapsed,
+               'rss_peak': _rss(), 'rss_increase': _rss() - rss_start}
+    results.update(_trace(lambda: _iterate(generator,
+                                           min(n_batches, traced_batches))))
+    return results
+
+
+def run_load_dataset(csv_path: str, expected_shape: tuple,
+                     not_found_ok: bool) -> dict:
+    """
+    Measures numpyloader.load_dataset.
+
+    :param csv_path: str
+        CSV file of the data set.
+    :param expected_shape: tuple
+        Expected shape (None to disable).
+    :param not_found_ok: bool
+        not_found_ok option.
+
+    :return: dict
+        Samples/sec, peak RSS and allocation measurements.
+    """
+    from util.dataloader.numpyloader import load_dataset
+    rss_start = _rss()
+    start = time.perf_counter()
+    x, _ = load_dataset(csv_path, expected_shape=expected_shape,
+                        not_found_ok=not_found_ok)
+    elapsed = time.perf_counter() - start
+    results = {'samples': len(x), 'elapsed': elapsed,
+               'per_sec': len(x) / elapsed, 'data_bytes': int(x.nbytes),
+               'rss_peak': _rss(), 'rss_increase': _rss() - rss_start}
+    del x
+    results.update(_trace(lambda: load_dataset(csv_path, expected_shape,
+                                               not_found_ok=not_found_ok)))
+    return results
+
+
+def run_img_load(csv_path: str, max_samples: int) -> dict:
+    """
+    Measures img_load on single images.
+
+    :param csv_path: str
+        CSV file of the data set.
+    :param max_samples: int
+        Maximum number of images.
+
+    :return: dict
+        Samples/sec, latency summary and peak RSS.
+    """
+    from util.dataloader.imgload import img_load
+    from util.datasets.csv import CSVParser
+    paths = [p for p in CSVParser(csv_path)()[0] if os.path.isfile(p)]
+    times = []
+    for path in paths[:max_samples]:
+        start = time.perf_counter()
+        img_load(path)
+        times.append(time.perf_counter() - start)
+    results = report.latency(times)
+    results['rss_peak'] = _rss()
+    results.update(_trace(lambda: [img_load(p) for p in paths[:10]]))
+    return results
+
+
+def _trace(c: callable) -> dict:
+    """Runs a callable measuring the traced memory and allocated blocks"""
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    c()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'traced_peak': peak, 'traced_current': current,
+            'allocated_blocks': sys.getallocatedblocks() - blocks}
+
+
+def _isolated(function: callable, *args) -> dict:
+    """Runs a case in a new process"""
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1,
+                                                mp_context=context) as \
+            executor:
+        try:
+            return executor.submit(function, *args).result()
+        except Exception as error:
+            return {'error': str(error)}
+
+
+def _parse_shape(text: str) -> tuple:
+    return tuple(int(s) for s in text.split('x'))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmarks the data '
+                                                 'loaders.')
+    parser.add_argument('--files', help='Number of files of each data set.',
+                        type=int, default=1024)
+    parser.add_argument('--batch_sizes', help='Batch sizes.', type=int,
+                        nargs='+', default=[16, 64])
+    parser.add_argument('--shapes', help='Shapes of the .npy files, e.g. '
+                                         '64x64 (file size).',
+                        nargs='+', default=['64x64', '256x256'])
+    parser.add_argument('--image_size', help='Size of the images, e.g. 128x128.',
+                        default='128x128')
+    parser.add_argument('--wav_duration', help='Duration of the WAV files.',
+                        type=float, default=1.)
+    parser.add_argument('--options', help='Loader options to benchmark.',
+                        nargs='+', choices=[o[0] for o in OPTIONS],
+                        default=[o[0] for o in OPTIONS])
+    parser.add_argument('--max_batches', help='Maximum number of timed batches '
+                                              'per case.',
+                        type=int, default=100)
+    parser.add_argument('--traced_batches', help='Number of batches read with '
+                                                 'tracemalloc enabled.',
+                        type=int, default=5)
+    parser.add_argument('--seed', help='Random seed.', type=int, default=0)
+    parser.add_argument('--work_dir', help='Directory of the synthetic data '
+                                           'sets (local disk). Default to a '
+                                           'temporary directory.')
+    parser.add_argument('--output', help='Output JSON file. Default to '
+                                         'stdout.')
+    parser.add_argument('--compare', help='JSON file of a previous run to '
+                                          'compare with.')
+    args = parser.parse_args()
+
+    work = args.work_dir or tempfile.mkdtemp(prefix='bench_dataloader_')
+    options = [o for o in OPTIONS if o[0] in args.options]
+    res = {'meta': report.metadata(vars(args)), 'generator': {},
+           'load_dataset': {}, 'img_load': {}}
+    try:
+        datasets = []
+        for option, not_found, expected, missing, wrong in options:
+            for text in args.shapes:
+                shape = _parse_shape(text)
+                directory = os.path.join(work, 'npy_{}_{}'.format(text, option))
+                csv = corpus.make_npy_dataset(directory, args.files, shape,
+                                              missing=missing,
+                                              wrong_shape=wrong,
+                                              seed=args.seed)
+                datasets.append(('npy', text, option, csv,
+                                 shape if expected else None, not_found))
+            size = _parse_shape(args.image_size)
+            csv = corpus.make_image_dataset(
+                os.path.join(work, 'image_' + option), args.files, size,
+                missing=missing, wrong_shape=wrong, seed=args.seed)
+            datasets.append(('image', args.image_size, option, csv,
+                             size + (1,) if expected else None, not_found))
+            csv = corpus.make_wav_dataset(
+                os.path.join(work, 'wav_' + option), args.files,
+                args.wav_duration, missing=missing, seed=args.seed)
+            datasets.append(('wav', str(args.wav_duration), option, csv,
+                             (int(args.wav_duration * 16000),) if expected
+                             else None, not_found))
+
+        for kind, size, option, csv, expected, not_found in datasets:
+            key = '{}_{}_{}'.format(kind, size, option)
+            for batch_size in args.batch_sizes:
+                print('[INFO] generator {} (batch size {})'.
+                      format(key, batch_size))
+                res['generator']['{}_bs{}'.format(key, batch_size)] = \
+                    _isolated(run_generator, kind, csv, batch_size, expected,
+                              not_found, args.max_batches,
+                              args.traced_batches)
+            if kind == 'npy':
+                print('[INFO] load_dataset', key)
+                res['load_dataset'][key] = _isolated(run_load_dataset, csv,
+                                                     expected, not_found)
+            elif kind == 'image' and option == 'plain':
+                print('[INFO] img_load', key)
+                res['img_load'][key] = _isolated(run_img_load, csv,
+                                                 args.max_batches *
+                                                 args.batch_sizes[0])
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work, ignore_errors=True)
+    report.write(res, args.output)
+    if args.compare is not None:
+        report.compare(res, args.compare, keys=('per_sec', 'batches_per_sec'))
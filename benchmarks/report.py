@@ -0,0 +1,110 @@
+"""
+This module gathers, writes and compares benchmark results.
+"""
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+import util.syscommand as syscommand
+
+
+def metadata(arguments: dict = None) -> dict:
+    """
+    Describes the environment of a benchmark run.
+
+    :param arguments: dict
+        Arguments of the run.
+
+    :return: dict
+        Commit, interpreter, library versions and machine information.
+    """
+    return {
+        'commit': syscommand.system('git rev-parse HEAD').strip(),
+        'time': time.time(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'arguments': arguments or {}
+    }
+
+
+def latency(times) -> dict:
+    """
+    Summarizes a list of latencies.
+
+    :param times: list
+        Latencies in seconds.
+
+    :return: dict
+        Count, total, mean, percentiles and maximum latency in seconds and
+        the throughput (calls per second).
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if len(times) == 0:
+        return {'count': 0}
+    return {
+        'count': int(len(times)),
+        'total': float(times.sum()),
+        'mean': float(times.mean()),
+        'p50': float(np.percentile(times, 50)),
+        'p95': float(np.percentile(times, 95)),
+        'max': float(times.max()),
+        'per_sec': float(len(times) / times.sum()) if times.sum() > 0 else
+        None
+    }
+
+
+def write(results: dict, path: str = None):
+    """
+    Writes the results as JSON (to stdout if path is None).
+
+    :param results: dict
+        Benchmark results.
+    :param path: str
+        Output path.
+    """
+    if path is None:
+        print(json.dumps(results, indent=2))
+        return
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('[INFO] results written to', path)
+
+
+def _flatten(results, prefix=''):
+    """Yields (key, value) pairs of the numeric leaves of the results"""
+    if isinstance(results, dict):
+        for k, v in results.items():
+            if k != 'meta':
+                yield from _flatten(v, prefix + str(k) + '.')
+    elif isinstance(results, list):
+        for i, v in enumerate(results):
+            yield from _flatten(v, prefix + str(i) + '.')
+    elif isinstance(results, (int, float)) and not isinstance(results, bool):
+        yield prefix[:-1], results
+
+
+def compare(results: dict, previous_path: str, keys: tuple = ('per_sec',)):
+    """
+    Prints the ratio between the current and previous results.
+
+    :param results: dict
+        Current results.
+    :param previous_path: str
+        Path to the JSON file of a previous run.
+    :param keys: tuple
+        Suffixes of the compared values. Ratios above 1 mean the current run
+        has greater values.
+    """
+    with open(previous_path) as f:
+        previous = json.load(f)
+    old = dict(_flatten(previous))
+    print('[INFO] comparing with commit', previous.get('meta', {}).
+          get('commit', 'unknown'))
+    for k, v in _flatten(results):
+        if k.split('.')[-1] in keys and old.get(k):
+            print('{key:60s} {old:12.3f} -> {new:12.3f} ({ratio:.2f}x)'.
+                  format(key=k, old=old[k], new=v, ratio=v / old[k]))
@@ -28,6 +28,10 @@ class Config:
     def __init__(self):
         # General config
         self.verbose_level = _VERBOSE_LEVEL
+        # Scripts config
+        self.speeds = _SPEEDS
+        self.semitones = _SEMITONES
+        self.noises = _NOISES
         # Core config
         self.early_stop_range = _EARLY_STOP_RANGE
         self.data_csv = _DATA_CSV
@@ -3,15 +3,50 @@ import numpy as np
 import warnings
 
 
+def monitor_op(monitor: str, mode: str = 'auto'):
+    """
+    Chooses the comparison of a monitored quantity.
+
+    :param monitor: str
+        Quantity to be monitored.
+    :param mode: str
+        One of {auto, min, max}. In 'auto' mode, quantities containing 'acc'
+        are maximized, the others minimized.
+
+    :return: numpy.ufunc
+        numpy.greater if the quantity is maximized, numpy.less otherwise.
+    """
+    if mode not in ['auto', 'min', 'max']:
+        warnings.warn('EarlyStopping mode %s is unknown, '
+                      'fallback to auto mode.' % mode,
+                      RuntimeWarning)
+        mode = 'auto'
+
+    if mode == 'min':
+        return np.less
+    elif mode == 'max':
+        return np.greater
+    elif 'acc' in monitor:
+        return np.greater
+    return np.less
+
+
 class EarlyStoppingRange(keras.callbacks.Callback):
     """
     Stop training when a monitored quantity has stopped improving.
 
     Based on keras.callbacks.EarlyStopping
+
+    The monitored quantity can be smoothed (exponential moving average or
+    rolling window), and a learning curve y = a + b / (epoch + 1) can be fitted
+    to the last epochs, stopping the training when the gain projected at the
+    end of the training is less than min_delta. The reason of the stop is kept
+    in stop_reason.
     """
     def __init__(self, monitor='val_loss', min_val_monitor=0.,
                  max_val_monitor=1., min_delta=0., patience=0., verbose=0,
-                 mode='auto', baseline=None):
+                 mode='auto', baseline=None, smoothing=None, ema_alpha=0.3,
+                 window=3, curve_fit=False, curve_epochs=5, max_epochs=None):
         """
         :param monitor:
             Quantity to be monitored.
@@ -38,9 +73,30 @@ class EarlyStoppingRange(keras.callbacks.Callback):
             Baseline value for the monitored quantity to reach.
             Training will stop if the model doesn't show improvement
             over the baseline.
+        :param smoothing:
+            One of {None, ema, window}. The monitored quantity is replaced by
+            its exponential moving average (ema) or the mean of the last
+            epochs (window). Default to None (no smoothing).
+        :param ema_alpha:
+            Weight of the current epoch in the moving average.
+        :param window:
+            Number of epochs of the rolling window.
+        :param curve_fit:
+            If true, the learning curve is fitted to the last curve_epochs
+            (smoothed) values, and the training stops when the projected gain
+            until the last epoch is less than min_delta. The patience rule is
+            still applied.
+        :param curve_epochs:
+            Number of epochs of the fit (at least 2).
+        :param max_epochs:
+            Epochs budget of the projection. Default to None (the epochs of
+            the training, as set by fit).
         """
         super(EarlyStoppingRange, self).__init__()
 
+        if smoothing not in (None, 'ema', 'window'):
+            raise ValueError('Unknown smoothing: {}. Choose ema or window'.
+                             format(smoothing))
         self.monitor = monitor
         self.baseline = baseline
         self.patience = patience
@@ -51,22 +107,18 @@ class EarlyStoppingRange(keras.callbacks.Callback):
         self.min_val_monitor = min_val_monitor
         self.max_val_monitor = max_val_monitor
         self.best = None
+        self.smoothing = smoothing
+        self.ema_alpha = ema_alpha
+        self.window = window
+        self.curve_fit = curve_fit
+        self.curve_epochs = max(curve_epochs, 2)
+        self.max_epochs = max_epochs
+        self.stop_reason = None
+        self._values = []
+        self._smoothed = []
+        self._epochs = []
 
-        if mode not in ['auto', 'min', 'max']:
-            warnings.warn('EarlyStopping mode %s is unknown, '
-                          'fallback to auto mode.' % mode,
-                          RuntimeWarning)
-            mode = 'auto'
-
-        if mode == 'min':
-            self.monitor_op = np.less
-        elif mode == 'max':
-            self.monitor_op = np.greater
-        else:
-            if 'acc' in self.monitor:
-                self.monitor_op = np.greater
-            else:
-                self.monitor_op = np.less
+        self.monitor_op = monitor_op(monitor, mode)
 
         if self.monitor_op == np.greater:
             self.min_delta *= 1
@@ -77,10 +129,69 @@ class EarlyStoppingRange(keras.callbacks.Callback):
         # Allow instances to be re-used
         self.wait = 0
         self.stopped_epoch = 0
+        self.stop_reason = None
+        self._values = []
+        self._smoothed = []
+        self._epochs = []
         if self.baseline is not None:
             self.best = self.baseline
         else:
-            self.best = np.Inf if self.monitor_op == np.less else -np.Inf
+            self.best = np.inf if self.monitor_op == np.less else -np.inf
+
+    def get_state(self) -> dict:
+        """Returns the state of the callback (saved by core.training.Trainer
+        in its checkpoints)"""
+        return {'wait': self.wait, 'stopped_epoch': self.stopped_epoch,
+                'best': None if self.best is None else float(self.best),
+                'stop_reason': self.stop_reason,
+                'values': [float(v) for v in self._values],
+                'smoothed': [float(v) for v in self._smoothed],
+                'epochs': [int(e) for e in self._epochs]}
+
+    def set_state(self, state: dict):
+        """Restores a state of get_state, after on_train_begin"""
+        self.wait = state['wait']
+        self.stopped_epoch = state['stopped_epoch']
+        self.best = state['best']
+        self.stop_reason = state['stop_reason']
+        self._values = list(state['values'])
+        self._smoothed = list(state['smoothed'])
+        self._epochs = list(state['epochs'])
+
+    def _smooth(self, current: float) -> float:
+        self._values.append(current)
+        if self.smoothing == 'ema' and len(self._smoothed) > 0:
+            return self.ema_alpha * current + \
+                (1 - self.ema_alpha) * self._smoothed[-1]
+        if self.smoothing == 'window':
+            return float(np.mean(self._values[-self.window:]))
+        return current
+
+    def projected_gain(self) -> float:
+        """
+        Fits the learning curve y = a + b / (epoch + 1) to the last epochs and
+        projects the gain of the monitored quantity at the last epoch.
+
+        :return: float
+            The projected improvement (positive if the quantity improves), or
+            None if there are not enough epochs or the budget is unknown.
+        """
+        max_epochs = self.max_epochs if self.max_epochs is not None else \
+            (self.params or {}).get('epochs')
+        if max_epochs is None or len(self._smoothed) < self.curve_epochs:
+            return None
+        epochs = np.asarray(self._epochs[-self.curve_epochs:], dtype=float)
+        x = 1. / (epochs + 1)
+        a, b = np.linalg.lstsq(np.stack([np.ones_like(x), x], axis=1),
+                               np.asarray(self._smoothed[-self.curve_epochs:]),
+                               rcond=None)[0]
+        gain = b * (1. / max_epochs - x[-1])
+        return float(gain if self.monitor_op == np.greater else -gain)
+
+    def _stop(self, epoch, reason: str):
+        self.stopped_epoch = epoch
+        self.stop_reason = reason
+        self.model.stop_training = True
 
     def on_epoch_end(self, epoch, logs=None):
         current = logs.get(self.monitor)
@@ -91,6 +202,9 @@ class EarlyStoppingRange(keras.callbacks.Callback):
                 (self.monitor, ','.join(list(logs.keys()))), RuntimeWarning
             )
             return
+        current = self._smooth(current)
+        self._smoothed.append(current)
+        self._epochs.append(epoch)
         if self.monitor_op(current - self.min_delta, self.best):
             self.best = current
             self.wait = 0
@@ -98,9 +212,19 @@ class EarlyStoppingRange(keras.callbacks.Callback):
             self.wait += 1
             if self.min_val_monitor < current < self.max_val_monitor and \
                     self.wait >= self.patience:
-                self.stopped_epoch = epoch
-                self.model.stop_training = True
+                self._stop(epoch, '{} did not improve for {} epochs (best '
+                                  '{:.4f})'.format(self.monitor, self.wait,
+                                                   self.best))
+                return
+        if self.curve_fit and self.min_val_monitor < current < \
+                self.max_val_monitor:
+            gain = self.projected_gain()
+            if gain is not None and gain < abs(self.min_delta):
+                self._stop(epoch, 'projected gain of {} until the last epoch '
+                                  'is {:.4f}, less than min_delta {}'.
+                           format(self.monitor, gain, abs(self.min_delta)))
 
     def on_train_end(self, logs=None):
-        if self.stopped_epoch > 0 and self.verbose > 0:
-            print('Epoch %05d: early stopping' % (self.stopped_epoch + 1))
+        if self.stop_reason is not None and self.verbose > 0:
+            print('Epoch %05d: early stopping: %s' % (self.stopped_epoch + 1,
+                                                      self.stop_reason))
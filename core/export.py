@@ -0,0 +1,344 @@
+"""
+This module implements the export of trained models to TensorFlow Lite, with
+post-training quantization, and a lightweight inference wrapper.
+
+The quantized model is smaller, loads faster and runs faster on CPU. The
+wrapper (TFLiteModel) has the predict methods of a Keras model, so it can
+replace it, e.g. in core.recognition.CommandRecognizer or evaluate.py. It
+uses the LiteRT interpreter (ai_edge_litert) or tflite_runtime if installed,
+and imports tensorflow only otherwise.
+
+Usage:
+    export_tflite(model, 'model.tflite', 'int8', calibration=generator)
+    lite = TFLiteModel('model.tflite')
+    print_comparison(compare(model, lite, test_generator))
+"""
+import os
+import time
+import numpy as np
+from core.networks import BaseModel
+
+QUANTIZATIONS = ('int8', 'float16', 'dynamic', None)
+
+
+def _keras_model(model):
+    return model.model if isinstance(model, BaseModel) else model
+
+
+def representative_dataset(generator, batches: int = 100):
+    """
+    Reads calibration samples from a Generator.
+
+    :param generator: util.dataloader.batching.sequence.Generator
+        The generator of the (pre processed) samples.
+    :param batches: int
+        Maximum number of batches read. Default to 100.
+
+    :return: callable
+        The representative dataset of the TFLite converter, yielding each
+        sample as a batch of one.
+    """
+    def samples():
+        for index in range(min(batches, len(generator))):
+            x, _ = generator[index]
+            for sample in np.asarray(x, dtype=np.float32):
+                yield [sample[None]]
+    return samples
+
+
+def export_tflite(model, path: str, quantization: str = 'int8',
+                  calibration=None, calibration_batches: int = 100) -> int:
+    """
+    Converts a model to TensorFlow Lite.
+
+    :param model: core.networks.BaseModel or keras.Model
+        The trained model.
+    :param path: str
+        Path of the .tflite file.
+    :param quantization: str
+        'int8' quantizes the weights and the activations (calibrated on the
+        calibration data), 'float16' stores the weights as float16, 'dynamic'
+        quantizes the weights to int8, and None keeps float32. The inputs and
+        outputs stay float32 in every case. Default to 'int8'.
+    :param calibration: util.dataloader.batching.sequence.Generator
+        Samples of the activation ranges. Required by 'int8'.
+    :param calibration_batches: int
+        Maximum number of calibration batches. Default to 100.
+
+    :return: int
+        The size of the file (bytes).
+    """
+    import tensorflow as tf
+    if quantization not in QUANTIZATIONS:
+        raise ValueError('Unknown quantization: {}. Choose one of {}'.
+                         format(quantization, QUANTIZATIONS))
+    converter = tf.lite.TFLiteConverter.from_keras_model(_keras_model(model))
+    if quantization is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == 'int8':
+        if calibration is None:
+            raise ValueError('The int8 quantization requires calibration data')
+        converter.representative_dataset = representative_dataset(
+            calibration, calibration_batches)
+        # Operations without an int8 kernel fall back to float
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+    content = converter.convert()
+    with open(path + '.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(path + '.tmp', path)
+    return len(content)
+
+
+def _interpreter(path: str, num_threads: int = None):
+    """Loads the lightest interpreter available"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=path, num_threads=num_threads)
+
+
+class TFLiteModel:
+    """A TensorFlow Lite model with the predict methods of a Keras model"""
+
+    def __init__(self, path: str, num_threads: int = None):
+        """
+        Loads a model.
+
+        :param path: str
+            Path of the .tflite file.
+        :param num_threads: int
+            Number of threads of the interpreter. Default to None (chosen by
+            the interpreter).
+        """
+        self.path = path
+        self._interpreter = _interpreter(path, num_threads)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = None
+
+    def _resize(self, batch_size: int):
+        if batch_size != self._batch_size:
+            self._interpreter.resize_tensor_input(
+                self._input['index'],
+                [batch_size] + list(self._input['shape'][1:]))
+            self._interpreter.allocate_tensors()
+            self._input = self._interpreter.get_input_details()[0]
+            self._output = self._interpreter.get_output_details()[0]
+            self._batch_size = batch_size
+
+    def predict_on_batch(self, x) -> np.ndarray:
+        """
+        Runs the model on a batch.
+
+        :param x: numpy.ndarray
+            The batch, in the input shape of the model.
+
+        :return: numpy.ndarray
+            The outputs.
+        """
+        x = np.asarray(x)
+        self._resize(len(x))
+        scale, zero_point = self._input['quantization']
+        if np.issubdtype(self._input['dtype'], np.integer) and scale > 0:
+            x = np.round(x / scale + zero_point)
+        self._interpreter.set_tensor(self._input['index'],
+                                     x.astype(self._input['dtype']))
+        self._interpreter.invoke()
+        y = self._interpreter.get_tensor(self._output['index'])
+        scale, zero_point = self._output['quantization']
+        if np.issubdtype(self._output['dtype'], np.integer) and scale > 0:
+            y = (y.astype(np.float32) - zero_point) * scale
+        return y
+
+    def predict(self, x, batch_size: int = 32, verbose=0) -> np.ndarray:
+        """Runs the model on samples, in batches"""
+        x = np.asarray(x)
+        return np.concatenate([self.predict_on_batch(x[i:i + batch_size])
+                               for i in range(0, len(x), batch_size)])
+
+    def __call__(self, x):
+        return self.predict_on_batch(x)
+
+    @property
+    def input_shape(self) -> tuple:
+        return (None,) + tuple(int(d) for d in self._input['shape'][1:])
+
+    @property
+    def output_shape(self) -> tuple:
+        return (None,) + tuple(int(d) for d in self._output['shape'][1:])
+
+    @property
+    def size(self) -> int:
+        """Returns the size of the model file (bytes)"""
+        return os.path.getsize(self.path)
+
+
+def load_model(model_path: str, num_threads: int = None):
+    """
+    Loads a saved model for inference.
+
+    :param model_path: str
+        Path of a .tflite model (loaded as a TFLiteModel, without keras) or a
+        Keras model (.keras).
+    :param num_threads: int
+        Number of threads of the TFLite interpreter.
+
+    :return:
+        The model, with predict_on_batch and input_shape.
+    """
+    if model_path.endswith('.tflite'):
+        return TFLiteModel(model_path, num_threads)
+    import keras
+    return keras.models.load_model(model_path, compile=False)
+
+
+def _latency(model, sample: np.ndarray, repeats: int) -> float:
+    """Median time (seconds) of a prediction of a single sample"""
+    model.predict_on_batch(sample)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model.predict_on_batch(sample)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def compare(model, lite_model, generator, batches: int = None,
+            repeats: int = 100) -> dict:
+    """
+    Compares the accuracy and the speed of a model and its TFLite export.
+
+    :param model: core.networks.BaseModel or keras.Model
+        The original model.
+    :param lite_model: TFLiteModel
+        The exported model.
+    :param generator: util.dataloader.batching.sequence.Generator
+        Test batches (labels are class indexes).
+    :param batches: int
+        Maximum number of batches. Default to None (all the batches, with the
+        last incomplete one, as in evaluate.py).
+    :param repeats: int
+        Number of single sample predictions timed. Default to 100.
+
+    :return: dict
+        For each model ('keras' and 'tflite'): the accuracy, the median
+        latency of a single sample, the samples per second on the batches and
+        the size (bytes, the Keras size is the float32 weights). The
+        agreement of the predicted classes and the maximum absolute
+        difference of the outputs.
+    """
+    model = _keras_model(model)
+    models = {'keras': model, 'tflite': lite_model}
+    correct = {'keras': 0, 'tflite': 0}
+    seconds = {'keras': 0., 'tflite': 0.}
+    agree = 0
+    max_diff = 0.
+    samples = 0
+    sample = None
+    # The last batch is incomplete, it is not counted by len(generator)
+    n = len(generator) + (generator.size % generator.batch_size > 0)
+    for index in range(n if batches is None else min(batches, n)):
+        x, y = generator[index]
+        outputs = dict()
+        for name, m in models.items():
+            start = time.perf_counter()
+            outputs[name] = np.asarray(m.predict_on_batch(x))
+            seconds[name] += time.perf_counter() - start
+            correct[name] += int((outputs[name].argmax(axis=-1) == y).sum())
+        agree += int((outputs['keras'].argmax(axis=-1) ==
+                      outputs['tflite'].argmax(axis=-1)).sum())
+        max_diff = max(max_diff, float(np.abs(outputs['keras'] -
+                                              outputs['tflite']).max()))
+        samples += len(x)
+        if sample is None:
+            sample = x[:1]
+    report = {'agreement': agree / max(samples, 1), 'max_abs_diff': max_diff,
+              'samples': samples}
+    sizes = {'keras': sum(int(np.prod(w.shape)) * 4 for w in model.weights),
+             'tflite': lite_model.size}
+    for name, m in models.items():
+        report[name] = {
+            'accuracy': correct[name] / max(samples, 1),
+            'latency': _latency(m, sample, repeats) if sample is not None
+            else 0.,
+            'samples_per_sec': samples / max(seconds[name], 1e-9),
+            'size': sizes[name]}
+    return report
+
+
+def print_comparison(report: dict):
+    """Prints the accuracy vs latency report of compare"""
+    print('{:>7} {:>9} {:>12} {:>10} {:>10}'.format(
+        'model', 'accuracy', 'latency(ms)', 'samples/s', 'size(KB)'))
+    for name in ('keras', 'tflite'):
+        r = report[name]
+        print('{:>7} {:>9.4f} {:>12.3f} {:>10.1f} {:>10.1f}'.format(
+            name, r['accuracy'], r['latency'] * 1000, r['samples_per_sec'],
+            r['size'] / 1024))
+    print('agreement: {:.4f} - max abs diff: {:.4f} ({} samples)'.format(
+        report['agreement'], report['max_abs_diff'], report['samples']))
+
+
+if __name__ == '__main__':
+    import argparse
+    # Command line arguments:
+    parser = argparse.ArgumentParser(description='Exports a model to '
+                                                 'TensorFlow Lite')
+    parser.add_argument('model', help='Saved model (.keras)')
+    parser.add_argument('output', help='Path of the .tflite file')
+    parser.add_argument('-q', '--quantization', help='Quantization. Default '
+                                                     'to int8.',
+                        choices=['int8', 'float16', 'dynamic', 'none'],
+                        default='int8')
+    parser.add_argument('--calibration', help='CSV manifest of the '
+                                              'calibration data (int8).')
+    parser.add_argument('--test', help='CSV manifest of the test data of the '
+                                       'comparison report.')
+    parser.add_argument('--classes', help='File with the classes of the '
+                                          'model, one per line. Default to '
+                                          'the classes of the test manifest.')
+    parser.add_argument('-b', '--batch_size', help='Batch size. Default to 32.',
+                        type=int, default=32)
+    parser.add_argument('--batches', help='Maximum number of batches of the '
+                                          'calibration and the comparison. '
+                                          'Default to 100.',
+                        type=int, default=100)
+    arguments = parser.parse_args()
+
+    import keras
+    from util.dataloader import loader_kw
+    from util.datasets.csv import CSVParser, encode_labels
+    from util.dataloader.batching.sequence import Generator
+    keras_model = keras.models.load_model(arguments.model, compile=False)
+    calibration_data = None
+    if arguments.calibration is not None:
+        calibration_csv = CSVParser(arguments.calibration, cache=True)
+        calibration_data = Generator(
+            calibration_csv.file_names, calibration_csv.label_ids,
+            arguments.batch_size, seed=0,
+            **loader_kw(calibration_csv.file_names[0]))
+    size = export_tflite(keras_model, arguments.output,
+                         None if arguments.quantization == 'none'
+                         else arguments.quantization, calibration_data,
+                         arguments.batches)
+    print('[INFO] {} saved ({:.1f} KB)'.format(arguments.output, size / 1024))
+    if arguments.test is not None:
+        test_csv = CSVParser(arguments.test, cache=True)
+        labels = test_csv.label_ids
+        if arguments.classes is not None:
+            with open(arguments.classes) as classes_file:
+                labels = encode_labels(test_csv.labels, np.asarray(
+                    classes_file.read().splitlines(), dtype=str))
+        test_data = Generator(test_csv.file_names, labels,
+                              arguments.batch_size, shuffle=False,
+                              **loader_kw(test_csv.file_names[0]))
+        print_comparison(compare(keras_model, TFLiteModel(arguments.output),
+                                 test_data, arguments.batches))
@@ -1,6 +1,9 @@
+import os
 from abc import ABC, abstractmethod
+import numpy as np
 from config import Config
 from core.networks.layers import Layer
+from core.networks import search
 
 
 class BaseModel(ABC):
@@ -25,8 +28,179 @@ class BaseModel(ABC):
 
 
 class HyperParameterSearchable:
+    """
+    Searches the hyperparameters of a BaseModel, training the trials in
+    parallel processes and stopping the unpromising ones early (asynchronous
+    successive halving, see core.networks.search).
+
+    Each trial is trained by core.training.Trainer, with its checkpoints in
+    the search directory, so a promoted trial continues from its last epoch.
+    The results are saved after each evaluation (search.json), and a search
+    run again with the same directory resumes from them.
+    """
+    def __init__(self, model_class, space: dict, data_fn: callable,
+                 search_dir: str, n_trials: int = 27, min_epochs: int = 1,
+                 max_epochs: int = 27, eta: int = 3, monitor: str = 'val_loss',
+                 mode: str = 'auto', workers: int = None, seed: int = 0,
+                 callbacks_fn: callable = None, verbose: int = 1):
+        """
+        :param model_class:
+            The BaseModel subclass, initialized with the hyperparameters of
+            each trial as kwargs. Its build_model must compile the model.
+        :param space: dict
+            The search space (see core.networks.search.sample_config).
+        :param data_fn: callable(config: dict, seed: int) -> (generator,
+                                                               validation)
+            Creates the training Generator (seeded by the seed) and the
+            validation batches of a trial.
+        :param search_dir: str
+            Directory of the results and the checkpoints of the trials.
+        :param n_trials: int
+            Number of sampled configurations.
+        :param min_epochs: int
+            Epochs of the first evaluation of every trial.
+        :param max_epochs: int
+            Epochs of the trials trained to the end.
+        :param eta: int
+            Reduction factor: 1 / eta of the trials of each rung is promoted.
+        :param monitor: str
+            Quantity comparing the trials, as in
+            core.callbacks.EarlyStoppingRange. Default to 'val_loss'.
+        :param mode: str
+            One of {auto, min, max} (see core.callbacks.EarlyStoppingRange).
+        :param workers: int
+            Number of processes. Default to None (number of cores).
+        :param seed: int
+            Seed of the sampling and the trials.
+        :param callbacks_fn: callable() -> list
+            Creates the Keras callbacks of a trial (e.g. an
+            EarlyStoppingRange). Optional.
+        :param verbose: int
+            Verbosity level.
+
+        Note: the processes are spawned, so the model_class, data_fn and
+        callbacks_fn must be importable (defined at the top level of a
+        module).
+        """
+        from core.callbacks.earlystoprange import monitor_op
+        self._model_class = model_class
+        self._space = space
+        self._data_fn = data_fn
+        self._search_dir = search_dir
+        self._n_trials = n_trials
+        self._halving = search.SuccessiveHalving(min_epochs, max_epochs, eta)
+        self._monitor = monitor
+        self._op = monitor_op(monitor, mode)
+        self._workers = workers or os.cpu_count() or 1
+        self._seed = seed
+        self._callbacks_fn = callbacks_fn
+        self._verbose = verbose
+        self._results_path = os.path.join(search_dir, 'search.json')
+        self._results = search.load_results(self._results_path) or \
+            {'seed': seed, 'rungs': self._halving.rungs, 'trials': {}}
+        if self._results['seed'] != seed or \
+                self._results['rungs'] != self._halving.rungs:
+            raise ValueError('The search in {} was run with another seed or '
+                             'rungs'.format(search_dir))
+
+    def _next_job(self, busy) -> tuple:
+        """Promotes a trial, or starts a new one"""
+        trials = self._results['trials']
+        job = self._halving.promotion(trials, self._op, busy)
+        if job is not None:
+            return job
+        for k in range(self._n_trials):
+            key = str(k)
+            if key in busy:
+                continue
+            # Trials interrupted before their first evaluation are restarted
+            if key not in trials:
+                trials[key] = {'config': search.sample_config(
+                    self._space, self._seed, k), 'metrics': [],
+                    'stopped': False, 'error': None}
+            if len(trials[key]['metrics']) == 0 and \
+                    trials[key]['error'] is None:
+                return key, 0
+        return None
+
+    def _submit(self, executor, key: str, rung: int):
+        trial = self._results['trials'][key]
+        if self._verbose > 0:
+            print('[INFO] trial {} -> {} epochs: {}'.format(
+                key, self._halving.rungs[rung], trial['config']))
+        return executor.submit(search.run_trial, self._model_class,
+                                trial['config'], self._data_fn,
+                                os.path.join(self._search_dir, 'trial_' + key),
+                                self._halving.rungs[rung], self._monitor,
+                                self._seed + int(key), self._callbacks_fn)
+
+    def run(self) -> dict:
+        """
+        Runs (or resumes) the search.
+
+        :return: dict
+            The best trial (see best).
+        """
+        import concurrent.futures
+        import multiprocessing
+        os.makedirs(self._search_dir, exist_ok=True)
+        threads = max((os.cpu_count() or 1) // self._workers, 1)
+        running = dict()
+        with concurrent.futures.ProcessPoolExecutor(
+                self._workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=search.init_worker, initargs=(threads,)) as \
+                executor:
+            while True:
+                while len(running) < self._workers:
+                    job = self._next_job({k for k, _ in running.values()})
+                    if job is None:
+                        break
+                    running[self._submit(executor, *job)] = job
+                if len(running) == 0:
+                    break
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for f in done:
+                    key, rung = running.pop(f)
+                    trial = self._results['trials'][key]
+                    if f.exception() is not None:
+                        trial['error'] = str(f.exception())
+                        trial['stopped'] = True
+                        print('[ERROR] trial {}: {}'.format(key,
+                                                            f.exception()))
+                    else:
+                        result = f.result()
+                        del trial['metrics'][rung:]
+                        trial['metrics'].append(result['metric'])
+                        trial['stopped'] = result['stopped']
+                        if self._verbose > 0:
+                            print('[INFO] trial {} at {} epochs: {} {:.4f}'.
+                                  format(key, self._halving.rungs[rung],
+                                         self._monitor, result['metric']))
+                    search.save_results(self._results_path, self._results)
+        return self.best
+
+    @property
+    def results(self) -> dict:
+        """Returns the trials: their configuration, the metric at each
+        evaluated rung, and whether they stopped or failed"""
+        return self._results['trials']
+
+    @property
+    def best(self) -> dict:
+        """
+        Returns the best trial of the highest evaluated rung: its number,
+        configuration, metric and epochs (None if no trial was evaluated).
+        """
+        evaluated = [(len(t['metrics']), t['metrics'][-1], k)
+                     for k, t in self.results.items() if len(t['metrics']) > 0]
+        if len(evaluated) == 0:
+            return None
+        rung = max(e[0] for e in evaluated)
+        top = [(m, k) for r, m, k in evaluated if r == rung]
+        metric, key = max(top) if self._op is np.greater else min(top)
+        return {'trial': key, 'config': self.results[key]['config'],
+                'metric': metric, 'epochs': self._halving.rungs[rung - 1]}
 
-    def run(self):
-        pass
 
 # Pensar immutables e experimentos
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""
+Helpers of the hyperparameter search (see
+core.networks.HyperParameterSearchable).
+
+The search space is a dict of hyperparameters: lists are choices, the
+distributions of this module are sampled, and other values are constants. The
+configuration of a trial only depends on the seed of the search and the trial
+number, so an interrupted search samples the same configurations again.
+
+>>> import numpy as np
+>>> space = {'units': [32, 64], 'rate': LogUniform(1e-4, 1e-2), 'layers': 2}
+>>> config = sample_config(space, 0, 3)
+>>> config == sample_config(space, 0, 3), config['layers']
+(True, 2)
+>>> SuccessiveHalving(1, 27, 3).rungs
+[1, 3, 9, 27]
+"""
+import json
+import os
+import numpy as np
+
+
+class Uniform:
+    """A hyperparameter uniformly distributed in [low, high)"""
+    def __init__(self, low: float, high: float):
+        self.low = low
+        self.high = high
+
+    def sample(self, rng: np.random.Generator):
+        return float(rng.uniform(self.low, self.high))
+
+
+class LogUniform(Uniform):
+    """A hyperparameter whose logarithm is uniformly distributed, e.g. the
+    learning rate"""
+    def sample(self, rng: np.random.Generator):
+        return float(np.exp(rng.uniform(np.log(self.low), np.log(self.high))))
+
+
+class IntUniform(Uniform):
+    """An integer hyperparameter uniformly distributed in [low, high]"""
+    def sample(self, rng: np.random.Generator):
+        return int(rng.integers(self.low, self.high, endpoint=True))
+
+
+def sample_config(space: dict, seed: int, trial: int) -> dict:
+    """
+    Samples the configuration of a trial.
+
+    :param space: dict
+        The search space.
+    :param seed: int
+        Seed of the search.
+    :param trial: int
+        Number of the trial.
+
+    :return: dict
+        The hyperparameters of the trial.
+    """
+    rng = np.random.default_rng([seed, trial])
+    config = dict()
+    for name in sorted(space):
+        value = space[name]
+        if isinstance(value, list):
+            value = value[rng.integers(len(value))]
+            value = value.item() if isinstance(value, np.generic) else value
+        elif isinstance(value, Uniform):
+            value = value.sample(rng)
+        config[name] = value
+    return config
+
+
+class SuccessiveHalving:
+    """
+    Asynchronous successive halving (ASHA): the trials are evaluated at rungs
+    of increasing number of epochs, and a trial is promoted to the next rung
+    if it is in the best 1 / eta of the trials evaluated at its rung. Trials
+    are promoted as soon as possible, no rung waits for all the trials.
+    """
+    def __init__(self, min_epochs: int = 1, max_epochs: int = 27,
+                 eta: int = 3):
+        """
+        :param min_epochs: int
+            Epochs of the first rung.
+        :param max_epochs: int
+            Epochs of the last rung.
+        :param eta: int
+            Reduction factor: each rung trains eta times more epochs than the
+            previous one and keeps 1 / eta of its trials.
+        """
+        if eta < 2:
+            raise ValueError('eta must be at least 2')
+        self.eta = eta
+        self.rungs = []
+        epochs = min_epochs
+        while epochs < max_epochs:
+            self.rungs.append(int(epochs))
+            epochs *= eta
+        self.rungs.append(int(max_epochs))
+
+    def promotion(self, trials: dict, op, busy=()):
+        """
+        Finds a trial to promote, from the highest rungs first.
+
+        :param trials: dict
+            The trials (see HyperParameterSearchable.results).
+        :param op: numpy.ufunc
+            numpy.greater if the metric is maximized, numpy.less otherwise.
+        :param busy:
+            Trials being trained (they are not promoted).
+
+        :return: tuple (str, int)
+            The trial and its next rung, or None.
+        """
+        for rung in reversed(range(len(self.rungs) - 1)):
+            done = [(t['metrics'][rung], k) for k, t in trials.items()
+                    if len(t['metrics']) > rung]
+            if len(done) < self.eta:
+                continue
+            # Sorted from the best metric
+            done.sort(key=lambda m: -m[0] if op is np.greater else m[0])
+            for metric, k in done[:len(done) // self.eta]:
+                trial = trials[k]
+                if len(trial['metrics']) == rung + 1 and k not in busy and \
+                        not trial['stopped']:
+                    return k, rung + 1
+        return None
+
+
+def run_trial(model_class, config: dict, data_fn: callable, trial_dir: str,
+              epochs: int, monitor: str, seed: int, callbacks_fn=None) -> dict:
+    """
+    Trains a trial up to a number of epochs, resuming from its checkpoint (run
+    by the worker processes).
+
+    :return: dict
+        The metric of the last epoch and whether the training stopped (e.g.
+        by an EarlyStoppingRange of the callbacks).
+    """
+    import keras
+    from core.training import Trainer
+    keras.utils.set_random_seed(seed)
+    model = model_class(**config)
+    generator, validation = data_fn(config, seed)
+    callbacks = callbacks_fn() if callbacks_fn is not None else None
+    trainer = Trainer(model, generator, trial_dir, validation=validation,
+                      callbacks=callbacks, verbose=0)
+    history = trainer.fit(epochs)
+    if len(history) == 0 or monitor not in history[-1]:
+        raise ValueError('The monitored quantity {} is not available'.
+                         format(monitor))
+    state = Trainer.checkpoint_state(trial_dir)
+    return {'metric': float(history[-1][monitor]),
+            'stopped': state is not None and state['stopped']}
+
+
+def init_worker(threads: int):
+    """Limits the threads of each worker process (before importing
+    tensorflow)"""
+    for name in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS'):
+        os.environ[name] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+
+
+def save_results(path: str, results: dict):
+    """Saves the results of a search atomically"""
+    with open(path + '.tmp', 'w') as f:
+        json.dump(results, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def load_results(path: str) -> dict:
+    """Loads the results of a search, or returns None"""
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
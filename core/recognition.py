@@ -0,0 +1,212 @@
+"""
+This module implements a streaming command recognizer.
+
+The audio chunks are written to a ring buffer (of samples, or of feature
+frames computed incrementally), and overlapping windows are scored by the
+model as soon as they are complete. The windows completed by a chunk are
+scored in a single batch, so a stream replayed faster than real time is
+processed in larger batches.
+
+Usage:
+    source = WavSource('commands.wav', speed=1.)
+    recognizer = CommandRecognizer(model, classes, source.rate,
+                                   features=StreamingFeatures(source.rate))
+    for detection in recognizer.run(source):
+        print(detection)
+    print(recognizer.stats)
+"""
+import collections
+import time
+import numpy as np
+from core.networks import BaseModel
+from util.audio.stream import RingBuffer
+
+Detection = collections.namedtuple('Detection', ['command', 'score', 'start',
+                                                 'end', 'latency'])
+
+
+class CommandRecognizer:
+    """Scores overlapping windows of an audio stream and detects commands"""
+
+    def __init__(self, model, classes: list, rate: int, window: float = 1.,
+                 hop: float = 0.25, features=None, threshold: float = 0.8,
+                 ignore=(), refractory: float = 1., latencies: int = 1000):
+        """
+        Initializes a recognizer.
+
+        :param model: core.networks.BaseModel or keras.Model
+            The classifier of the windows (any object with predict_on_batch
+            and input_shape, e.g. core.export.TFLiteModel). The windows are
+            reshaped to its input shape.
+        :param classes: list
+            The commands of the outputs of the model, in order.
+        :param rate: int
+            Sample rate of the stream.
+        :param window: float
+            Length of the windows (seconds). Default to 1.
+        :param hop: float
+            Time between windows (seconds). Default to 0.25.
+        :param features: util.audio.features.StreamingFeatures
+            Features of the windows. Default to None (the samples).
+        :param threshold: float
+            Minimum score of a detection. Default to 0.8.
+        :param ignore:
+            Classes never detected (e.g. silence and unknown words).
+        :param refractory: float
+            Minimum silence (seconds) between two detections of the same
+            command: a command is detected again only if no window scored it
+            for refractory seconds, so the overlapping windows of a command
+            are detected once. Default to 1.
+        :param latencies: int
+            Number of recent window latencies kept for the percentiles.
+        """
+        if isinstance(model, BaseModel):
+            model = model.model
+        self._model = model
+        self._classes = list(classes)
+        self._rate = rate
+        self._window = window
+        self._features = features
+        self._threshold = threshold
+        self._ignore = set(ignore)
+        self._refractory = refractory
+        if features is None:
+            self._item_length = 1
+            self._item_hop = 1
+            self._window_items = int(round(window * rate))
+        else:
+            if features.rate != rate:
+                raise ValueError('The rate of the features ({}) is not the '
+                                 'rate of the stream ({})'.
+                                 format(features.rate, rate))
+            self._item_length = features.frame_length
+            self._item_hop = features.hop_length
+            self._window_items = 1 + (int(round(window * rate)) -
+                                      features.frame_length) // \
+                features.hop_length
+        self._hop_items = max(int(round(hop * rate / self._item_hop)), 1)
+        self._item_shape = () if features is None else (features.n_mels,)
+        self._input_shape = tuple(getattr(model, 'input_shape', (None,))[1:])
+        self._latencies = collections.deque(maxlen=latencies)
+        self.reset()
+
+    def reset(self):
+        """Starts a new stream"""
+        if self._features is not None:
+            self._features.reset()
+        self._buffer = RingBuffer(self._window_items * 2 + self._hop_items,
+                                  self._item_shape)
+        self._next_end = self._window_items
+        self._last = dict()
+        self._latencies.clear()
+        self._counts = {'chunks': 0, 'windows': 0, 'detections': 0,
+                        'samples': 0, 'processing': 0., 'latency_sum': 0.,
+                        'latency_max': 0.}
+
+    def _end_time(self, end: int) -> float:
+        """Time (seconds) of the end of the item before the position end"""
+        return ((end - 1) * self._item_hop + self._item_length) / self._rate
+
+    def _score(self, windows: list) -> np.ndarray:
+        x = np.stack(windows)
+        if None not in self._input_shape and \
+                int(np.prod(self._input_shape)) == x[0].size:
+            x = x.reshape((len(x),) + self._input_shape)
+        return np.asarray(self._model.predict_on_batch(x))
+
+    def process(self, chunk: np.ndarray, arrival: float = None) -> list:
+        """
+        Processes the next chunk of the stream.
+
+        :param chunk: numpy.ndarray, shape=(samples,)
+            Mono samples in [-1, 1].
+        :param arrival: float
+            Time (time.perf_counter) the chunk was received. Default to None
+            (now).
+
+        :return: list
+            The Detection of the commands in the windows completed by the
+            chunk: the command, its score, the start and end time (seconds
+            from the start of the stream) and the latency (seconds from the
+            arrival of the chunk to the detection).
+        """
+        start = time.perf_counter()
+        arrival = start if arrival is None else arrival
+        items = chunk if self._features is None else \
+            self._features.push(chunk)
+        windows = []
+        ends = []
+        # Written in pieces, so no window is overwritten before it is read
+        piece = self._buffer.capacity - self._window_items
+        for i in range(0, len(items), piece):
+            self._buffer.write(items[i:i + piece])
+            while self._next_end <= self._buffer.total:
+                windows.append(self._buffer.window(self._next_end,
+                                                   self._window_items))
+                ends.append(self._end_time(self._next_end))
+                self._next_end += self._hop_items
+        detections = []
+        if len(windows) > 0:
+            scores = self._score(windows)
+            now = time.perf_counter()
+            latency = now - arrival
+            self._latencies.extend([latency] * len(windows))
+            self._counts['windows'] += len(windows)
+            self._counts['latency_sum'] += latency * len(windows)
+            self._counts['latency_max'] = max(self._counts['latency_max'],
+                                              latency)
+            best = scores.argmax(axis=1)
+            for end, k, score in zip(ends, best, scores[np.arange(len(best)),
+                                                        best]):
+                command = self._classes[k]
+                if score < self._threshold or command in self._ignore:
+                    continue
+                last = self._last.get(command, -np.inf)
+                self._last[command] = end
+                if end - last < self._refractory:
+                    continue
+                detections.append(Detection(command, float(score),
+                                            max(end - self._window, 0.), end,
+                                            latency))
+        self._counts['chunks'] += 1
+        self._counts['samples'] += len(chunk)
+        self._counts['detections'] += len(detections)
+        self._counts['processing'] += time.perf_counter() - start
+        return detections
+
+    def run(self, source):
+        """
+        Processes a stream.
+
+        :param source:
+            Iterable of tuples (chunk, arrival), e.g. util.audio.stream
+            WavSource or PCMSource.
+
+        :return: generator
+            Yields the detections.
+        """
+        for chunk, arrival in source:
+            for detection in self.process(chunk, arrival):
+                yield detection
+
+    @property
+    def stats(self) -> dict:
+        """
+        Returns the number of processed chunks, scored windows and detections,
+        the seconds of audio, the real time factor (processing time / audio
+        time) and the latency of the windows (seconds from the arrival of the
+        chunk completing a window to its score): mean and max of the stream,
+        p50 and p95 of the recent windows.
+        """
+        counts = self._counts
+        audio = counts['samples'] / self._rate
+        latencies = np.asarray(self._latencies)
+        p50, p95 = np.percentile(latencies, [50, 95]) if len(latencies) > 0 \
+            else (0., 0.)
+        return {'chunks': counts['chunks'], 'windows': counts['windows'],
+                'detections': counts['detections'], 'audio_seconds': audio,
+                'real_time_factor': counts['processing'] / max(audio, 1e-9),
+                'latency_mean': counts['latency_sum'] /
+                max(counts['windows'], 1),
+                'latency_p50': float(p50), 'latency_p95': float(p95),
+                'latency_max': counts['latency_max']}
@@ -0,0 +1,335 @@
+"""
+This module implements a resumable training loop for Keras models fed by a
+Generator (util.dataloader.batching.sequence).
+
+The checkpoints hold the weights, the full state of the optimizer (moments and
+iterations) and the position within the epoch. The order of the batches only
+depends on the seed of the generator and the epoch, so a resumed training sees
+the same batches it would have seen without the interruption, and restarts
+from the same weights and optimizer state. The random state of python and
+TensorFlow is not saved, so the randomness drawn during the training (e.g.
+dropout, or an augment_fn not using the seeded RNG of the Generator) differs
+after a resume. A checkpoint is saved every few minutes, at the end of each
+epoch and when the process receives a SIGTERM (e.g. preemption).
+
+The state of the callbacks implementing get_state and set_state (e.g.
+core.callbacks.EarlyStoppingRange) is saved in the checkpoints as well. The
+other callbacks start over when the training is resumed, so their decisions
+(e.g. the patience of keras.callbacks.EarlyStopping) are approximate.
+
+Usage:
+    generator = Generator(paths, labels, 32, loader_fn=numpy.load, seed=0)
+    trainer = Trainer(model, generator, 'checkpoints/', validation=val)
+    history = trainer.fit(epochs=100)
+"""
+import json
+import os
+import signal
+import threading
+import time
+import keras
+import numpy as np
+from core.networks import BaseModel
+from util.dataloader.batching.prefetch import Prefetcher
+
+_STATE_FILE = 'state.json'
+
+
+class Trainer:
+    """A training loop which can be stopped and resumed at any step"""
+
+    def __init__(self, model, generator, checkpoint_dir: str = None,
+                 validation=None, callbacks: list = None,
+                 best_path: str = None, monitor: str = 'val_loss',
+                 save_seconds: float = 600., save_steps: int = None,
+                 prefetch: int = 2, workers: int = 1, log_every: int = 100,
+                 verbose: int = 1):
+        """
+        Initializes a trainer.
+
+        :param model: core.networks.BaseModel or keras.Model
+            The compiled model to train. The model of a BaseModel is built if
+            it was not built yet.
+        :param generator: util.dataloader.batching.sequence.Generator
+            The generator of the training batches. Its seed must be the same
+            when a training is resumed.
+        :param checkpoint_dir: str
+            Directory of the checkpoints. If it holds a checkpoint, the
+            training is resumed from it. Default to None (no checkpoints).
+        :param validation: keras.utils.Sequence
+            Batches evaluated at the end of each epoch. Optional.
+        :param callbacks: list
+            Keras callbacks (e.g. core.callbacks.EarlyStoppingRange). Their
+            epoch methods are called, batch methods are not. The state of the
+            callbacks with get_state() and set_state(state) methods (JSON
+            serializable) is saved in the checkpoints.
+        :param best_path: str
+            Path (.keras) of the best model according to the monitor. Optional.
+        :param monitor: str
+            Quantity deciding the best model. Metrics containing 'acc' are
+            maximized, the others minimized. Default to 'val_loss'.
+        :param save_seconds: float
+            Minimum time between two checkpoints within an epoch. Default to
+            600 seconds.
+        :param save_steps: int
+            If provided, a checkpoint is saved every save_steps steps as well.
+        :param prefetch: int
+            Number of batches prepared in background (see Prefetcher). Default
+            to 2, 0 disables the prefetching.
+        :param workers: int
+            Number of threads preparing the batches. Default to 1.
+        :param log_every: int
+            Number of steps between progress messages. Default to 100.
+        :param verbose: int
+            Verbosity level.
+        """
+        if isinstance(model, BaseModel):
+            if model.model is None:
+                model.build_model()
+            model = model.model
+        if not model.compiled:
+            raise ValueError('The model must be compiled before training')
+        self._model = model
+        self._generator = generator
+        self._checkpoint_dir = checkpoint_dir
+        self._validation = validation
+        self._callback_list = list(callbacks or [])
+        self._callbacks = keras.callbacks.CallbackList(self._callback_list,
+                                                       model=model)
+        self._best_path = best_path
+        self._monitor = monitor
+        self._monitor_op = np.greater if 'acc' in monitor else np.less
+        self._save_seconds = save_seconds
+        self._save_steps = save_steps
+        self._prefetch = prefetch
+        self._workers = workers
+        self._log_every = log_every
+        self._verbose = verbose
+        self._interrupted = False
+        self._state = {'epoch': 0, 'step': 0, 'seed': generator.seed,
+                       'totals': {}, 'samples': 0, 'train_time': 0.,
+                       'best': None, 'stopped': False, 'history': [],
+                       'callbacks': [], 'checkpoint': None}
+
+    @staticmethod
+    def checkpoint_state(checkpoint_dir: str) -> dict:
+        """
+        Reads the state of the last checkpoint of a directory.
+
+        :param checkpoint_dir: str
+            Directory of the checkpoints.
+
+        :return: dict
+            The state (epoch, step, seed, history...) or None if there is no
+            checkpoint.
+        """
+        path = os.path.join(checkpoint_dir, _STATE_FILE)
+        if not os.path.isfile(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _restore(self):
+        """Loads the last checkpoint, if any"""
+        if self._checkpoint_dir is None:
+            return
+        state = self.checkpoint_state(self._checkpoint_dir)
+        if state is None:
+            return
+        if state['seed'] != self._generator.seed:
+            raise ValueError('The checkpoint was saved with the generator '
+                             'seed {}, got {}. The order of the batches would '
+                             'not be resumed'.format(state['seed'],
+                                                     self._generator.seed))
+        # The weights file holds the variables of the optimizer as well, which
+        # are only loaded once the optimizer is built
+        optimizer = self._model.optimizer
+        if not optimizer.built:
+            optimizer.build(self._model.trainable_variables)
+        self._model.load_weights(os.path.join(self._checkpoint_dir,
+                                              state['checkpoint']))
+        self._state = state
+        if self._verbose > 0:
+            print('[INFO] resuming from epoch {} step {}'.
+                  format(state['epoch'] + 1, state['step']))
+
+    def _save(self):
+        """Saves a checkpoint of the current state"""
+        if self._checkpoint_dir is None:
+            return
+        os.makedirs(self._checkpoint_dir, exist_ok=True)
+        previous = self._state['checkpoint']
+        name = 'checkpoint-{:04d}-{:06d}'.format(self._state['epoch'],
+                                                 self._state['step'])
+        path = os.path.join(self._checkpoint_dir, name)
+        self._model.save_weights(path + '.tmp.weights.h5')
+        os.replace(path + '.tmp.weights.h5', path + '.weights.h5')
+        name += '.weights.h5'
+        # The state is replaced last, so it always points to a whole checkpoint
+        self._state['checkpoint'] = name
+        self._state['callbacks'] = [
+            c.get_state() if hasattr(c, 'get_state') else None
+            for c in self._callback_list]
+        state_path = os.path.join(self._checkpoint_dir, _STATE_FILE)
+        with open(state_path + '.tmp', 'w') as f:
+            json.dump(self._state, f, indent=1)
+        os.replace(state_path + '.tmp', state_path)
+        if previous is not None and previous != name and \
+                os.path.isfile(os.path.join(self._checkpoint_dir, previous)):
+            os.remove(os.path.join(self._checkpoint_dir, previous))
+
+    def _save_best(self, logs: dict):
+        current = logs.get(self._monitor)
+        if self._best_path is None or current is None:
+            return
+        best = self._state['best']
+        if best is None or self._monitor_op(current, best):
+            self._state['best'] = current
+            tmp_path = os.path.splitext(self._best_path)[0] + '.tmp.keras'
+            self._model.save(tmp_path)
+            os.replace(tmp_path, self._best_path)
+            if self._verbose > 0:
+                print('[INFO] {} improved to {:.4f}, model saved to {}'.
+                      format(self._monitor, current, self._best_path))
+
+    def _interrupt(self, signum, frame):
+        self._interrupted = True
+
+    def _epoch_logs(self) -> dict:
+        """Averages of the metrics of the epoch and its throughput"""
+        samples = max(self._state['samples'], 1)
+        logs = {k: v / samples for k, v in self._state['totals'].items()}
+        train_time = max(self._state['train_time'], 1e-9)
+        logs['steps_per_sec'] = self._state['step'] / train_time
+        logs['samples_per_sec'] = self._state['samples'] / train_time
+        return logs
+
+    def _log_progress(self, steps: int, logs: dict, window: tuple):
+        samples, seconds = window
+        seconds = max(seconds, 1e-9)
+        print('[INFO] epoch {} step {}/{}: {} - {:.2f} steps/s - {:.1f} '
+              'samples/s'.format(self._state['epoch'] + 1, self._state['step'],
+                                 steps, ' - '.join('{} {:.4f}'.format(k, v)
+                                                   for k, v in logs.items()),
+                                 self._log_every / seconds, samples / seconds))
+
+    def _train_epoch(self, batches) -> bool:
+        """
+        Trains the model from the current step to the end of the epoch.
+
+        :return: bool
+            False if the training was interrupted.
+        """
+        state = self._state
+        steps = len(batches)
+        last_save = time.time()
+        window = [0, 0.]
+        while state['step'] < steps:
+            start = time.perf_counter()
+            x, y = batches[state['step']]
+            logs = self._model.train_on_batch(x, y, return_dict=True)
+            elapsed = time.perf_counter() - start
+            state['train_time'] += elapsed
+            state['samples'] += len(x)
+            state['step'] += 1
+            window[0] += len(x)
+            window[1] += elapsed
+            for k, v in logs.items():
+                state['totals'][k] = state['totals'].get(k, 0.) + \
+                    float(v) * len(x)
+            if self._verbose > 0 and state['step'] % self._log_every == 0:
+                self._log_progress(steps, logs, window)
+                window = [0, 0.]
+            if self._interrupted:
+                self._save()
+                return False
+            if state['step'] < steps and (
+                    time.time() - last_save >= self._save_seconds or
+                    self._save_steps and
+                    state['step'] % self._save_steps == 0):
+                self._save()
+                last_save = time.time()
+        return True
+
+    def fit(self, epochs: int) -> list:
+        """
+        Trains the model, resuming from the last checkpoint.
+
+        :param epochs: int
+            Total number of epochs (including the ones of the checkpoint).
+
+        :return: list
+            The logs of each epoch: the averages of the training metrics, the
+            validation metrics (val_*), steps_per_sec and samples_per_sec (of
+            the training steps, including the wait for the batches).
+        """
+        self._restore()
+        state = self._state
+        if state['stopped']:
+            print('[INFO] the training was stopped at epoch {}'.
+                  format(state['epoch']))
+            return state['history']
+        self._generator.set_epoch(state['epoch'])
+        batches = Prefetcher(self._generator, self._prefetch, self._workers) \
+            if self._prefetch > 0 else self._generator
+        handler = None
+        if threading.current_thread() is threading.main_thread():
+            handler = signal.signal(signal.SIGTERM, self._interrupt)
+        self._model.stop_training = False
+        # The budget of the training, e.g. for EarlyStoppingRange(curve_fit)
+        self._callbacks.set_params({'epochs': epochs, 'steps': len(batches),
+                                    'verbose': 0})
+        self._callbacks.on_train_begin()
+        # Restored after on_train_begin, which resets the callbacks
+        for callback, callback_state in zip(self._callback_list,
+                                            state.get('callbacks') or []):
+            if callback_state is not None and hasattr(callback, 'set_state'):
+                callback.set_state(callback_state)
+        try:
+            while state['epoch'] < epochs:
+                self._callbacks.on_epoch_begin(state['epoch'])
+                if not self._train_epoch(batches):
+                    print('[WARN] training interrupted at epoch {} step {}, '
+                          'checkpoint saved'.format(state['epoch'] + 1,
+                                                    state['step']))
+                    return state['history']
+                logs = self._epoch_logs()
+                if self._validation is not None:
+                    val_logs = self._model.evaluate(self._validation,
+                                                    verbose=0,
+                                                    return_dict=True)
+                    logs.update({'val_' + k: v for k, v in val_logs.items()})
+                if self._verbose > 0:
+                    print('[INFO] epoch {}/{}: {}'.format(
+                        state['epoch'] + 1, epochs,
+                        ' - '.join('{} {:.4f}'.format(k, v)
+                                   for k, v in logs.items())))
+                self._callbacks.on_epoch_end(state['epoch'], logs)
+                self._save_best(logs)
+                state['history'].append(logs)
+                batches.on_epoch_end()
+                state.update(epoch=state['epoch'] + 1, step=0, totals={},
+                             samples=0, train_time=0.,
+                             stopped=bool(self._model.stop_training))
+                self._save()
+                if state['stopped']:
+                    break
+            self._callbacks.on_train_end()
+        finally:
+            if handler is not None:
+                signal.signal(signal.SIGTERM, handler)
+            if isinstance(batches, Prefetcher):
+                if self._verbose > 0:
+                    print('[INFO] prefetching: {}'.format(batches.stats))
+                batches.close()
+        return state['history']
+
+    @property
+    def model(self):
+        """Returns the trained Keras model"""
+        return self._model
+
+    @property
+    def history(self) -> list:
+        """Returns the logs of the finished epochs"""
+        return self._state['history']
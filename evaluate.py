@@ -1,3 +1,256 @@
-"""Model evaluation script"""
+"""
+Model evaluation script
 
-# todo: implement evaluate script file
\ No newline at end of file
+The test data is streamed through a Generator, and each batch of predictions
+only updates a confusion matrix, so the memory does not grow with the size of
+the dataset. The results are cached by a hash of the model weights and of the
+manifest, so an unchanged pair is not evaluated again.
+
+Usage:
+    python evaluate.py models/best.keras test.csv \
+        --classes checkpoints/classes.txt
+"""
+import hashlib
+import json
+import os
+import time
+import zipfile
+import numpy as np
+from util.hashing import file_digest
+
+
+def update_confusion(matrix: np.ndarray, y_true, y_pred) -> np.ndarray:
+    """
+    Adds a batch of predictions to a confusion matrix (in place).
+
+    >>> m = np.zeros((3, 3), dtype=np.int64)
+    >>> update_confusion(m, [0, 1, 2, 2], [0, 2, 2, 2]).tolist()
+    [[1, 0, 0], [0, 0, 1], [0, 0, 2]]
+
+    :param matrix: numpy.ndarray, shape=(classes, classes)
+        The confusion matrix: true classes on the rows, predicted classes on
+        the columns.
+    :param y_true:
+        True classes (indexes) of the batch.
+    :param y_pred:
+        Predicted classes (indexes) of the batch.
+
+    :return: numpy.ndarray
+        The updated matrix.
+    """
+    n = len(matrix)
+    pairs = np.asarray(y_true, dtype=np.int64) * n + np.asarray(y_pred,
+                                                              dtype=np.int64)
+    matrix += np.bincount(pairs, minlength=n * n).reshape(n, n)
+    return matrix
+
+
+def class_metrics(matrix: np.ndarray) -> dict:
+    """
+    Computes the metrics of a confusion matrix.
+
+    :param matrix: numpy.ndarray, shape=(classes, classes)
+        The confusion matrix (see update_confusion).
+
+    :return: dict
+        The precision, recall, f1 and support of each class (lists), the
+        accuracy and the macro averages of the precision, recall and f1.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    tp = np.diag(matrix)
+    support = matrix.sum(axis=1)
+    predicted = matrix.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, tp / predicted, 0.)
+        recall = np.where(support > 0, tp / support, 0.)
+        f1 = np.where(precision + recall > 0,
+                      2 * precision * recall / (precision + recall), 0.)
+    return {'precision': precision.tolist(), 'recall': recall.tolist(),
+            'f1': f1.tolist(), 'support': support.astype(np.int64).tolist(),
+            'accuracy': float(tp.sum() / max(matrix.sum(), 1)),
+            'macro_precision': float(precision.mean()),
+            'macro_recall': float(recall.mean()),
+            'macro_f1': float(f1.mean())}
+
+
+def weights_digest(model_path: str) -> str:
+    """
+    Hashes the weights of a saved model without loading it.
+
+    :param model_path: str
+        Path of a .keras model (only its weights file is hashed) or of a
+        weights file.
+
+    :return: str
+        The hexadecimal digest.
+    """
+    if zipfile.is_zipfile(model_path):
+        digest = hashlib.blake2b(digest_size=16)
+        with zipfile.ZipFile(model_path) as archive:
+            for name in sorted(archive.namelist()):
+                # The metadata holds the saving date
+                if name != 'metadata.json':
+                    digest.update(name.encode())
+                    with archive.open(name) as member:
+                        for chunk in iter(lambda: member.read(1 << 20), b''):
+                            digest.update(chunk)
+        return digest.hexdigest()
+    return file_digest(model_path)
+
+
+def cache_key(model_path: str, csv_path: str, classes) -> str:
+    """Key of the results of a model on a dataset"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (weights_digest(model_path), file_digest(csv_path),
+                 '\n'.join(classes)):
+        digest.update(part.encode())
+    return digest.hexdigest()
+
+
+def evaluate(model_path: str, csv_path: str, classes: list = None,
+             batch_size: int = 32, prefetch: int = 2, workers: int = 1,
+             cache_dir: str = 'logs/evaluations', verbose: int = 1) -> dict:
+    """
+    Evaluates a classification model on a dataset.
+
+    :param model_path: str
+        Path of the saved model (.keras or .tflite).
+    :param csv_path: str
+        CSV manifest of the test data (see util.datasets.csv.CSVParser).
+    :param classes: list
+        The classes of the outputs of the model, in order. Default to None
+        (the sorted classes of the manifest).
+    :param batch_size: int
+        Batch size of the predictions.
+    :param prefetch: int
+        Number of batches prepared in background. 0 disables the prefetching.
+    :param workers: int
+        Number of threads preparing the batches.
+    :param cache_dir: str
+        Directory of the cached results. None disables the cache.
+    :param verbose: int
+        Verbosity level.
+
+    :return: dict
+        The metrics (see class_metrics), the classes, the confusion matrix,
+        the number of samples and the samples evaluated per second.
+    """
+    from util.dataloader import loader_kw
+    from util.datasets.csv import CSVParser, encode_labels
+    csv = CSVParser(csv_path, cache=True)
+    if classes is None:
+        classes = csv.classes.tolist()
+        if verbose > 0:
+            print('[WARN] the classes of the model are not provided, using the '
+                  'classes of the manifest')
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = os.path.join(cache_dir, cache_key(model_path, csv_path,
+                                                       classes) + '.json')
+        if os.path.isfile(cache_path):
+            if verbose > 0:
+                print('[INFO] cached results', cache_path)
+            with open(cache_path) as f:
+                return json.load(f)
+
+    from core.export import load_model
+    from util.dataloader.batching.prefetch import Prefetcher
+    from util.dataloader.batching.sequence import Generator
+    model = load_model(model_path)
+    labels = encode_labels(csv.labels, np.asarray(classes, dtype=str)) if \
+        list(classes) != csv.classes.tolist() else csv.label_ids
+    generator = Generator(csv.file_names, labels, batch_size, shuffle=False,
+                          **loader_kw(csv.file_names[0]))
+    batches = Prefetcher(generator, prefetch, workers) if prefetch > 0 else \
+        generator
+    matrix = np.zeros((len(classes), len(classes)), dtype=np.int64)
+    start = time.perf_counter()
+    try:
+        # The last batch is incomplete, it is read from the generator
+        for index in range(len(generator) + (len(labels) % batch_size > 0)):
+            x, y = batches[index] if index < len(batches) else \
+                generator[index]
+            y_pred = np.asarray(model.predict_on_batch(x)).argmax(axis=-1)
+            update_confusion(matrix, y, y_pred)
+            if verbose > 1 and (index + 1) % 100 == 0:
+                print('[INFO] {} samples evaluated'.format(matrix.sum()))
+    finally:
+        if isinstance(batches, Prefetcher):
+            batches.close()
+    seconds = time.perf_counter() - start
+    results = class_metrics(matrix)
+    results.update(classes=list(classes), confusion=matrix.tolist(),
+                   samples=int(matrix.sum()),
+                   samples_per_sec=float(matrix.sum() / max(seconds, 1e-9)))
+    if cache_path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path + '.tmp', 'w') as f:
+            json.dump(results, f)
+        os.replace(cache_path + '.tmp', cache_path)
+    return results
+
+
+def print_report(results: dict):
+    """Prints the metrics of each class and the averages"""
+    width = max([len(c) for c in results['classes']] + [9])
+    print('{:>{w}} {:>9} {:>9} {:>9} {:>9}'.format(
+        'class', 'precision', 'recall', 'f1', 'support', w=width))
+    for i, c in enumerate(results['classes']):
+        print('{:>{w}} {:>9.4f} {:>9.4f} {:>9.4f} {:>9d}'.format(
+            c, results['precision'][i], results['recall'][i],
+            results['f1'][i], results['support'][i], w=width))
+    print('{:>{w}} {:>9.4f} {:>9.4f} {:>9.4f} {:>9d}'.format(
+        'macro', results['macro_precision'], results['macro_recall'],
+        results['macro_f1'], results['samples'], w=width))
+    print('accuracy: {:.4f} ({:.1f} samples/s)'.format(
+        results['accuracy'], results['samples_per_sec']))
+
+
+if __name__ == '__main__':
+    import argparse
+    # Command line arguments:
+    parser = argparse.ArgumentParser(description='Evaluates a model on a test '
+                                                 'dataset')
+    parser.add_argument('model', help='Saved model (.keras or .tflite)')
+    parser.add_argument('data', help='CSV manifest of the test data')
+    parser.add_argument('--classes', help='File with the classes of the '
+                                          'model, one per line (e.g. the '
+                                          'classes.txt of the checkpoints of '
+                                          'train.py). Default to the classes '
+                                          'of the manifest.')
+    parser.add_argument('-b', '--batch_size', help='Batch size. Default to 32.',
+                        type=int, default=32)
+    parser.add_argument('-w', '--workers', help='Number of threads preparing '
+                                                'the batches. Default to 1.',
+                        type=int, default=1)
+    parser.add_argument('--prefetch', help='Number of batches prepared in '
+                                           'background. Default to 2.',
+                        type=int, default=2)
+    parser.add_argument('--cache_dir', help='Directory of the cached results. '
+                                            'Default to logs/evaluations.',
+                        default='logs/evaluations')
+    parser.add_argument('--no_cache', help='Disables the cache of the '
+                                           'results.',
+                        action='store_true')
+    parser.add_argument('-o', '--output', help='Saves the results to a JSON '
+                                               'file.')
+    parser.add_argument('-v', '--verbose', help='Verbosity level.', type=int,
+                        default=1)
+    arguments = parser.parse_args()
+
+    model_classes = None
+    if arguments.classes is not None:
+        with open(arguments.classes) as classes_file:
+            model_classes = classes_file.read().splitlines()
+    evaluation = evaluate(arguments.model, arguments.data,
+                          classes=model_classes,
+                          batch_size=arguments.batch_size,
+                          prefetch=arguments.prefetch,
+                          workers=arguments.workers,
+                          cache_dir=None if arguments.no_cache else
+                          arguments.cache_dir,
+                          verbose=arguments.verbose)
+    print_report(evaluation)
+    if arguments.output is not None:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(evaluation, output_file, indent=1)
@@ -1,4 +1,18 @@
 """
+Command recognition of an audio stream.
+
+The audio is read from a WAV file (replayed in real time or faster), from the
+standard input or from a TCP socket (raw PCM), and the detected commands are
+printed with their time in the stream and their latency.
+
+The model scores log mel spectrograms (util.audio.features): it must be
+trained on the features saved by script_create_dataset.py --features, with the
+same sample rate and feature options (--n_mels, --frame and --frame_hop).
+
+Usage:
+    python main.py model.keras --classes classes.txt --wav commands.wav
+    arecord -f S16_LE -r 16000 -c 1 -t raw | python main.py model.keras \\
+        --classes classes.txt --stdin --rate 16000
 """
 
 from core import *
@@ -6,13 +20,159 @@ from preprocessing import *
 from util import *
 
 
-def main(*args, **kwargs):
+def load_model(model_path: str):
+    """Loads a saved Keras model (.keras) or TFLite model (.tflite)"""
+    from core.export import load_model as load_saved_model
+    return load_saved_model(model_path)
+
+
+def main(model, classes: list, source, features: bool = True,
+         feature_kw: dict = None, verbose: int = 1, **recognizer_kw) -> dict:
     """
-    :param args:
-    :param kwargs:
-    :return:
+    Recognizes the commands of a stream.
+
+    :param model:
+        The model (see core.recognition.CommandRecognizer).
+    :param classes: list
+        The commands of the outputs of the model, in order.
+    :param source:
+        The stream: util.audio.stream.WavSource or PCMSource.
+    :param features: bool
+        If true, the windows are log mel spectrograms, the samples otherwise.
+    :param feature_kw: dict
+        Kwargs of util.audio.features.StreamingFeatures (frame_length,
+        hop_length and n_mels), the same as the features of the training
+        data. Default to None (the defaults of StreamingFeatures).
+    :param verbose: int
+        Verbosity level.
+    :param recognizer_kw:
+        Additional kwargs are passed on to the CommandRecognizer.
+
+    :return: dict
+        The stats of the recognizer.
     """
+    from core.recognition import CommandRecognizer
+    from util.audio.features import StreamingFeatures
+    recognizer = CommandRecognizer(
+        model, classes, source.rate,
+        features=StreamingFeatures(source.rate, **(feature_kw or {}))
+        if features else None,
+        **recognizer_kw)
+    try:
+        for detection in recognizer.run(source):
+            print('[INFO] {:.2f}s: {} ({:.2f}) - latency {:.1f} ms'.format(
+                detection.end, detection.command, detection.score,
+                detection.latency * 1000))
+    except KeyboardInterrupt:
+        pass
+    stats = recognizer.stats
+    if verbose > 0:
+        print('[INFO] {:.1f} seconds of audio, {} windows, {} detections, '
+              'real time factor {:.3f}'.format(stats['audio_seconds'],
+                                               stats['windows'],
+                                               stats['detections'],
+                                               stats['real_time_factor']))
+        print('[INFO] latency: mean {:.1f} ms - p50 {:.1f} ms - p95 {:.1f} ms '
+              '- max {:.1f} ms'.format(stats['latency_mean'] * 1000,
+                                       stats['latency_p50'] * 1000,
+                                       stats['latency_p95'] * 1000,
+                                       stats['latency_max'] * 1000))
+    return stats
 
 
 if __name__ == '__main__':
-    pass
+    import argparse
+    import sys
+    from util.audio.stream import PCMSource, WavSource
+    # Command line arguments:
+    parser = argparse.ArgumentParser(description='Recognizes commands in an '
+                                                 'audio stream')
+    parser.add_argument('model', help='Saved model (.keras or .tflite, see '
+                                      'core/export.py)')
+    parser.add_argument('--classes', help='File with the commands of the '
+                                          'model, one per line (e.g. the '
+                                          'classes.txt of the checkpoints of '
+                                          'train.py)', required=True)
+    sources = parser.add_mutually_exclusive_group(required=True)
+    sources.add_argument('--wav', help='Replays an audio file')
+    sources.add_argument('--stdin', help='Reads raw PCM from the standard '
+                                         'input', action='store_true')
+    sources.add_argument('--socket', help='Reads raw PCM from a TCP server '
+                                          '(host:port)')
+    parser.add_argument('--speed', help='Replay speed of the audio file: 1 is '
+                                        'real time, 0 as fast as possible. '
+                                        'Default to 1.',
+                        type=float, default=1.)
+    parser.add_argument('-r', '--rate', help='Sample rate of the raw PCM. '
+                                             'Default to 16000.',
+                        type=int, default=16000)
+    parser.add_argument('--format', help='Sample format of the raw PCM. '
+                                         'Default to int16.',
+                        choices=['int16', 'int32', 'float32'], default='int16')
+    parser.add_argument('--channels', help='Channels of the raw PCM. Default '
+                                           'to 1.', type=int, default=1)
+    parser.add_argument('--chunk', help='Samples of each chunk. Default to '
+                                        '100 ms.', type=int)
+    parser.add_argument('--window', help='Length of the scored windows '
+                                         '(seconds). Default to 1.',
+                        type=float, default=1.)
+    parser.add_argument('--hop', help='Time between windows (seconds). '
+                                      'Default to 0.25.',
+                        type=float, default=0.25)
+    parser.add_argument('-t', '--threshold', help='Minimum score of a '
+                                                  'detection. Default to 0.8.',
+                        type=float, default=0.8)
+    parser.add_argument('--ignore', help='Classes never detected (e.g. '
+                                         'silence).', nargs='*', default=[])
+    parser.add_argument('--waveform', help='Scores the samples of the '
+                                           'windows instead of log mel '
+                                           'spectrograms.',
+                        action='store_true')
+    parser.add_argument('--n_mels', help='Number of mel bands. Default to 40. '
+                                         'The feature options must be the '
+                                         'ones of the training data (see '
+                                         'script_create_dataset.py '
+                                         '--features).',
+                        type=int, default=40)
+    parser.add_argument('--frame', help='Length of the feature frames '
+                                        '(seconds). Default to 0.025.',
+                        type=float, default=0.025)
+    parser.add_argument('--frame_hop', help='Time between feature frames '
+                                            '(seconds). Default to 0.01.',
+                        type=float, default=0.010)
+    parser.add_argument('-v', '--verbose', help='Verbosity level.', type=int,
+                        default=1)
+    arguments = parser.parse_args()
+
+    with open(arguments.classes) as classes_file:
+        model_classes = classes_file.read().splitlines()
+    if arguments.wav is not None:
+        import soundfile as sf
+        rate = sf.info(arguments.wav).samplerate
+        audio_source = WavSource(arguments.wav, arguments.chunk or rate // 10,
+                                 arguments.speed if arguments.speed > 0
+                                 else None)
+    else:
+        pcm_kw = {'chunk_size': arguments.chunk or arguments.rate // 10,
+                  'dtype': arguments.format, 'channels': arguments.channels}
+        if arguments.stdin:
+            audio_source = PCMSource(sys.stdin.buffer, arguments.rate,
+                                     **pcm_kw)
+        else:
+            host, port = arguments.socket.rsplit(':', 1)
+            audio_source = PCMSource.from_socket(host, int(port),
+                                                 arguments.rate, **pcm_kw)
+    try:
+        main(load_model(arguments.model), model_classes, audio_source,
+             features=not arguments.waveform,
+             feature_kw={'frame_length': int(round(arguments.frame *
+                                                   audio_source.rate)),
+                         'hop_length': int(round(arguments.frame_hop *
+                                                 audio_source.rate)),
+                         'n_mels': arguments.n_mels},
+             verbose=arguments.verbose, window=arguments.window,
+             hop=arguments.hop, threshold=arguments.threshold,
+             ignore=arguments.ignore)
+    finally:
+        if isinstance(audio_source, PCMSource):
+            audio_source.close()
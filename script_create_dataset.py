@@ -7,7 +7,11 @@ Dependencies:
     variable. More details in http://sox.sourceforge.net
 
 Note:
-    Duplicate files are being ignored.
+    Duplicate files are being ignored. Files with the same content under
+    different names can be removed before processing (--dedup).
+
+    The log mel spectrograms scored by main.py can be saved next to the
+    processed files (--features), with the same parameters as main.py.
 """
 import concurrent.futures
 import os
@@ -15,6 +19,9 @@ import time
 import glob
 import shutil
 import util.syscommand as syscommand
+import util.audio.vad as vad
+import util.audio.features as features
+import util.audio.fingerprint as fingerprint
 import numpy as np
 from tqdm import tqdm
 from pydub import AudioSegment
@@ -177,7 +184,8 @@ def pre_process(file_path: str, output_dir: str, name: str = None,
                 remix_channels: bool = False, speed_changing: float = None,
                 robot: bool = False, rate: int = None, phone: bool = False,
                 max_instances: int = None, low_pass_filter: float = None,
-                ignore_length: bool = False, verbose_level=0, **kwargs):
+                ignore_length: bool = False, pad_short: bool = False,
+                verbose_level=0, **kwargs):
     """
     Pre process a file. Use this function to handle raw datasets.
 
@@ -225,6 +233,9 @@ def pre_process(file_path: str, output_dir: str, name: str = None,
     :param ignore_length: bool
         If true, will pass --ignore_length to each audio, forcing the length
         checking. Can slow down the process.
+    :param pad_short: bool
+        If true, an audio shorter than the trim interval is not skipped: the
+        trimmed audio is padded with silence. Default to False.
     :param kwargs: dict
         Additional kwargs to pass on to the processing functions.
     :param verbose_level: int
@@ -259,7 +270,11 @@ def pre_process(file_path: str, output_dir: str, name: str = None,
 
         expected_length = trim_interval[1] - trim_interval[0] if trim_interval \
                           is not None else min_length
-        if audio_length < expected_length and ignore_length:
+        if audio_length < expected_length and pad_short and \
+                trim_interval is not None:
+            # The trimmed audio is padded with silence
+            pass
+        elif audio_length < expected_length and ignore_length:
             # Force the audio length checking (can be slow)
             if str(verbose_level) == '2':
                 print('[WARN] forcing audio length checking of audio {file}'
@@ -322,7 +337,7 @@ def pre_process(file_path: str, output_dir: str, name: str = None,
                 + '_'
         file_path = trim(file_path, output_dir, name, trim_interval[0],
                          trim_interval[1] - trim_interval[0],
-                         verbose_level)
+                         verbose_level, pad=pad_short)
         temp_files.add(file_path)
     if remix_channels:
         name += '_remix_'
@@ -364,6 +379,12 @@ def pre_process(file_path: str, output_dir: str, name: str = None,
         name += '_trs_' + str(trim_silence_threshold) + '_'
         file_path = trim_silence_audio(trim_silence_threshold, file_path,
                                        output_dir, name, verbose_level)
+        if file_path is None:
+            # No speech: nothing is written
+            for fp in temp_files:
+                if os.path.isfile(fp):
+                    os.remove(fp)
+            return
         temp_files.add(file_path)
     if noise_path is not None:
         name += '_noise_' + \
@@ -379,7 +400,7 @@ def pre_process(file_path: str, output_dir: str, name: str = None,
                 + '_'
         file_path = trim(file_path, output_dir, name, trim_interval[0],
                          trim_interval[1] - trim_interval[0],
-                         verbose_level)
+                         verbose_level, pad=pad_short)
         temp_files.add(file_path)
     if len(temp_files) == 0 and int(verbose_level) > 1:
         print('[WARN] no pre processing was performed on file', file_path)
@@ -459,12 +480,16 @@ def norm(file_path: str, output_dir: str, file_name: str, target_value: float,
 
 
 def trim_silence_audio(trim_threshold: float, file_path, output_dir, file_name,
-                       verbose_level: int= 0 ) -> str:
+                       verbose_level: int = 0, max_silence: float = 2.) -> str:
     """
     Removes silence.
 
+    Speech is detected with a frame energy VAD (see util.audio.vad). Leading
+    and trailing silence are removed and long silence periods are shortened.
+
     :param trim_threshold: float
-        Below-periods duration threshold.
+        Volume threshold in percent (anything less than this volume is
+        considered silence).
     :param file_path: str
         Path to the file.
     :param output_dir: str
@@ -472,36 +497,27 @@ def trim_silence_audio(trim_threshold: float, file_path, output_dir, file_name,
     :param file_name: str
         Name of the output file.
     :param verbose_level: int
-        Verbosity level. 2 prints the command. This argument as passed on as
-        a command line option in sox arguments.
+        Verbosity level. 2 prints the detected speech segments.
+    :param max_silence: float
+        Silence periods longer than this value (seconds) are shortened to it.
 
     :return: str
-        Path to the generated file.
+        Path to the generated file, or None if no speech was detected (no file
+        is written).
     """
-    #  -l 1.0 0.1 1% -1 2.0 1%
     temp_file_path = output_dir + os.sep + file_name + '.wav'
-    # todo: add silence threshold argument, in this case, it is set as 1.0
-    cmd = 'sox -V{vlevel} {input} {output} '\
-          'silence {below_periods_duration} {above_periods} {duration} '\
-          '{duration_threshold}% {below_period} {ignore_period} '\
-          '{below_period_threshold}%'\
-          .format(vlevel=str(verbose_level),
-                  input=file_path,
-                  output=temp_file_path,
-                  below_periods_duration='-l',  #Remove silence or short silence
-                  # parameter. l means for not remove long periods of silence
-                  above_periods='1.0',  # Start removing silence from the
-                  # beginning
-                  duration='0.1',  # Minimum duration of silence to remove
-                  duration_threshold=trim_threshold,  # Trim silence
-                  # (anything less than 1% volume)
-                  below_period='-1',  # Remove silence until the end of the file
-                  ignore_period='2.0',  # Ignore small moments of silence
-                  below_period_threshold=trim_threshold
-                  )
+    data, rate = sf.read(file_path, always_2d=True)
+    segments = vad.speech_segments(data.mean(axis=1), rate,
+                                   threshold=trim_threshold)
     if str(verbose_level) == '2':
-        print(cmd)
-    os.system(cmd)
+        print('[INFO] speech segments of {file}: {segments}'.
+              format(file=file_path, segments=segments.round(2).tolist()))
+    if len(segments) == 0:
+        print('[WARN] no speech detected in {file} (ignoring)'.
+              format(file=file_path))
+        return None
+    sf.write(temp_file_path, vad.keep_speech(data, rate, segments, max_silence),
+             rate, subtype=sf.info(file_path).subtype)
     return temp_file_path
 
 
@@ -803,7 +819,7 @@ def robot_voice(file_path: str, output_dir: str, file_name: str,
 
 
 def trim(file_path: str, output_dir: str, file_name: str, position: float,
-         duration: float, verbose_level: int = 0):
+         duration: float, verbose_level: int = 0, pad: bool = False):
     """
     Trims an audio file using sox software.
 
@@ -820,8 +836,22 @@ def trim(file_path: str, output_dir: str, file_name: str, position: float,
     :param verbose_level: int
         Verbosity level. 2 prints the command. This argument as passed on as
         a command line option in sox arguments.
+    :param pad: bool
+        If true, the parts of the interval out of the audio (a negative
+        position, or an end after the audio) are filled with silence, so the
+        output always lasts duration seconds.
     """
     temp_file_path = output_dir + os.sep + file_name + '.wav'
+    if pad:
+        data, rate = sf.read(file_path, always_2d=True)
+        out = np.zeros((int(round(duration * rate)), data.shape[1]),
+                       dtype=data.dtype)
+        offset = int(round(position * rate))
+        data = data[max(offset, 0):max(offset + len(out), 0)]
+        out[max(-offset, 0):max(-offset, 0) + len(data)] = \
+            data[:len(out) - max(-offset, 0)]
+        sf.write(temp_file_path, out, rate, subtype=sf.info(file_path).subtype)
+        return temp_file_path
     cmd = 'sox -V{vlevel} {input} {output} trim {position} {duration}'.\
           format(vlevel=verbose_level,
                  input=file_path,
@@ -869,13 +899,188 @@ def process_augmentation(dataset_dir: str, file_list: list,
             pass
 
 
+def detect_speech(file_list: list, num_workers: int = None,
+                  verbose_level: int = 0, **vad_kw) -> dict:
+    """
+    Detects the speech segments of each file (once per file).
+
+    :param file_list: list
+        List of files to process.
+    :param num_workers: int
+        Number of workers for multiprocessing.
+    :param verbose_level: int
+        Verbosity level.
+    :param vad_kw: dict
+        Additional kwargs are passed on to util.audio.vad.speech_segments.
+
+    :return: dict
+        A dict with the file paths as keys and tuples (segments, duration) as
+        values. Files that could not be read are not included.
+    """
+    print('[INFO] detecting speech segments')
+    speech = dict()
+    if num_workers == 1:
+        for file_path in (tqdm(file_list) if int(verbose_level) < 2 else
+                          file_list):
+            try:
+                speech[file_path] = vad.detect_speech(file_path, **vad_kw)
+            except RuntimeError as error:
+                if int(verbose_level) > 1:
+                    print('[ERROR] detecting speech of {file}. {error}'.
+                          format(file=file_path, error=error))
+        return speech
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as \
+            executor:
+        futures = {executor.submit(vad.detect_speech, file_path, **vad_kw):
+                   file_path for file_path in file_list}
+        kw = {
+            'total': len(futures),
+            'unit': 'files',
+            'unit_scale': True,
+            'leave': True
+        }
+        for f in tqdm(concurrent.futures.as_completed(futures), **kw):
+            if f.exception() is None:
+                speech[futures[f]] = f.result()
+            elif int(verbose_level) > 1:
+                print('[ERROR] detecting speech of {file}. {error}'.
+                      format(file=futures[f], error=f.exception()))
+    return speech
+
+
+def remove_duplicates(file_list: list, num_workers: int = 4,
+                      mode: str = 'file', outputs_per_file: int = 1,
+                      verbose_level: int = 0) -> list:
+    """
+    Removes the files with the same content as a previous file of the list,
+    before any processing.
+
+    :param file_list: list
+        List of files to process.
+    :param num_workers: int
+        Number of threads reading the files.
+    :param mode: str
+        'file' compares the bytes of the files, 'pcm' compares the decoded
+        samples (see util.audio.fingerprint.find_duplicates).
+    :param outputs_per_file: int
+        Number of files processed from each source file (1 + the augmented
+        copies), to report the saved work.
+    :param verbose_level: int
+        Verbosity level.
+
+    :return: list
+        The list of unique files (in the order of the provided list). The
+        first occurrence of each group of identical files is kept, and a path
+        listed several times (e.g. overlapping bases) is kept once.
+    """
+    print('[INFO] looking for duplicate files')
+    start = time.time()
+    unique_paths = list(dict.fromkeys(file_list))
+    if len(unique_paths) < len(file_list):
+        print('[INFO] {n} paths are listed more than once'.
+              format(n=len(file_list) - len(unique_paths)))
+    duplicates = fingerprint.find_duplicates(unique_paths, mode,
+                                             max(int(num_workers), 1))
+    if int(verbose_level) > 1:
+        for duplicate, original in duplicates.items():
+            print('[INFO] {file} is a duplicate of {original}'.
+                  format(file=duplicate, original=original))
+    saved = sum(os.path.getsize(p) for p in duplicates)
+    print('[INFO] {n} of {total} files are duplicates ({size:.1f} MB), found '
+          'in {time:.1f} seconds: {runs} pre processing runs saved'.
+          format(n=len(duplicates), total=len(unique_paths),
+                 size=saved / 2 ** 20, time=time.time() - start,
+                 runs=len(duplicates) * outputs_per_file))
+    # The index of the first occurrence of each kept path
+    first = {p: i for i, p in reversed(list(enumerate(file_list)))}
+    return [p for i, p in enumerate(file_list)
+            if first[p] == i and p not in duplicates]
+
+
+def speech_windows(speech: dict, starts, seconds: float, mode: str = 'skip',
+                   min_ratio: float = 0.5) -> list:
+    """
+    Builds a list of trimming windows placed over speech.
+
+    :param speech: dict
+        Speech segments and durations of each file (see detect_speech).
+    :param starts: array like or callable(duration) -> array like
+        Candidate window starts in seconds, shared by all files or computed
+        from the duration of each file.
+    :param seconds: float
+        Length of the windows in seconds.
+    :param mode: str
+        Window placement mode. See util.audio.vad.place_windows.
+    :param min_ratio: float
+        Minimum fraction of speech a window must contain.
+
+    :return: list
+        A list of tuples (file_path, trim_interval).
+    """
+    windows = []
+    candidates = 0
+    for file_path, (segments, duration) in speech.items():
+        file_starts = starts(duration) if callable(starts) else starts
+        candidates += len(file_starts)
+        for start in vad.place_windows(segments, duration, file_starts, seconds,
+                                       mode, min_ratio):
+            windows.append((file_path, (float(start), float(start) + seconds)))
+    print('[INFO] {} of {} windows contain speech'.format(len(windows),
+                                                          candidates))
+    return windows
+
+
+def process_windows(dataset_dir: str, windows: list, num_workers: int = None,
+                    pre_processing: callable = None, **kwargs):
+    """
+    Trims a list of windows of audio files.
+
+    :param dataset_dir: str
+        Output directory (data set).
+    :param windows: list
+        List of tuples (file_path, trim_interval). See speech_windows.
+    :param num_workers: int
+        Number of workers for multiprocessing.
+    :param pre_processing: callable
+        Pre processing function.
+    :param kwargs:
+        Additional kwargs are passed on to the pre processing function.
+    """
+    if num_workers == 1:
+        for file_path, interval in windows:
+            pre_processing(file_path,
+                           dataset_dir + os.sep +
+                           os.path.basename(os.path.dirname(file_path)),
+                           trim_interval=interval, **kwargs)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as \
+            executor:
+        futures = [executor.submit(pre_processing, file_path,
+                                   dataset_dir + os.sep +
+                                   os.path.basename(os.path.dirname(file_path)),
+                                   trim_interval=interval, **kwargs)
+                   for file_path, interval in windows]
+
+        kw = {
+            'total': len(futures),
+            'unit': 'trims',
+            'unit_scale': True,
+            'leave': True
+        }
+        for f in tqdm(concurrent.futures.as_completed(futures), **kw):
+            pass
+
+
 def augment_data(data_path: str, file_list: list, sliding_window: int = None,
                  trimming_window: int = None, seconds: float = 5,
                  noises: list = None, semitones: list = None,
                  speeds: list = None, robot: bool = False,
                  phone: bool = False, num_workers: int=None,
                  verbose_level: int = 0, low_pass_filter: float = None,
-                 **kwargs):
+                 window_placement: str = None, min_speech_ratio: float = 0.5,
+                 vad_threshold: float = 1., **kwargs):
     """
     Augments data by applying audio transformations.
 
@@ -913,6 +1118,15 @@ def augment_data(data_path: str, file_list: list, sliding_window: int = None,
         Number of workers for multiprocessing .
     :param verbose_level: int
         Verbosity level.
+    :param window_placement: str
+        Speech aware placement of the sliding and trimming windows. 'skip'
+        ignores windows without enough speech and 'center' moves them to the
+        nearest speech segment. Default to None (windows are placed at fixed
+        offsets).
+    :param min_speech_ratio: float
+        Minimum fraction of speech of each window. Used with window_placement.
+    :param vad_threshold: float
+        Volume threshold (percent) of the VAD. Used with window_placement.
     :param kwargs: dict
         Additional kwargs are passed on to the pre processing function.
     """
@@ -994,7 +1208,30 @@ def augment_data(data_path: str, file_list: list, sliding_window: int = None,
         if dr[0] == '_':
             file_list += glob.glob(data_path + os.sep + dr + '*/**/*.wav',
                                    recursive=True)
-    if sliding_window is not None:
+    if window_placement is not None and (sliding_window is not None or
+                                         trimming_window is not None):
+        if sliding_window is not None:
+            print('[INFO] processing sliding window over speech')
+            starts = np.arange(0, 16, sliding_window)
+        else:
+            print('[INFO] processing trimming window over speech')
+
+            def starts(audio_length):
+                return np.arange(0, audio_length - trimming_window,
+                                 trimming_window)
+        speech = detect_speech(file_list, num_workers, verbose_level,
+                               threshold=vad_threshold)
+        process_windows(dataset_dir=data_path,
+                        windows=speech_windows(speech, starts, seconds,
+                                               window_placement,
+                                               min_speech_ratio),
+                        num_workers=num_workers,
+                        pre_processing=pre_process,
+                        verbose_level=verbose_level,
+                        min_length=seconds,
+                        pad_short=True,
+                        **kwargs)
+    elif sliding_window is not None:
         print('[INFO] processing sliding window')
         for i in range(0, 16, sliding_window):
             print('[INFO] operation {} of {}'.format(int(i / 2) + 1,
@@ -1009,7 +1246,7 @@ def augment_data(data_path: str, file_list: list, sliding_window: int = None,
                                  **kwargs)
     elif trimming_window is not None: 
         print('[INFO] processing trimming window')
-        if workers == 1:
+        if num_workers == 1:
             for audio in (tqdm(file_list) if int(verbose_level) < 2 else
                           file_list):
                 if int(verbose_level) > 0:
@@ -1097,6 +1334,70 @@ def process_trim_parallel(audio, output_dir, seconds, trimming_window,
             pass
 
 
+def save_features(file_path: str, n_mels: int = 40, frame: float = 0.025,
+                  hop: float = 0.010) -> str:
+    """
+    Saves the log mel spectrogram of an audio file next to it (.npy), as
+    computed on streams by main.py (see util.audio.features).
+
+    :param file_path: str
+        Path of the audio file.
+    :param n_mels: int
+        Number of mel bands.
+    :param frame: float
+        Length of the frames (seconds).
+    :param hop: float
+        Time between frames (seconds).
+
+    :return: str
+        Path of the generated file.
+    """
+    signal, rate = vad.read_mono(file_path)
+    output_path = os.path.splitext(file_path)[0] + '.npy'
+    np.save(output_path, features.log_mel_spectrogram(
+        signal, rate, int(round(frame * rate)), int(round(hop * rate)),
+        n_mels=n_mels))
+    return output_path
+
+
+def extract_features(file_list: list, num_workers: int = None,
+                     verbose_level: int = 0, **feature_kw) -> int:
+    """
+    Saves the features of each file (see save_features).
+
+    :param file_list: list
+        List of files to process.
+    :param num_workers: int
+        Number of workers for multiprocessing.
+    :param verbose_level: int
+        Verbosity level.
+    :param feature_kw: dict
+        Additional kwargs are passed on to save_features.
+
+    :return: int
+        The number of saved files.
+    """
+    print('[INFO] extracting features')
+    saved = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as \
+            executor:
+        futures = {executor.submit(save_features, file_path, **feature_kw):
+                   file_path for file_path in file_list}
+        kw = {
+            'total': len(futures),
+            'unit': 'files',
+            'unit_scale': True,
+            'leave': True
+        }
+        for f in tqdm(concurrent.futures.as_completed(futures), **kw):
+            if f.exception() is None:
+                saved += 1
+            elif int(verbose_level) > 1:
+                print('[ERROR] extracting features of {file}. {error}'.
+                      format(file=futures[f], error=f.exception()))
+    return saved
+
+
 def make_json_file(directory):
     raise NotImplementedError
 
@@ -1186,6 +1487,29 @@ if __name__ == '__main__':
                              'down the process. Recommended if the processing '
                              'is skipping some audio files. ',
                         action='store_true')
+    parser.add_argument('-dd', '--dedup',
+                        help='Removes the files with the same content (merged '
+                             'corpora) before processing. "file" compares the '
+                             'bytes of the files, "pcm" compares the decoded '
+                             'audio (slower, finds copies with a different '
+                             'format or metadata).',
+                        choices=['file', 'pcm'])
+    feature_args = parser.add_argument_group('Feature options')
+    feature_args.add_argument('-f', '--features',
+                              help='Saves the log mel spectrogram of each '
+                                   'processed file (.npy), to train the '
+                                   'models of main.py. The feature options '
+                                   'must be the same in main.py.',
+                              action='store_true')
+    feature_args.add_argument('--n_mels', help='Number of mel bands. Default '
+                                               'to 40.', type=int, default=40)
+    feature_args.add_argument('--frame', help='Length of the frames '
+                                              '(seconds). Default to 0.025.',
+                              type=float, default=0.025)
+    feature_args.add_argument('--frame_hop', help='Time between frames '
+                                                  '(seconds). Default to '
+                                                  '0.01.',
+                              type=float, default=0.010)
     aug_args = parser.add_argument_group('Data augmentation options')
     aug_args.add_argument('-sw', '--sliding_window',
                           help='Sliding window: augments data by trimming '
@@ -1216,6 +1540,22 @@ if __name__ == '__main__':
                           help='Pitch: augment data by changing the pitch of '
                                'audio files.',
                           action='store_true')
+    aug_args.add_argument('-wp', '--window_placement',
+                          help='Speech aware placement of the sliding and '
+                               'trimming windows: "skip" ignores windows '
+                               'without enough speech and "center" moves them '
+                               'to the nearest speech segment.',
+                          choices=['skip', 'center'])
+    aug_args.add_argument('--min_speech_ratio',
+                          help='Minimum fraction of speech of each window '
+                               'when the window placement is set. Default to '
+                               '0.5.',
+                          type=float, default=0.5)
+    aug_args.add_argument('--vad_threshold',
+                          help='Volume threshold (percent) of the speech '
+                               'detection used by the window placement. '
+                               'Default to 1.',
+                          type=float, default=1.)
     aug_args.add_argument('--robot', help='Applies robot voice to audio files.',
                           action='store_true')
     aug_args.add_argument('--phone', help='Applies phone voice to audio files.',
@@ -1298,6 +1638,20 @@ if __name__ == '__main__':
         # Append file paths to the respective language base
         files_list_lang[new_base_name] += files_paths
 
+    if arguments.dedup is not None:
+        # Each source file is pre processed once, then once per augmentation
+        outputs = 1 + (len(SEMITONES) if arguments.pitch else 0) + \
+            (len(SPEEDS) if arguments.speed else 0) + \
+            (len(NOISES) if arguments.noise else 0) + \
+            (1 if low_pass_aug is not None else 0) + \
+            (1 if arguments.robot else 0) + (1 if arguments.phone else 0)
+        for base in files_list_lang:
+            print('[INFO] base "%s"' % base)
+            files_list_lang[base] = remove_duplicates(
+                files_list_lang[base], num_workers=workers,
+                mode=arguments.dedup, outputs_per_file=outputs,
+                verbose_level=verbose)
+
     if limit is not None:
         print('[INFO] limiting the amount of files to process')
         if limit == -1:
@@ -1384,6 +1738,9 @@ if __name__ == '__main__':
                          low_pass_filter=low_pass_aug if low_pass_aug is not
                          None else None,
                          normalize_method='skip',
+                         window_placement=arguments.window_placement,
+                         min_speech_ratio=arguments.min_speech_ratio,
+                         vad_threshold=arguments.vad_threshold,
                          verbose_level=verbose)
             # Remove raw files
             # If the data augmentation is enabled, the length of each audio
@@ -1405,3 +1762,10 @@ if __name__ == '__main__':
             elif dr[0] == '_':
                 os.rename(output + os.sep + base + os.sep +
                           dr, output + os.sep + base + os.sep + dr[1:])
+
+        if arguments.features:
+            extract_features(glob.glob(output + os.sep + base +
+                                       '/**/*.wav', recursive=True),
+                             num_workers=workers, verbose_level=verbose,
+                             n_mels=arguments.n_mels, frame=arguments.frame,
+                             hop=arguments.frame_hop)
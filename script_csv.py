@@ -2,12 +2,15 @@
 This script creates a csv file containing data paths and labels to process.
 """
 import argparse
+import hashlib
 import random
 import glob
 import os
 import numpy as np
 from util.datasets import balance
-from collections import defaultdict
+from util.datasets.csv import iter_rows
+
+SPLITS = ['train', 'val', 'test']
 
 
 def validate_args(paths_and_labels, data_balance, shuffle, test_split,
@@ -34,6 +37,86 @@ def validate_args(paths_and_labels, data_balance, shuffle, test_split,
                                 1 - (val_split + test_split)))
 
 
+def hash_split(relative_path: str, val_split: float, test_split: float) -> str:
+    """
+    Assigns a file to a split from a stable hash of its relative path, so the
+    assignment does not change when files are added.
+
+    >>> hash_split('cats/cat_001.png', 0.1, 0.1)
+    'train'
+    >>> hash_split('cats/cat_001.png', 0.0, 1.0)
+    'test'
+
+    :param relative_path: str
+        Path of the file relative to its data directory.
+    :param val_split: float
+        Proportion of the validation split.
+    :param test_split: float
+        Proportion of the test split.
+
+    :return: str
+        'train', 'val' or 'test'.
+    """
+    digest = hashlib.blake2b(relative_path.replace(os.sep, '/').encode(),
+                             digest_size=8).digest()
+    h = int.from_bytes(digest, 'big') / 2 ** 64
+    if h < test_split:
+        return 'test'
+    if h < test_split + val_split:
+        return 'val'
+    return 'train'
+
+
+def split_csv_path(csv_path: str, split: str) -> str:
+    return csv_path[:-4] + '_{}_data.csv'.format(split)
+
+
+def existing_paths(csv_path: str) -> set:
+    """Paths already in a CSV file (empty if it does not exist)"""
+    if not os.path.isfile(csv_path):
+        return set()
+    paths = set()
+    for file_names, _ in iter_rows(csv_path):
+        paths.update(file_names)
+    return paths
+
+
+def append_hash_splits(paths, labels, csv_path: str, val_split: float,
+                       test_split: float, recursive: bool, data_format: str):
+    """
+    Appends the files not yet in the CSV files, assigned to the splits by
+    hash_split. The directories are read in a single pass, and the CSV files
+    are only opened if there are new files.
+
+    :return: dict
+        Number of appended files of the whole dataset and of each split.
+    """
+    known = existing_paths(csv_path)
+    new_rows = {name: [] for name in [None] + SPLITS}
+    for path, label in zip(paths, labels):
+        pattern = '/**/*.' if recursive else '/*.'
+        for file_path in glob.iglob(path + pattern + data_format,
+                                    recursive=recursive):
+            # Paths read from the CSV files use the separator of the system
+            if file_path.replace('/', os.sep) in known:
+                continue
+            row = file_path + ',' + label + '\n'
+            new_rows[None].append(row)
+            if val_split > 0.0 or test_split > 0.0:
+                relative = os.path.relpath(file_path, path)
+                new_rows[hash_split(relative, val_split, test_split)].append(
+                    row)
+    counts = dict()
+    for name, rows in new_rows.items():
+        counts[name or 'all'] = len(rows)
+        if len(rows) == 0:
+            continue
+        out_path = csv_path if name is None else split_csv_path(csv_path, name)
+        with open(out_path, 'a', buffering=1 << 20) as csv_file:
+            csv_file.writelines(rows)
+    return counts
+
+
 if __name__ == '__main__':
     # Command line arguments:
     parser = argparse.ArgumentParser(description='Generates a CSV file '
@@ -53,6 +136,9 @@ if __name__ == '__main__':
                                           'while balancing the number of '
                                           'instances of each class.',
                         action='store_true', default=False)
+    parser.add_argument('--max_per_class', help='Maximum number of instances '
+                                                'of each class.',
+                        type=int, default=None)
     parser.add_argument('--test_split', help='Creates another two CSV files '
                                              'and split data paths and labels '
                                              'into two data sets for training '
@@ -69,6 +155,15 @@ if __name__ == '__main__':
                                             'represents the proportion of the '
                                             'dataset to split.',
                         type=float, default=0.0)
+    parser.add_argument('--hash_split', help='Assigns each file to the '
+                                             'train, validation or test split '
+                                             'from a hash of its path '
+                                             'relative to its directory, and '
+                                             'only appends the files not in '
+                                             'the CSV files yet. Shuffling '
+                                             'and balancing are not '
+                                             'performed.',
+                        action='store_true', default=False)
     parser.add_argument('--format', help='Format of the data.',
                         default='*')
     parser.add_argument('--r', help='Get paths recursively.',
@@ -84,13 +179,21 @@ if __name__ == '__main__':
     test_split = args.test_split
     val_split = args.val_split
     data_balance = args.balance
+    max_per_class = args.max_per_class
     paths = paths_and_labels[0::2]
     labels = paths_and_labels[1::2]
 
     validate_args(paths_and_labels, data_balance, shuffle, test_split,
                   val_split)
 
-    splits = [0, 1 - (val_split + test_split), 1 - test_split]
+    if args.hash_split:
+        if data_balance or shuffle or max_per_class is not None:
+            print('[WARN] Shuffling and balancing are not performed with '
+                  '--hash_split.')
+        appended = append_hash_splits(paths, labels, csv_path, val_split,
+                                      test_split, recursive, data_format)
+        print('[INFO] appended files:', appended)
+        exit(0)
 
     dataset = list()
 
@@ -116,61 +219,27 @@ if __name__ == '__main__':
         random.shuffle(dataset)
 
     file_paths, file_labels = zip(*dataset)
-    num_classes = np.unique(file_labels)
+    file_paths = np.asarray(file_paths)
+    file_labels = np.asarray(file_labels)
 
-    if balance:
-        file_paths, file_labels = balance.balance_data(file_paths, file_labels)
-    else:
-        file_paths = np.asarray(file_paths)
-        file_labels = np.asarray(file_labels)
+    if data_balance or max_per_class is not None:
+        indices = balance.balance_indices(file_labels, max_per_class,
+                                          balance=data_balance)
+        file_paths, file_labels = file_paths[indices], file_labels[indices]
 
     with open(csv_path, 'w') as csv_file:
         print('[INFO] creating a csv file with paths and labels')
         for p, l in zip(file_paths, file_labels):
             csv_file.write(p + ',' + l + '\n')
     if test_split > 0.0 or val_split > 0.0:
-        paths_per_label = defaultdict(lambda: [])
-        for p, l in zip(file_paths, file_labels):
-            paths_per_label[l].append(p)
-        train_paths = list()
-        train_labels = list()
-        val_paths = list()
-        val_labels = list()
-        test_paths = list()
-        test_labels = list()
-        for label in paths_per_label:
-            train_paths += paths_per_label[label][splits[0]:int(splits[1]*len(
-                paths_per_label[label]))]
-            train_labels += [label for _ in range(splits[0], int(len(
-                paths_per_label[label]) - splits[1] * len(
-                paths_per_label[label])))]
-            if val_split > 0.0:
-                val_paths += paths_per_label[label][int(splits[1]*len(
-                    paths_per_label[label])):int(splits[2]*len(
-                    paths_per_label[label]))]
-                val_labels += [label for _ in range(0, int(splits[1] * len(
-                    paths_per_label[label]) - splits[2] * len(
-                    paths_per_label[label])))]
-            if test_split > 0.0:
-                test_paths += paths_per_label[label][int(splits[2]*len(
-                    paths_per_label[label])):len(paths_per_label[label])]
-                test_labels += [label for _ in range(0, int(splits[2] * len(
-                    paths_per_label[label])))]
-
-        with open(csv_path[:-4] + '_train_data.csv', 'w') as csv_file:
-            print('[INFO] creating a csv file with train data, '
-                  'total', len(train_paths))
-            for p, l in zip(train_paths, train_labels):
-                csv_file.write(p + ',' + l + '\n')
-
-        with open(csv_path[:-4] + '_val_data.csv', 'w') as csv_file:
-            print('[INFO] creating a csv file with validation data, '
-                  'total', len(val_paths))
-            for p, l in zip(val_paths, val_labels):
-                csv_file.write(p + ',' + l + '\n')
-
-        with open(csv_path[:-4] + '_test_data.csv', 'w') as csv_file:
-            print('[INFO] creating a csv file with test data, '
-                  'total', len(test_paths))
-            for p, l in zip(test_paths, test_labels):
-                csv_file.write(p + ',' + l + '\n')
+        splits = balance.stratified_split(file_labels,
+                                          (1 - (val_split + test_split),
+                                           val_split, test_split))
+        for name, indices in zip(['train', 'validation', 'test'], splits):
+            split_path = split_csv_path(csv_path, 'val' if name ==
+                                        'validation' else name)
+            with open(split_path, 'w') as csv_file:
+                print('[INFO] creating a csv file with {} data, '
+                      'total'.format(name), len(indices))
+                for p, l in zip(file_paths[indices], file_labels[indices]):
+                    csv_file.write(p + ',' + l + '\n')
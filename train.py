@@ -1,17 +1,148 @@
 """Train and save models script"""
+import inspect
+import os
+import numpy as np
 from core.networks import BaseModel
+from core.training import Trainer
+from util.dataloader import loader_kw
+from util.dataloader.batching.sequence import Generator
+from util.datasets.csv import CSVParser, encode_labels
+
+
+def load_model_class(model_path: str):
+    """
+    Imports a Python file and returns the BaseModel subclass defined in it.
+
+    :param model_path: str
+        Path of the Python file.
+    """
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        os.path.splitext(os.path.basename(model_path))[0], model_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    classes = [c for _, c in inspect.getmembers(module, inspect.isclass)
+               if issubclass(c, BaseModel) and not inspect.isabstract(c) and
+               c.__module__ == module.__name__]
+    if len(classes) != 1:
+        raise ValueError('Expected a single BaseModel in {}, found {}'.
+                         format(model_path, len(classes)))
+    return classes[0]
 
 
 if __name__ == '__main__':
     import json
     import argparse
     import importlib
+    from config import Config
     # Command line arguments:
     parser = argparse.ArgumentParser(description='Train script')
     parser.add_argument('model', help='Model path (Python file)')
-    parser.add_argument('--params', help='Parameters JSON file')
-    parser.add_argument('--checkpoints', help='')
-    parser.add_argument('--best_checkpoint', help='')
-    parser.add_argument('--callbacks', help='')
-    parser.add_argument('--tensorboard', help='', action='store_true',
-                        default=False)
\ No newline at end of file
+    parser.add_argument('--params', help='Parameters JSON file. The "model" '
+                                         'entry holds the kwargs of the model '
+                                         'class, the other entries set the '
+                                         'defaults of the training options.')
+    parser.add_argument('--data', help='CSV manifest of the training data. '
+                                       'Default to the data_csv of the '
+                                       'config.')
+    parser.add_argument('--validation', help='CSV manifest of the validation '
+                                             'data.')
+    parser.add_argument('--epochs', help='Number of epochs. Default to 10.',
+                        type=int)
+    parser.add_argument('--batch_size', help='Batch size. Default to 32.',
+                        type=int)
+    parser.add_argument('--seed', help='Seed of the shuffling. Default to the '
+                                       'seed of the checkpoint, or random.',
+                        type=int)
+    parser.add_argument('--workers', help='Number of threads preparing the '
+                                          'batches. Default to 1.', type=int)
+    parser.add_argument('--prefetch', help='Number of batches prepared in '
+                                           'background. Default to 2.',
+                        type=int)
+    parser.add_argument('--checkpoints', help='Checkpoints directory. The '
+                                              'training is resumed from its '
+                                              'last checkpoint.')
+    parser.add_argument('--save_seconds', help='Minimum time between two '
+                                               'checkpoints within an epoch. '
+                                               'Default to 600.', type=float)
+    parser.add_argument('--save_steps', help='Saves a checkpoint every '
+                                             'save_steps steps as well.',
+                        type=int)
+    parser.add_argument('--log_every', help='Number of steps between progress '
+                                            'messages. Default to 100.',
+                        type=int)
+    parser.add_argument('--best_checkpoint', help='Path (.keras) of the best '
+                                                  'model on the validation '
+                                                  'data.')
+    parser.add_argument('--monitor', help='Quantity deciding the best model. '
+                                          'Default to val_loss.')
+    parser.add_argument('--callbacks', help='Python module with a list of '
+                                            'Keras callbacks named callbacks '
+                                            '(e.g. core.callbacks).')
+    parser.add_argument('--tensorboard', help='Writes TensorBoard logs to '
+                                              'logs/tensorboard.',
+                        action='store_true', default=False)
+    parser.add_argument('-v', '--verbose', help='Verbosity level.', type=int,
+                        default=1)
+    arguments = parser.parse_args()
+
+    params = dict()
+    if arguments.params is not None:
+        with open(arguments.params) as params_file:
+            params = json.load(params_file)
+    defaults = {'epochs': 10, 'batch_size': 32, 'workers': 1, 'prefetch': 2,
+                'save_seconds': 600., 'log_every': 100, 'monitor': 'val_loss',
+                'data': Config().data_csv}
+    options = {k: getattr(arguments, k) if getattr(arguments, k) is not None
+               else params.get(k, defaults.get(k))
+               for k in ('data', 'validation', 'epochs', 'batch_size', 'seed',
+                         'workers', 'prefetch', 'save_seconds', 'save_steps',
+                         'log_every', 'monitor')}
+    if options['data'] is None:
+        parser.error('the training data (--data) is required')
+
+    train_csv = CSVParser(options['data'], cache=True)
+    print('[INFO] {} instances of {} classes'.format(len(train_csv.label_ids),
+                                                     train_csv.num_classes))
+    if options['seed'] is None:
+        # The seed of the checkpoint resumes the order of the batches
+        state = Trainer.checkpoint_state(arguments.checkpoints) if \
+            arguments.checkpoints is not None else None
+        options['seed'] = state['seed'] if state is not None else \
+            int(np.random.SeedSequence().entropy % 2 ** 63)
+    kw = loader_kw(train_csv.file_names[0])
+    generator = Generator(train_csv.file_names, train_csv.label_ids,
+                          options['batch_size'], seed=options['seed'], **kw)
+    validation = None
+    if options['validation'] is not None:
+        val_csv = CSVParser(options['validation'], cache=True)
+        validation = Generator(val_csv.file_names,
+                               encode_labels(val_csv.labels,
+                                             train_csv.classes),
+                               options['batch_size'], shuffle=False, **kw)
+    if arguments.checkpoints is not None:
+        os.makedirs(arguments.checkpoints, exist_ok=True)
+        with open(os.path.join(arguments.checkpoints, 'classes.txt'),
+                  'w') as classes_file:
+            classes_file.write('\n'.join(train_csv.classes))
+
+    callbacks = []
+    if arguments.callbacks is not None:
+        callbacks += list(importlib.import_module(arguments.callbacks).
+                          callbacks)
+    if arguments.tensorboard:
+        import keras
+        callbacks.append(keras.callbacks.TensorBoard(
+            log_dir='logs/tensorboard'))
+
+    model = load_model_class(arguments.model)(**params.get('model', {}))
+    trainer = Trainer(model, generator, arguments.checkpoints,
+                      validation=validation, callbacks=callbacks,
+                      best_path=arguments.best_checkpoint,
+                      monitor=options['monitor'],
+                      save_seconds=options['save_seconds'],
+                      save_steps=options['save_steps'],
+                      prefetch=options['prefetch'], workers=options['workers'],
+                      log_every=options['log_every'],
+                      verbose=arguments.verbose)
+    trainer.fit(options['epochs'])
@@ -0,0 +1,209 @@
+"""
+This module implements audio effects over batches of waveforms.
+
+The effects mirror the sox transformations of script_create_dataset.py, but
+work in memory over arrays of shape (batch, samples), applying a different
+parameter to each waveform with vectorized NumPy operations. The length of the
+waveforms is always preserved: shortened audio is padded with zeros and
+lengthened audio is truncated.
+"""
+import numpy as np
+
+
+def _gather(batch: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Linear interpolation of each row at fractional positions (zero padded)"""
+    padded = np.concatenate((batch, np.zeros((len(batch), 2), batch.dtype)),
+                            axis=1)
+    positions = np.clip(positions, 0, batch.shape[1])
+    left = np.floor(positions).astype(np.int64)
+    frac = (positions - left).astype(batch.dtype)
+    return (np.take_along_axis(padded, left, axis=1) * (1 - frac) +
+            np.take_along_axis(padded, left + 1, axis=1) * frac)
+
+
+def speed(batch: np.ndarray, factors) -> np.ndarray:
+    """
+    Changes the speed (tempo and pitch) of each waveform.
+
+    :param batch: numpy.ndarray, shape=(batch, samples)
+        Waveforms.
+    :param factors: array like, shape=(batch,)
+        Speed factor of each waveform (like sox speed).
+
+    :return: numpy.ndarray
+        Waveforms with the same shape.
+    """
+    factors = np.asarray(factors, dtype=np.float64).reshape(-1, 1)
+    positions = np.arange(batch.shape[1])[None, :] * factors
+    # Positions past the end of the audio read the zero padding
+    positions[positions > batch.shape[1]] = batch.shape[1]
+    return _gather(batch, positions)
+
+
+def time_stretch(batch: np.ndarray, factor: float,
+                 n_fft: int = 512) -> np.ndarray:
+    """
+    Changes the tempo (not the pitch) of the waveforms with a phase vocoder.
+
+    :param batch: numpy.ndarray, shape=(batch, samples)
+        Waveforms.
+    :param factor: float
+        Tempo factor shared by the whole batch (> 1 speeds up).
+    :param n_fft: int
+        Length of the analysis frames. Must be a multiple of 4.
+
+    :return: numpy.ndarray
+        Waveforms with the same shape.
+    """
+    length = batch.shape[1]
+    hop = n_fft // 4
+    window = np.hanning(n_fft + 1)[:-1]
+    padded = np.concatenate((np.zeros((len(batch), n_fft // 2)), batch,
+                             np.zeros((len(batch), n_fft + hop))), axis=1)
+    n_frames = (padded.shape[1] - n_fft) // hop + 1
+    positions = (np.arange(n_frames) * hop)[:, None] + np.arange(n_fft)
+    spectrum = np.fft.rfft(padded[:, positions] * window, axis=2)
+
+    # Output frames read the analysis frames at fractional steps
+    steps = np.arange(0, n_frames - 1, factor)[:length // hop + 4]
+    first = np.floor(steps).astype(np.int64)
+    alpha = (steps - first)[None, :, None]
+    magnitude = (1 - alpha) * np.abs(spectrum[:, first]) + \
+        alpha * np.abs(spectrum[:, first + 1])
+    # Accumulate the phase advance measured between consecutive frames
+    expected = 2 * np.pi * hop * np.arange(n_fft // 2 + 1) / n_fft
+    advance = np.angle(spectrum[:, first + 1]) - \
+        np.angle(spectrum[:, first]) - expected
+    advance = expected + advance - 2 * np.pi * np.round(advance / (2 * np.pi))
+    phase = np.angle(spectrum[:, :1]) + np.concatenate(
+        (np.zeros_like(advance[:, :1]), np.cumsum(advance[:, :-1], axis=1)),
+        axis=1)
+    frames = np.fft.irfft(magnitude * np.exp(1j * phase), n=n_fft, axis=2) * \
+        window
+
+    # Overlap-add of frames overlapping by 3/4 of their length
+    blocks = frames.reshape(len(batch), len(steps), 4, hop)
+    out = np.zeros((len(batch), len(steps) + 3, hop))
+    for j in range(4):
+        out[:, j:j + len(steps)] += blocks[:, :, j]
+    out /= np.sum(window ** 2) / hop
+    out = out.reshape(len(batch), -1)[:, n_fft // 2:n_fft // 2 + length]
+    return np.pad(out, ((0, 0), (0, length - out.shape[1]))).\
+        astype(batch.dtype)
+
+
+def pitch(batch: np.ndarray, cents, n_fft: int = 512) -> np.ndarray:
+    """
+    Changes the pitch (not the tempo) of each waveform.
+
+    Waveforms sharing the same shift are processed together, so the cost
+    depends on the number of distinct shifts, not on the batch size.
+
+    :param batch: numpy.ndarray, shape=(batch, samples)
+        Waveforms.
+    :param cents: array like, shape=(batch,)
+        Pitch shift of each waveform in cents (like sox pitch).
+    :param n_fft: int
+        Length of the analysis frames. See time_stretch.
+
+    :return: numpy.ndarray
+        Waveforms with the same shape.
+    """
+    cents = np.asarray(cents, dtype=np.float64)
+    out = np.empty_like(batch)
+    for shift in np.unique(cents):
+        rows = cents == shift
+        factor = 2 ** (shift / 1200)
+        # Slow down the tempo first, then resample back to the original tempo
+        stretched = time_stretch(
+            np.concatenate((batch[rows], np.zeros_like(batch[rows])), axis=1),
+            1 / factor, n_fft)
+        out[rows] = speed(stretched, np.full(rows.sum(), factor))[
+            :, :batch.shape[1]]
+    return out
+
+
+def _band(batch: np.ndarray, rate: int, low, high) -> np.ndarray:
+    """Keeps the frequencies between low and high of each waveform"""
+    spectrum = np.fft.rfft(batch, axis=1)
+    frequencies = np.fft.rfftfreq(batch.shape[1], 1 / rate)[None, :]
+    mask = (frequencies >= np.reshape(low, (-1, 1))) & \
+        (frequencies <= np.reshape(high, (-1, 1)))
+    return np.fft.irfft(spectrum * mask, n=batch.shape[1], axis=1).\
+        astype(batch.dtype)
+
+
+def lowpass(batch: np.ndarray, rate: int, frequencies) -> np.ndarray:
+    """
+    Applies a low pass filter to each waveform.
+
+    :param batch: numpy.ndarray, shape=(batch, samples)
+        Waveforms.
+    :param rate: int
+        Sample rate of the waveforms.
+    :param frequencies: array like, shape=(batch,) or float
+        Cutoff frequency of each waveform.
+
+    :return: numpy.ndarray
+        Waveforms with the same shape.
+    """
+    return _band(batch, rate, 0, frequencies)
+
+
+def phone(batch: np.ndarray, rate: int) -> np.ndarray:
+    """
+    Applies a phone voice effect (band pass between 400 Hz and 3.4 kHz).
+
+    :param batch: numpy.ndarray, shape=(batch, samples)
+        Waveforms.
+    :param rate: int
+        Sample rate of the waveforms.
+
+    :return: numpy.ndarray
+        Waveforms with the same shape.
+    """
+    return _band(batch, rate, 400, 3400)
+
+
+def robot(batch: np.ndarray, rate: int) -> np.ndarray:
+    """
+    Applies a robot voice effect (overdrive followed by short echoes).
+
+    :param batch: numpy.ndarray, shape=(batch, samples)
+        Waveforms.
+    :param rate: int
+        Sample rate of the waveforms.
+
+    :return: numpy.ndarray
+        Waveforms with the same shape.
+    """
+    gain = 10 ** (10 / 20)
+    driven = np.tanh(gain * batch) / np.tanh(gain)
+    out = 0.8 * driven
+    # (delay in ms, decay) of each echo, as in the sox robot effect
+    for delay, decay in [(5, 0.7), (6, 0.7), (10, 0.7), (12, 0.7)]:
+        shift = int(rate * delay / 1000)
+        out[:, shift:] += decay * driven[:, :-shift]
+    peak = np.abs(out).max(axis=1, keepdims=True)
+    return out / np.maximum(peak, 1)
+
+
+def add_noise(batch: np.ndarray, noise: np.ndarray, snr) -> np.ndarray:
+    """
+    Mixes noise with each waveform.
+
+    :param batch: numpy.ndarray, shape=(batch, samples)
+        Waveforms.
+    :param noise: numpy.ndarray, shape=(batch, samples)
+        Noise of each waveform.
+    :param snr: array like, shape=(batch,) or float
+        Signal to noise ratio of each waveform in dB.
+
+    :return: numpy.ndarray
+        Waveforms with the same shape.
+    """
+    signal_rms = np.sqrt(np.mean(np.square(batch), axis=1, keepdims=True))
+    noise_rms = np.sqrt(np.mean(np.square(noise), axis=1, keepdims=True))
+    scale = signal_rms / np.maximum(noise_rms, 1e-8) / \
+        10 ** (np.reshape(snr, (-1, 1)) / 20)
+    return batch + (noise * scale).astype(batch.dtype)
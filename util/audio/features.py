@@ -0,0 +1,129 @@
+"""
+This module implements framewise audio features (log mel spectrogram).
+
+The features of a stream are computed incrementally: StreamingFeatures keeps
+the samples of the last incomplete frame between chunks, so the frames of a
+stream fed in chunks of any size are the same as the frames of the whole
+signal.
+
+>>> import numpy as np
+>>> signal = np.random.default_rng(0).normal(size=16000).astype(np.float32)
+>>> features = StreamingFeatures(16000)
+>>> frames = np.concatenate([features.push(c) for c in
+...                          np.array_split(signal, 7)])
+>>> np.allclose(frames, log_mel_spectrogram(signal, 16000), atol=1e-5)
+True
+"""
+import numpy as np
+
+
+def mel_filterbank(rate: int, n_fft: int, n_mels: int, f_min: float = 0.,
+                   f_max: float = None) -> np.ndarray:
+    """
+    Computes triangular filters on the mel scale (HTK formula).
+
+    :param rate: int
+        Sample rate.
+    :param n_fft: int
+        Length of the FFT.
+    :param n_mels: int
+        Number of filters.
+    :param f_min: float
+        Lowest frequency (Hz).
+    :param f_max: float
+        Highest frequency (Hz). Default to None (half the sample rate).
+
+    :return: numpy.ndarray, shape=(n_fft // 2 + 1, n_mels)
+        The filters.
+    """
+    f_max = rate / 2 if f_max is None else f_max
+    mel = np.linspace(2595 * np.log10(1 + f_min / 700),
+                      2595 * np.log10(1 + f_max / 700), n_mels + 2)
+    hz = 700 * (10 ** (mel / 2595) - 1)
+    bins = np.linspace(0, rate / 2, n_fft // 2 + 1)
+    lower, center, upper = hz[:-2, None], hz[1:-1, None], hz[2:, None]
+    filters = np.maximum(0, np.minimum((bins - lower) / (center - lower),
+                                       (upper - bins) / (upper - center)))
+    return filters.T.astype(np.float32)
+
+
+def _frames(signal: np.ndarray, frame_length: int,
+            hop_length: int) -> np.ndarray:
+    """Views of the complete frames of a signal"""
+    if len(signal) < frame_length:
+        return np.empty((0, frame_length), dtype=signal.dtype)
+    return np.lib.stride_tricks.sliding_window_view(
+        signal, frame_length)[::hop_length]
+
+
+def _log_mel(frames: np.ndarray, window: np.ndarray, n_fft: int,
+             filters: np.ndarray) -> np.ndarray:
+    spectrum = np.abs(np.fft.rfft(frames * window, n=n_fft, axis=1)) ** 2
+    return np.log(spectrum.astype(np.float32) @ filters + 1e-6)
+
+
+def log_mel_spectrogram(signal: np.ndarray, rate: int,
+                        frame_length: int = None, hop_length: int = None,
+                        n_fft: int = None, n_mels: int = 40) -> np.ndarray:
+    """
+    Computes the log mel spectrogram of a signal.
+
+    :param signal: numpy.ndarray, shape=(samples,)
+        The signal.
+    :param rate: int
+        Sample rate.
+    :param frame_length: int
+        Samples of each frame. Default to None (25 ms).
+    :param hop_length: int
+        Samples between frames. Default to None (10 ms).
+    :param n_fft: int
+        Length of the FFT. Default to None (the power of 2 above the frame
+        length).
+    :param n_mels: int
+        Number of mel bands. Default to 40.
+
+    :return: numpy.ndarray, shape=(frames, n_mels)
+        The features of each complete frame.
+    """
+    return StreamingFeatures(rate, frame_length, hop_length, n_fft,
+                             n_mels).push(signal)
+
+
+class StreamingFeatures:
+    """Computes the log mel spectrogram of a stream, chunk by chunk"""
+
+    def __init__(self, rate: int, frame_length: int = None,
+                 hop_length: int = None, n_fft: int = None, n_mels: int = 40):
+        """
+        Initializes the features of a stream (see log_mel_spectrogram).
+        """
+        self.rate = rate
+        self.frame_length = frame_length or int(round(0.025 * rate))
+        self.hop_length = hop_length or int(round(0.010 * rate))
+        self.n_fft = n_fft or 1 << (self.frame_length - 1).bit_length()
+        self.n_mels = n_mels
+        self._window = np.hanning(self.frame_length + 1)[:-1].astype(
+            np.float32)
+        self._filters = mel_filterbank(rate, self.n_fft, n_mels)
+        self._rest = np.empty(0, dtype=np.float32)
+
+    def push(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Adds samples to the stream.
+
+        :param samples: numpy.ndarray, shape=(samples,)
+            The next samples of the stream.
+
+        :return: numpy.ndarray, shape=(frames, n_mels)
+            The features of the frames completed by the samples.
+        """
+        signal = np.concatenate((self._rest,
+                                 np.asarray(samples, dtype=np.float32)))
+        frames = _frames(signal, self.frame_length, self.hop_length)
+        # The samples of the next frames are kept
+        self._rest = signal[len(frames) * self.hop_length:]
+        return _log_mel(frames, self._window, self.n_fft, self._filters)
+
+    def reset(self):
+        """Drops the samples of the incomplete frame"""
+        self._rest = np.empty(0, dtype=np.float32)
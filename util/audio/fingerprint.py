@@ -0,0 +1,134 @@
+"""
+This module implements content fingerprints to find duplicate audio files.
+
+Files are compared in stages, so most files are never read: only files of the
+same size are candidates, their sampled digest (the size, the header and a few
+chunks) is computed next, and the full content confirms the sampled matches.
+The 'pcm' mode hashes the decoded samples instead, finding the same recording
+saved with a different container or metadata (slower, every file is decoded).
+
+>>> import os, tempfile
+>>> directory = tempfile.mkdtemp()
+>>> for name, content in [('a', b'1' * 10), ('b', b'2' * 10), ('c', b'1' * 10)]:
+...     with open(os.path.join(directory, name), 'wb') as f:
+...         _ = f.write(content)
+>>> paths = [os.path.join(directory, n) for n in 'abc']
+>>> {os.path.basename(d): os.path.basename(o)
+...  for d, o in find_duplicates(paths).items()}
+{'c': 'a'}
+"""
+import concurrent.futures
+import hashlib
+import os
+from collections import defaultdict
+import numpy as np
+import soundfile as sf
+from util.hashing import file_digest
+
+
+def sample_digest(file_path: str, sample_size: int = 65536) -> str:
+    """
+    Computes a digest of the size, the beginning (header), the middle and the
+    end of a file.
+
+    :param file_path: str
+        Path of the file.
+    :param sample_size: int
+        Number of bytes read at each position. Default to 65536.
+
+    :return: str
+        The hexadecimal digest.
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, 'rb') as f:
+        for position in sorted({0, max(size // 2 - sample_size // 2, 0),
+                                max(size - sample_size, 0)}):
+            f.seek(position)
+            digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+
+def pcm_digest(file_path: str, block_size: int = 1 << 16) -> str:
+    """
+    Computes a digest of the decoded samples of an audio file (and its rate
+    and number of channels), regardless of the container and metadata.
+
+    :param file_path: str
+        Path of the audio file.
+    :param block_size: int
+        Number of frames decoded at a time. Default to 65536.
+
+    :return: str
+        The hexadecimal digest.
+    """
+    if not os.path.isfile(file_path):
+        raise FileNotFoundError(file_path)
+    with sf.SoundFile(file_path) as audio:
+        digest = hashlib.blake2b('{} {}'.format(audio.samplerate,
+                                                audio.channels).encode(),
+                                 digest_size=16)
+        for block in audio.blocks(block_size, dtype='int16'):
+            digest.update(np.ascontiguousarray(block).tobytes())
+    return digest.hexdigest()
+
+
+def _digests(file_list: list, digest_fn: callable, num_workers: int) -> dict:
+    """Computes the digests on a thread pool, ignoring unreadable files"""
+    digests = dict()
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+        futures = {executor.submit(digest_fn, p): p for p in file_list}
+        for f in concurrent.futures.as_completed(futures):
+            if f.exception() is None:
+                digests[futures[f]] = f.result()
+    return digests
+
+
+def _candidates(file_list: list, key: dict) -> list:
+    """Files sharing their key with another file"""
+    groups = defaultdict(list)
+    for p in file_list:
+        if p in key:
+            groups[key[p]].append(p)
+    return [p for group in groups.values() if len(group) > 1 for p in group]
+
+
+def find_duplicates(file_list: list, mode: str = 'file',
+                    num_workers: int = 4) -> dict:
+    """
+    Finds the files with the same content as a previous file of the list.
+
+    :param file_list: list
+        Paths of the files.
+    :param mode: str
+        'file' compares the bytes of the files (size, sampled digest, then the
+        full content). 'pcm' compares the decoded samples of audio files.
+        Default to 'file'.
+    :param num_workers: int
+        Number of threads reading the files. Default to 4.
+
+    :return: dict
+        The duplicate paths as keys and the path of the first file with the
+        same content as values. Unreadable files are never duplicates, and
+        a path repeated in the list is never a duplicate of itself.
+    """
+    # A path listed twice is the same file, not a duplicate
+    file_list = list(dict.fromkeys(file_list))
+    if mode == 'pcm':
+        key = _digests(file_list, pcm_digest, num_workers)
+    elif mode == 'file':
+        key = {p: os.path.getsize(p) for p in file_list if os.path.isfile(p)}
+        for digest_fn in (sample_digest, file_digest):
+            key = _digests(_candidates(file_list, key), digest_fn, num_workers)
+    else:
+        raise ValueError('Unknown mode {}'.format(mode))
+    first = dict()
+    duplicates = dict()
+    for p in file_list:
+        if p not in key:
+            continue
+        if key[p] in first:
+            duplicates[p] = first[key[p]]
+        else:
+            first[key[p]] = p
+    return duplicates
@@ -0,0 +1,193 @@
+"""
+This module implements the input of audio streams: a ring buffer, and sources
+of PCM chunks from a WAV file, a pipe or a socket.
+
+Every source yields tuples (chunk, arrival), where the chunk is a mono float32
+array in [-1, 1] and arrival is the time (time.perf_counter) at which the
+chunk was received, to measure the latency of the processing.
+
+>>> buffer = RingBuffer(4)
+>>> buffer.write(np.arange(3))
+>>> buffer.write(np.arange(3, 6))
+>>> buffer.latest(3).tolist(), buffer.total
+([3.0, 4.0, 5.0], 6)
+"""
+import socket
+import time
+import numpy as np
+import soundfile as sf
+
+
+class RingBuffer:
+    """A fixed size buffer holding the last written items of a stream"""
+
+    def __init__(self, capacity: int, shape: tuple = (),
+                 dtype=np.float32):
+        """
+        :param capacity: int
+            Number of items held.
+        :param shape: tuple
+            Shape of each item, e.g. (n_mels,) for feature frames. Default to
+            () (samples).
+        :param dtype:
+            Data type of the items.
+        """
+        self._data = np.zeros((capacity,) + tuple(shape), dtype=dtype)
+        self._total = 0
+
+    def write(self, items: np.ndarray):
+        """Appends items, overwriting the oldest ones"""
+        items = np.asarray(items)
+        capacity = len(self._data)
+        n = len(items)
+        if n >= capacity:
+            # An item is always at its position in the stream modulo capacity
+            self._data[np.arange(self._total + n - capacity,
+                                 self._total + n) % capacity] = \
+                items[n - capacity:]
+        else:
+            start = self._total % capacity
+            first = min(n, capacity - start)
+            self._data[start:start + first] = items[:first]
+            self._data[:n - first] = items[first:]
+        self._total += n
+
+    def window(self, end: int, length: int) -> np.ndarray:
+        """
+        Reads the items [end - length, end) of the stream.
+
+        :param end: int
+            Position (number of items since the start of the stream) after
+            the last item.
+        :param length: int
+            Number of items.
+
+        :return: numpy.ndarray
+            A copy of the items, in order.
+        """
+        if end > self._total or end - length < 0 or \
+                end - length < self._total - len(self._data):
+            raise IndexError('Items [{}, {}) are not in the buffer (holding '
+                             '[{}, {})'.format(end - length, end,
+                                               max(self._total -
+                                                   len(self._data), 0),
+                                               self._total))
+        positions = np.arange(end - length, end) % len(self._data)
+        return self._data[positions]
+
+    def latest(self, length: int) -> np.ndarray:
+        """Reads the last items written"""
+        return self.window(self._total, length)
+
+    @property
+    def total(self) -> int:
+        """Returns the number of items written since the start"""
+        return self._total
+
+    @property
+    def capacity(self) -> int:
+        return len(self._data)
+
+
+def _mono(data: np.ndarray) -> np.ndarray:
+    return data.mean(axis=1) if data.ndim > 1 else data
+
+
+class WavSource:
+    """Replays an audio file in chunks, in real time or faster"""
+
+    def __init__(self, path: str, chunk_size: int = 1600,
+                 speed: float = 1.):
+        """
+        :param path: str
+            Path of the audio file (any format read by soundfile).
+        :param chunk_size: int
+            Samples of each chunk. Default to 1600 (100 ms at 16 kHz).
+        :param speed: float
+            Replay speed: 1 is real time, 2 twice as fast. Default to 1.
+            None replays as fast as possible.
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.speed = speed
+        self.rate = sf.info(path).samplerate
+
+    def __iter__(self):
+        start = time.perf_counter()
+        position = 0
+        for block in sf.blocks(self.path, blocksize=self.chunk_size,
+                               dtype='float32', always_2d=True):
+            position += len(block)
+            if self.speed is not None:
+                # The chunk is available once its last sample was "recorded"
+                delay = start + position / self.rate / self.speed - \
+                    time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            yield _mono(block), time.perf_counter()
+
+
+class PCMSource:
+    """Reads raw PCM chunks from a binary stream (a pipe or a socket)"""
+
+    def __init__(self, stream, rate: int, chunk_size: int = 1600,
+                 dtype: str = 'int16', channels: int = 1):
+        """
+        :param stream:
+            A binary file object, e.g. sys.stdin.buffer or the file of a
+            socket (see from_socket).
+        :param rate: int
+            Sample rate of the stream.
+        :param chunk_size: int
+            Samples (per channel) of each chunk.
+        :param dtype: str
+            Sample format: 'int16', 'int32' or 'float32'. Default to 'int16'.
+        :param channels: int
+            Number of interleaved channels (averaged). Default to 1.
+        """
+        self.stream = stream
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self._connection = None
+
+    @classmethod
+    def from_socket(cls, host: str, port: int, rate: int, **kwargs):
+        """Connects to a TCP server sending raw PCM (closed by close)"""
+        connection = socket.create_connection((host, port))
+        source = cls(connection.makefile('rb'), rate, **kwargs)
+        source._connection = connection
+        return source
+
+    def close(self):
+        """Closes the connection opened by from_socket (other streams are
+        left open)"""
+        if self._connection is not None:
+            self.stream.close()
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        frame_bytes = self.dtype.itemsize * self.channels
+        scale = float(np.iinfo(self.dtype).max + 1) if \
+            np.issubdtype(self.dtype, np.integer) else 1.
+        rest = b''
+        while True:
+            data = self.stream.read(self.chunk_size * frame_bytes)
+            if not data:
+                break
+            arrival = time.perf_counter()
+            data = rest + data
+            # Incomplete frames are completed by the next read
+            n = len(data) // frame_bytes * frame_bytes
+            rest = data[n:]
+            samples = np.frombuffer(data[:n], dtype=self.dtype).reshape(
+                -1, self.channels)
+            yield _mono(samples.astype(np.float32) / scale), arrival
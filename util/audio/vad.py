@@ -0,0 +1,245 @@
+"""
+This module implements a frame energy based voice activity detector (VAD).
+
+Every operation is vectorized: the energy of all frames is computed at once from
+the cumulative sum of the squared signal, so the cost is linear in the number
+of samples regardless of the frame and hop lengths. Speech segments are
+returned as an array of (start, end) pairs in seconds, which can be computed
+once per source file and reused to trim silence or to place trimming windows.
+
+>>> import numpy as np
+>>> rate = 8000
+>>> signal = np.zeros(rate * 3)
+>>> signal[rate:2 * rate] = 0.5
+>>> speech_segments(signal, rate).round(1).tolist()
+[[1.0, 2.0]]
+"""
+import numpy as np
+import soundfile as sf
+
+
+def read_mono(file_path: str) -> (np.ndarray, int):
+    """
+    Reads an audio file as a single channel signal.
+
+    :param file_path: str
+        Path of the audio file.
+
+    :return: tuple (numpy.ndarray, int)
+        The signal (channels are averaged) and its sample rate.
+    """
+    data, rate = sf.read(file_path, dtype='float32', always_2d=True)
+    return data.mean(axis=1), rate
+
+
+def frame_rms(signal: np.ndarray, frame_length: int,
+              hop_length: int) -> np.ndarray:
+    """
+    Computes the root mean square of each frame of a signal.
+
+    :param signal: numpy.ndarray
+        Single channel signal.
+    :param frame_length: int
+        Length of each frame in samples.
+    :param hop_length: int
+        Number of samples between the start of consecutive frames.
+
+    :return: numpy.ndarray
+        RMS value of each frame. A signal shorter than a frame has one frame.
+    """
+    frame_length = max(1, min(int(frame_length), len(signal)))
+    n_frames = 1 + max(0, (len(signal) - frame_length) // int(hop_length))
+    energy = np.zeros(len(signal) + 1, dtype=np.float64)
+    np.cumsum(np.square(signal, dtype=np.float64), out=energy[1:])
+    starts = np.arange(n_frames) * int(hop_length)
+    frame_energy = energy[starts + frame_length] - energy[starts]
+    return np.sqrt(np.maximum(frame_energy, 0) / frame_length)
+
+
+def speech_segments(signal: np.ndarray, rate: int, threshold: float = 1.,
+                    frame_duration: float = 0.03, hop_duration: float = 0.01,
+                    min_speech: float = 0.05,
+                    min_silence: float = 0.2) -> np.ndarray:
+    """
+    Detects speech segments of a signal.
+
+    :param signal: numpy.ndarray
+        Single channel signal with samples in [-1, 1].
+    :param rate: int
+        Sample rate of the signal.
+    :param threshold: float
+        Volume threshold in percent of the full scale (the same unit sox
+        uses). Frames whose RMS is below this value are considered silence.
+    :param frame_duration: float
+        Frame length in seconds.
+    :param hop_duration: float
+        Hop between frames in seconds.
+    :param min_speech: float
+        Speech segments shorter than this duration (seconds) are dropped.
+    :param min_silence: float
+        Silence gaps shorter than this duration (seconds) are merged into the
+        surrounding speech.
+
+    :return: numpy.ndarray, shape=(n_segments, 2)
+        Sorted, disjoint (start, end) pairs in seconds.
+    """
+    if len(signal) == 0:
+        return np.zeros((0, 2))
+    frame_length = max(1, int(round(frame_duration * rate)))
+    hop_length = max(1, int(round(hop_duration * rate)))
+    active = frame_rms(signal, frame_length, hop_length) >= threshold / 100
+    # Rising and falling edges of the activity mask give the segment bounds
+    edges = np.diff(np.concatenate(([False], active, [False])).astype(np.int8))
+    first = np.flatnonzero(edges == 1)
+    last = np.flatnonzero(edges == -1) - 1
+    duration = len(signal) / rate
+    segments = np.stack((first * hop_length / rate,
+                         np.minimum((last * hop_length + frame_length) / rate,
+                                    duration)), axis=1)
+    return _drop_short(_merge_gaps(segments, min_silence), min_speech)
+
+
+def _merge_gaps(segments: np.ndarray, min_gap: float) -> np.ndarray:
+    """Merges consecutive segments separated by less than min_gap seconds"""
+    if len(segments) < 2:
+        return segments
+    opens = np.concatenate(([True], segments[1:, 0] - segments[:-1, 1] >=
+                            min_gap))
+    closes = np.concatenate((opens[1:], [True]))
+    return np.stack((segments[opens, 0], segments[closes, 1]), axis=1)
+
+
+def _drop_short(segments: np.ndarray, min_length: float) -> np.ndarray:
+    """Removes segments shorter than min_length seconds"""
+    return segments[segments[:, 1] - segments[:, 0] >= min_length]
+
+
+def detect_speech(file_path: str, **vad_kw) -> (np.ndarray, float):
+    """
+    Detects speech segments of an audio file.
+
+    :param file_path: str
+        Path of the audio file.
+    :param vad_kw:
+        Additional kwargs are passed on to speech_segments.
+
+    :return: tuple (numpy.ndarray, float)
+        The speech segments (see speech_segments) and the audio duration in
+        seconds.
+    """
+    signal, rate = read_mono(file_path)
+    return speech_segments(signal, rate, **vad_kw), len(signal) / rate
+
+
+def speech_ratio(segments: np.ndarray, starts, seconds: float) -> np.ndarray:
+    """
+    Computes the fraction of speech inside each window.
+
+    :param segments: numpy.ndarray, shape=(n_segments, 2)
+        Speech segments (see speech_segments).
+    :param starts: array like
+        Start of each window in seconds.
+    :param seconds: float
+        Length of the windows in seconds.
+
+    :return: numpy.ndarray
+        Fraction of speech in [0, 1] of each window.
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    if len(segments) == 0 or seconds <= 0:
+        return np.zeros(len(starts))
+    # Piecewise linear function of the accumulated speech time up to t
+    bounds = segments.reshape(-1)
+    lengths = segments[:, 1] - segments[:, 0]
+    accumulated = np.zeros(len(bounds))
+    accumulated[1::2] = np.cumsum(lengths)
+    accumulated[2::2] = accumulated[1:-1:2]
+    speech = np.interp(starts + seconds, bounds, accumulated) - \
+        np.interp(starts, bounds, accumulated)
+    return speech / seconds
+
+
+def place_windows(segments: np.ndarray, duration: float, starts,
+                  seconds: float, mode: str = 'skip',
+                  min_ratio: float = 0.5) -> np.ndarray:
+    """
+    Places trimming windows over speech.
+
+    :param segments: numpy.ndarray, shape=(n_segments, 2)
+        Speech segments (see speech_segments).
+    :param duration: float
+        Duration of the audio in seconds.
+    :param starts: array like
+        Candidate window starts in seconds.
+    :param seconds: float
+        Length of the windows in seconds.
+    :param mode: str
+        'skip' drops the windows whose speech fraction is below min_ratio.
+        'center' moves those windows to be centered on the nearest speech
+        segment, dropping them only if they still do not contain enough speech.
+    :param min_ratio: float
+        Minimum fraction of speech a window must contain.
+
+    :return: numpy.ndarray
+        Sorted, unique window starts in seconds. Audio shorter than a window
+        gets a single window centered on its speech (starting before 0 or
+        ending after the audio, the window must be padded), if it contains
+        speech.
+
+    >>> place_windows(np.array([[0.2, 0.6]]), 0.8, [0], 1.).tolist()
+    [-0.1]
+    """
+    if mode not in ['skip', 'center']:
+        raise ValueError('Invalid window placement mode: {}'.format(mode))
+    if duration < seconds:
+        if len(segments) == 0:
+            return np.zeros(0)
+        center = (segments[0, 0] + segments[-1, 1]) / 2
+        start = np.clip(center - seconds / 2, duration - seconds, 0)
+        return np.round(np.array([start]), 3)
+    starts = np.asarray(starts, dtype=np.float64)
+    starts = starts[starts + seconds <= duration]
+    if len(segments) == 0 or len(starts) == 0:
+        return np.zeros(0)
+    ratio = speech_ratio(segments, starts, seconds)
+    if mode == 'center':
+        centers = segments.mean(axis=1)
+        nearest = np.abs((starts + seconds / 2)[:, None] -
+                         centers[None, :]).argmin(axis=1)
+        moved = np.clip(centers[nearest] - seconds / 2, 0, duration - seconds)
+        starts = np.where(ratio < min_ratio, moved, starts)
+        ratio = speech_ratio(segments, starts, seconds)
+    # Windows moved to the same segment collapse into a single window
+    return np.unique(np.round(starts[ratio >= min_ratio], 3))
+
+
+def keep_speech(data: np.ndarray, rate: int, segments: np.ndarray,
+                max_silence: float = 2.) -> np.ndarray:
+    """
+    Removes the silence of a signal.
+
+    Leading and trailing silence are removed, and silence gaps between speech
+    segments are shortened to max_silence seconds.
+
+    :param data: numpy.ndarray, shape=(samples, ...)
+        Signal, with samples in the first axis.
+    :param rate: int
+        Sample rate of the signal.
+    :param segments: numpy.ndarray, shape=(n_segments, 2)
+        Speech segments (see speech_segments).
+    :param max_silence: float
+        Maximum duration of the kept silence gaps in seconds.
+
+    :return: numpy.ndarray
+        The signal without the silence periods.
+    """
+    if len(segments) == 0:
+        return data[:0]
+    begin = np.round(segments[:, 0] * rate).astype(np.int64)
+    end = np.round(segments[:, 1] * rate).astype(np.int64)
+    # Extend each segment up to max_silence into the following gap
+    end[:-1] = np.minimum(begin[1:], end[:-1] + int(max_silence * rate))
+    delta = np.zeros(len(data) + 1, dtype=np.int64)
+    np.add.at(delta, np.clip(begin, 0, len(data)), 1)
+    np.add.at(delta, np.clip(end, 0, len(data)), -1)
+    return data[np.cumsum(delta[:-1]) > 0]
@@ -1,5 +1,7 @@
 from abc import abstractmethod
+import os
 import random
+import numpy as np
 
 
 class BaseDataLoader:
@@ -64,3 +66,25 @@ class BaseDataLoader:
     def labels(self):
         """Returns a list containing the labels of each instance of data"""
         return self._labels
+
+
+def loader_kw(file_path: str) -> dict:
+    """
+    Chooses the loader functions of the Generator by the file extension.
+
+    :param file_path: str
+        Path of a data file (.npy or an image).
+
+    :return: dict
+        The loader_fn, loader_into_fn and shape_fn kwargs.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.npy':
+        from util.dataloader import numpyloader
+        return {'loader_fn': np.load, 'loader_into_fn': numpyloader.load_into,
+                'shape_fn': numpyloader.read_shape}
+    if extension in ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff'):
+        from util.dataloader import imgload
+        return {'loader_fn': imgload.img_load,
+                'loader_into_fn': imgload.img_load_into}
+    raise ValueError('No loader for {} files'.format(extension))
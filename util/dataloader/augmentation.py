@@ -0,0 +1,192 @@
+"""
+This module implements on-the-fly data augmentation of waveforms.
+
+Instead of materializing every pitch, speed, noise, robot and phone variant on
+disk (see script_create_dataset.py), a WaveformAugmenter applies randomized
+effects to each batch while training. It can be plugged into the
+util.dataloader.batching.sequence.Generator through the augment_fn argument,
+which provides a random generator seeded by the batch index, so the applied
+effects are reproducible regardless of the order the batches are requested.
+"""
+import concurrent.futures
+import numpy as np
+import soundfile as sf
+from config import Config
+from util.audio import effects
+
+
+class WaveformAugmenter:
+    """Applies randomized audio effects to batches of waveforms"""
+
+    def __init__(self, rate: int = 16000, p_speed: float = 0.5,
+                 p_pitch: float = 0.5, p_noise: float = 0.5,
+                 p_low_pass: float = 0., p_robot: float = 0.,
+                 p_phone: float = 0., snr: tuple = (5., 20.),
+                 low_pass: tuple = (1000., 4000.), noises: list = None,
+                 num_workers: int = 1, config: Config = Config()):
+        """
+        Initializes an augmenter.
+
+        Each effect is applied to each waveform with its own probability.
+        Speeds and pitch shifts are drawn from the values used to augment
+        data on disk (config.speeds and config.semitones).
+
+        :param rate: int
+            Sample rate of the waveforms.
+
+        :param p_speed: float
+            Probability of changing the speed.
+
+        :param p_pitch: float
+            Probability of changing the pitch.
+
+        :param p_noise: float
+            Probability of adding noise.
+
+        :param p_low_pass: float
+            Probability of applying a low pass filter.
+
+        :param p_robot: float
+            Probability of applying the robot voice effect.
+
+        :param p_phone: float
+            Probability of applying the phone voice effect.
+
+        :param snr: tuple, shape=(min, max)
+            Range of the signal to noise ratio (dB) of the added noise.
+
+        :param low_pass: tuple, shape=(min, max)
+            Range of the low pass filter cutoff frequency.
+
+        :param noises: list
+            Paths of noise files (e.g. config.noises). Default to None, white
+            noise will be added.
+
+        :param num_workers: int
+            Number of threads used to process each batch. The random
+            parameters are drawn before splitting the batch, so the result
+            does not depend on the number of workers.
+
+        :param config: Config
+            Configuration providing the speeds and semitones.
+        """
+        self._rate = rate
+        self._p = {'low_pass': p_low_pass, 'speed': p_speed, 'pitch': p_pitch,
+                   'robot': p_robot, 'phone': p_phone, 'noise': p_noise}
+        self._snr = snr
+        self._low_pass = low_pass
+        self._speeds = np.asarray(config.speeds)
+        self._semitones = np.asarray(config.semitones)
+        self._noises = [self._load_noise(n) for n in noises] \
+            if noises is not None else None
+        self._num_workers = num_workers
+        self._executor = None
+
+    def _load_noise(self, noise_path: str) -> np.ndarray:
+        data, rate = sf.read(noise_path, dtype='float32', always_2d=True)
+        data = data.mean(axis=1)
+        if rate != self._rate:
+            positions = np.arange(0, len(data) - 1, rate / self._rate)
+            data = np.interp(positions, np.arange(len(data)), data).\
+                astype(np.float32)
+        return data
+
+    def _draw_noise(self, rng, n: int, length: int) -> np.ndarray:
+        """Draws n noise excerpts of the given length"""
+        if self._noises is None:
+            return rng.standard_normal((n, length), dtype=np.float32)
+        noise = np.empty((n, length), np.float32)
+        choices = rng.integers(0, len(self._noises), n)
+        offsets = rng.random(n)
+        for i, (c, o) in enumerate(zip(choices, offsets)):
+            source = self._noises[c]
+            # Repeat the noise if it is shorter than the waveform
+            positions = int(o * len(source)) + np.arange(length)
+            noise[i] = source[positions % len(source)]
+        return noise
+
+    def _draw(self, rng, n: int, length: int) -> dict:
+        """Draws the random parameters of each effect for a batch"""
+        masks = {k: rng.random(n) < p for k, p in self._p.items()}
+        params = {
+            'speed': rng.choice(self._speeds, n),
+            'pitch': rng.choice(self._semitones, n),
+            'low_pass': rng.uniform(*self._low_pass, n),
+            'snr': rng.uniform(*self._snr, n),
+        }
+        params['noise'] = self._draw_noise(rng, int(masks['noise'].sum()),
+                                           length)
+        return {'masks': masks, 'params': params}
+
+    def _apply(self, waves: np.ndarray, masks: dict, params: dict) -> \
+            np.ndarray:
+        """Applies the effects to a chunk of waveforms"""
+        rows = masks['low_pass']
+        if rows.any():
+            waves[rows] = effects.lowpass(waves[rows], self._rate,
+                                          params['low_pass'][rows])
+        rows = masks['speed']
+        if rows.any():
+            waves[rows] = effects.speed(waves[rows], params['speed'][rows])
+        rows = masks['pitch']
+        if rows.any():
+            waves[rows] = effects.pitch(waves[rows], params['pitch'][rows])
+        rows = masks['robot']
+        if rows.any():
+            waves[rows] = effects.robot(waves[rows], self._rate)
+        rows = masks['phone']
+        if rows.any():
+            waves[rows] = effects.phone(waves[rows], self._rate)
+        rows = masks['noise']
+        if rows.any():
+            waves[rows] = effects.add_noise(waves[rows], params['noise'],
+                                            params['snr'][rows])
+        return waves
+
+    def __call__(self, batch, rng: np.random.Generator = None) -> np.ndarray:
+        """
+        Augments a batch of waveforms.
+
+        :param batch: array like, shape=(batch, samples) or (batch, samples, 1)
+            Waveforms.
+        :param rng: numpy.random.Generator
+            Random generator. Default to None (a new unseeded generator).
+
+        :return: numpy.ndarray
+            The augmented waveforms (float32) with the shape of the batch.
+        """
+        batch = np.asarray(batch)
+        if batch.ndim == 3 and batch.shape[2] != 1 or batch.ndim > 3:
+            raise ValueError('Expected waveforms of shape (batch, samples) or '
+                             '(batch, samples, 1), got {}'.format(batch.shape))
+        waves = batch.reshape(len(batch), -1).astype(np.float32)
+        if rng is None:
+            rng = np.random.default_rng()
+        drawn = self._draw(rng, len(waves), waves.shape[1])
+
+        if self._num_workers == 1 or len(waves) < 2:
+            return self._apply(waves, **drawn).reshape(batch.shape)
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self._num_workers)
+        # Rows with noise index the drawn noise in order
+        noise_index = np.cumsum(drawn['masks']['noise']) - 1
+        futures = []
+        for rows in np.array_split(np.arange(len(waves)), self._num_workers):
+            masks = {k: m[rows] for k, m in drawn['masks'].items()}
+            params = {k: p[rows] for k, p in drawn['params'].items()
+                      if k != 'noise'}
+            params['noise'] = drawn['params']['noise'][
+                noise_index[rows][masks['noise']]]
+            futures.append((rows, self._executor.submit(
+                self._apply, waves[rows], masks, params)))
+        for rows, f in futures:
+            waves[rows] = f.result()
+        return waves.reshape(batch.shape)
+
+    def __getstate__(self):
+        # Thread pools can not be pickled (e.g. Keras multiprocessing)
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
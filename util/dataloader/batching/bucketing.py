@@ -0,0 +1,246 @@
+"""
+This module implements a generator of batches of variable length data (e.g.
+audio of different durations), grouping samples of similar length so each
+batch is only padded to its own maximum length.
+
+Usage:
+    generator = BucketGenerator(paths, labels, 32, loader_fn=load_wav,
+                                length_fn=wav_length)
+    (x, lengths), y = generator[0]
+"""
+import concurrent.futures
+import os
+import numpy
+from util.dataloader.batching.sequence import Generator
+
+# Generator options not implemented by the variable length batches
+UNSUPPORTED = ('expected_shape', 'buffers', 'validate', 'loader_into_fn',
+               'shape_fn', 'shuffle_block')
+
+
+def wav_length(path: str) -> int:
+    """
+    Reads the number of frames of an audio file, without reading its data.
+
+    :param path: str
+        Path to the audio file.
+
+    :return: int
+        The number of frames.
+    """
+    import soundfile as sf
+    # soundfile does not raise FileNotFoundError, expected by not_found_ok
+    if not os.path.isfile(path):
+        raise FileNotFoundError(path)
+    return sf.info(path).frames
+
+
+def npy_length(path: str) -> int:
+    """
+    Reads the length (first dimension) of the array saved in a .npy file,
+    without reading its data.
+
+    :param path: str
+        Path to the .npy file.
+
+    :return: int
+        The length of the array.
+    """
+    from util.dataloader.numpyloader import read_shape
+    return read_shape(path)[0]
+
+
+class BucketGenerator(Generator):
+    """A generator which provides batches of samples of similar length"""
+
+    def __init__(self, paths, labels, batch_size: int,
+                 lengths=None, length_fn: callable = None,
+                 pool_batches: int = 50, max_length: int = None,
+                 pad_value=0, output: str = 'lengths', num_workers: int = 1,
+                 not_found_ok=False, **kwargs):
+        """
+        Initializes a generator.
+
+        The samples are shuffled at every epoch, split in pools of
+        pool_batches batches and sorted by length within each pool. The order
+        of the batches is shuffled again, so long and short batches alternate.
+
+        :param paths:
+            List containing the data file paths to load.
+
+        :param labels:
+            List containing the labels of each data.
+
+        :param batch_size: int
+            The size of the batch to queue.
+
+        :param lengths:
+            Length (first dimension) of each data, e.g. the number of audio
+            frames. If None, it is read by length_fn.
+
+        :param length_fn: callable(source_path: str) -> int
+            A function to read the length of the data without loading it, e.g.
+            wav_length or npy_length. Used if the lengths are not provided.
+
+        :param pool_batches: int
+            Number of batches sorted together. Greater pools have less
+            padding, and less random batches. Default to 50.
+
+        :param max_length: int
+            Data longer than max_length is cropped. Default to None (no
+            cropping).
+
+        :param pad_value:
+            Value of the padding. Default to 0.
+
+        :param output: str
+            'lengths' to return ((data, lengths), labels), 'mask' to return
+            ((data, mask), labels), with a boolean mask of shape
+            (batch, length), or None to return (data, labels).
+
+        :param num_workers: int
+            Number of threads reading the lengths. Default to 1.
+
+        :param not_found_ok: bool
+            If false, will raise a FileNotFoundError, if true, files not found
+            when the lengths are read are removed from the dataset, and files
+            not found when a batch is loaded (e.g. with provided lengths) are
+            left out of the batch.
+
+        :param kwargs:
+            Additional kwargs to be passed on to the Generator (e.g. loader_fn,
+            pre_process_fn, augment_fn, seed, cache). The expected_shape,
+            buffers, validate, loader_into_fn, shape_fn and shuffle_block
+            arguments are not supported (ValueError is raised).
+        """
+        if output not in ('lengths', 'mask', None):
+            raise ValueError('Invalid output: {}. Choose lengths, mask or '
+                             'None'.format(output))
+        unsupported = sorted(k for k in UNSUPPORTED
+                             if kwargs.get(k) not in (None, False, 0))
+        if len(unsupported) > 0:
+            raise ValueError('Not supported by the BucketGenerator: {}'.
+                             format(', '.join(unsupported)))
+        if lengths is None:
+            if length_fn is None:
+                raise ValueError('Provide the lengths or a length_fn')
+            lengths = self._read_lengths(paths, length_fn, num_workers,
+                                         not_found_ok)
+            found = [i for i, l in enumerate(lengths) if l is not None]
+            if len(found) < len(paths):
+                print('[WARN] {} of {} files not found'.
+                      format(len(paths) - len(found), len(paths)))
+                paths = [paths[i] for i in found]
+                labels = [labels[i] for i in found]
+                lengths = [lengths[i] for i in found]
+        self._lengths = numpy.asarray(lengths, dtype=numpy.int64)
+        if len(self._lengths) != len(paths):
+            raise ValueError('Expected {} lengths, got {}'.
+                             format(len(paths), len(self._lengths)))
+        self._pool_batches = pool_batches
+        self._max_length = max_length
+        self._pad_value = pad_value
+        self._output = output
+        super(BucketGenerator, self).__init__(paths, labels, batch_size,
+                                              not_found_ok=not_found_ok,
+                                              **kwargs)
+
+    @staticmethod
+    def _read_lengths(paths, length_fn: callable, num_workers: int,
+                      not_found_ok: bool) -> list:
+        def length(path):
+            try:
+                return length_fn(path)
+            except FileNotFoundError:
+                if not not_found_ok:
+                    raise
+                return None
+        with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+            return list(executor.map(length, paths))
+
+    def _permutation(self) -> numpy.ndarray:
+        """Order of the samples, batches of similar length are contiguous"""
+        n = len(self._paths)
+        rng = numpy.random.default_rng([self._seed, self._epoch])
+        order = rng.permutation(n) if self._shuffle else numpy.arange(n)
+        # Sort each pool by length (stable, so ties keep the random order)
+        pool = max(self._pool_batches, 1) * self._batch_size
+        pools = numpy.arange(n) // pool
+        order = order[numpy.lexsort((self._lengths[order], pools))]
+        if not self._shuffle:
+            return order
+        # Shuffle the order of the complete batches
+        complete = (n // self._batch_size) * self._batch_size
+        batches = order[:complete].reshape(-1, self._batch_size)
+        return numpy.concatenate([batches[rng.permutation(len(batches))].
+                                  ravel(), order[complete:]])
+
+    def _load_variable(self, path) -> numpy.ndarray:
+        """Loads a sample, from the cache if available"""
+        if self._cache is not None:
+            data = self._cache.get(path)
+            if data is not None:
+                return data
+        data = numpy.asarray(self.loader(path, **self._loaderkw))
+        if self._cache is not None:
+            self._cache.put(path, data)
+        return data
+
+    def __getitem__(self, index):
+        """
+        Gets a batch of data, padded to its maximum length.
+
+        :return: tuple
+            ((data, lengths), labels), ((data, mask), labels) or
+            (data, labels), depending on the output.
+        """
+        indices = []
+        samples = []
+        for i in self._indices(index):
+            try:
+                samples.append(self._load_variable(self._paths[i]))
+            except FileNotFoundError:
+                if not self._not_found_ok:
+                    raise
+                continue
+            indices.append(i)
+        lengths = numpy.array([len(s) for s in samples], dtype=numpy.int64)
+        if self._max_length is not None:
+            lengths = numpy.minimum(lengths, self._max_length)
+        length = lengths.max() if len(lengths) > 0 else 0
+        x = numpy.full((len(samples), length) + samples[0].shape[1:]
+                       if len(samples) > 0 else (0, 0), self._pad_value,
+                       dtype=self._dtype or (samples[0].dtype if samples
+                                             else numpy.float64))
+        for k, (sample, n) in enumerate(zip(samples, lengths)):
+            x[k, :n] = sample[:n]
+        y = numpy.asarray([self._labels[i] for i in indices])
+
+        if self._pre_process_fn is not None:
+            x = self._pre_process_fn(x)
+
+        if self._augment_fn is not None:
+            x = self._augment_fn(x, self._rng(index))
+
+        x = numpy.asarray(x)
+        if self._output == 'lengths':
+            return (x, lengths), y
+        elif self._output == 'mask':
+            return (x, numpy.arange(length) < lengths[:, None]), y
+        return x, y
+
+    @property
+    def lengths(self) -> numpy.ndarray:
+        """Returns the length of each instance of data"""
+        return self._lengths
+
+    @property
+    def padding_ratio(self) -> float:
+        """Returns the fraction of padding in the batches of the epoch"""
+        n = len(self) * self._batch_size
+        lengths = self._lengths[self._order[:n]]
+        if self._max_length is not None:
+            lengths = numpy.minimum(lengths, self._max_length)
+        padded = lengths.reshape(-1, self._batch_size).max(axis=1).sum() * \
+            self._batch_size
+        return 1. - lengths.sum() / padded if padded > 0 else 0.
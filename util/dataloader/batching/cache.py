@@ -0,0 +1,131 @@
+"""
+This module implements an in memory cache of samples, limited by a budget of
+bytes, to serve the samples of a Generator across epochs.
+
+Usage:
+    cache = SampleCache(2 * 1024 ** 3)
+    generator = Generator(paths, labels, 32, loader_fn=numpy.load, cache=cache)
+    ...
+    print(cache.stats)
+"""
+import collections
+import threading
+import numpy
+
+
+class SampleCache:
+    """A cache of arrays limited by a budget of bytes"""
+
+    def __init__(self, max_bytes: int, policy: str = 'lru'):
+        """
+        Initializes a cache.
+
+        :param max_bytes: int
+            Budget of bytes of the cached arrays. Arrays greater than the
+            budget are never cached.
+
+        :param policy: str
+            Eviction policy. 'lru' evicts the least recently used array.
+            'clock' evicts the oldest array not used since the last time it was
+            checked (second chance), which does not reorder the entries on each
+            hit. Default to 'lru'.
+
+        Note: if the samples exceed the budget and are read in the same order
+        every epoch, both policies evict each sample before it is read again.
+        The hit ratio approaches max_bytes / dataset size when the order is
+        shuffled.
+        """
+        if policy not in ('lru', 'clock'):
+            raise ValueError('Invalid policy: {}. Choose lru or '
+                             'clock'.format(policy))
+        self._max_bytes = max_bytes
+        self._policy = policy
+        # key -> [array, referenced]
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Gets a cached array.
+
+        :param key:
+            Key of the array (e.g. its path).
+
+        :return: numpy.ndarray
+            The read only array, or None if it is not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self._policy == 'lru':
+                self._entries.move_to_end(key)
+            else:
+                entry[1] = True
+            return entry[0]
+
+    def put(self, key, value: numpy.ndarray):
+        """
+        Caches a copy of an array, evicting others if the budget is exceeded.
+
+        :param key:
+            Key of the array (e.g. its path).
+
+        :param value: numpy.ndarray
+            The array.
+        """
+        if value.nbytes > self._max_bytes:
+            return
+        value = numpy.array(value)
+        value.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[0].nbytes
+            while self._bytes + value.nbytes > self._max_bytes:
+                self._evict()
+            self._entries[key] = [value, False]
+            self._bytes += value.nbytes
+
+    def _evict(self):
+        while True:
+            key, entry = self._entries.popitem(last=False)
+            if self._policy == 'clock' and entry[1]:
+                # Second chance
+                entry[1] = False
+                self._entries[key] = entry
+                continue
+            self._bytes -= entry[0].nbytes
+            self.evictions += 1
+            return
+
+    def clear(self):
+        """Removes all the arrays (the counters are kept)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def nbytes(self) -> int:
+        """Returns the total size of the cached arrays"""
+        return self._bytes
+
+    @property
+    def stats(self) -> dict:
+        """Returns the counters, the number of entries and the cached bytes"""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups > 0 else 0.,
+                'evictions': self.evictions, 'entries': len(self),
+                'bytes': self._bytes, 'max_bytes': self._max_bytes}
@@ -0,0 +1,275 @@
+"""
+This module implements a prefetcher of batches for the Generator of
+util.dataloader.batching.sequence.
+
+The next batches are prepared in background threads (or forked processes)
+while the current batch is consumed, so the training computation and the disk
+reads overlap without the multiprocessing of Keras (which pickles the whole
+generator, including its loader functions).
+
+The workers belong to the sequence: Keras requests the batches from a single
+thread (the Keras workers of the sequence are always 1), and the requests are
+serialized, so the sequence must not be given Keras workers.
+
+Usage:
+    generator = Generator(paths, labels, 32, loader_fn=numpy.load)
+    prefetcher = Prefetcher(generator, depth=4, workers=2)
+    model.fit_generator(prefetcher, epochs=10)
+    print(prefetcher.stats)
+"""
+import collections
+import concurrent.futures
+import multiprocessing
+import threading
+import time
+import keras
+
+# Generator of the forked worker processes (see Prefetcher mode='process')
+_generator = None
+
+
+def _init_process(generator):
+    global _generator
+    _generator = generator
+
+
+def _process_batch(index, epoch):
+    _generator.set_epoch(epoch)
+    return _generator[index]
+
+
+class BackgroundSequence(keras.utils.Sequence):
+    """Base class of the sequences whose batches are prepared by background
+    workers (see Prefetcher and shm.SharedMemoryWorkers)"""
+
+    def __init__(self, generator, workers: int, depth: int, keep: int):
+        """
+        :param generator: util.dataloader.batching.sequence.Generator
+            The generator of the batches.
+        :param workers: int
+            Number of workers preparing the batches.
+        :param depth: int
+            Number of batches prepared ahead of the requested one.
+        :param keep: int
+            Number of returned batches the consumer holds at the same time.
+        """
+        # The workers are managed here, Keras requests the batches from a
+        # single thread
+        super(BackgroundSequence, self).__init__(workers=1,
+                                                 use_multiprocessing=False)
+        self._generator = generator
+        self._n_workers = workers
+        self._depth = depth
+        self._keep = keep
+        self._pending = dict()
+        # The buffers of the returned batches
+        self._returned = collections.deque()
+        self._access = threading.Lock()
+        self._requests = 0
+        self._waits = 0
+        self._wait_time = 0.
+
+    def _start(self):
+        """Starts the workers, if not started"""
+        raise NotImplementedError
+
+    def _get(self, index):
+        """Gets a batch, and schedules the preparation of the next ones"""
+        raise NotImplementedError
+
+    def _release(self, buffers):
+        """Makes the buffers of a batch available to the workers"""
+        raise NotImplementedError
+
+    def _epoch_end(self):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+    def _wait(self, ready: callable, wait: callable):
+        """Calls wait until ready() is true, counting the waits"""
+        if not ready():
+            self._waits += 1
+            start = time.perf_counter()
+            while not ready():
+                wait()
+            self._wait_time += time.perf_counter() - start
+
+    def _hold(self, buffers):
+        """Holds the buffers of a returned batch, and releases the buffers of
+        the batch returned keep batches before"""
+        self._returned.append(buffers)
+        if len(self._returned) > self._keep:
+            self._release(self._returned.popleft())
+
+    def __getitem__(self, index):
+        """
+        Gets a batch of data, and schedules the preparation of the next ones.
+
+        :return: (numpy.ndarray, numpy.ndarray)
+            See Generator.__getitem__. The arrays may be views of buffers
+            reused after keep more batches are returned.
+        """
+        with self._access:
+            self._start()
+            self._requests += 1
+            return self._get(index)
+
+    def __len__(self):
+        """Denotes the number of batches per epoch"""
+        return len(self._generator)
+
+    def on_epoch_end(self):
+        with self._access:
+            self._epoch_end()
+
+    def close(self):
+        """Stops the workers"""
+        with self._access:
+            self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def stats(self) -> dict:
+        """
+        Returns the number of requested batches, how many of them the consumer
+        had to wait for, the total waiting time (seconds) and the ratio of
+        waits.
+        """
+        return {'requests': self._requests, 'waits': self._waits,
+                'wait_time': self._wait_time,
+                'wait_ratio': self._waits / max(self._requests, 1)}
+
+
+class Prefetcher(BackgroundSequence):
+    """A sequence which prepares the next batches of a Generator in
+    background"""
+
+    def __init__(self, generator, depth: int = 2, workers: int = 1,
+                 mode: str = 'thread', keep: int = 1):
+        """
+        Initializes a prefetcher.
+
+        :param generator: util.dataloader.batching.sequence.Generator
+            The generator of the batches.
+
+        :param depth: int
+            Number of batches prepared ahead of the requested one.
+
+        :param workers: int
+            Number of threads or processes preparing the batches.
+
+        :param mode: str
+            'thread' or 'process'. Threads fill a set of reusable batch
+            buffers, and are enough when the loader releases the GIL (file
+            reads, numpy.load, decoding in C libraries). Processes are
+            forked, so the generator is not pickled, but each batch is
+            pickled back to the consumer. Default to 'thread'.
+
+        :param keep: int
+            Number of returned batches the consumer holds at the same time
+            (e.g. the Keras queue). The buffer of a batch is only reused after
+            keep more batches are returned. Used with mode='thread'. Default to
+            1.
+        """
+        if mode not in ('thread', 'process'):
+            raise ValueError('Invalid mode: {}. Choose thread or process'.
+                             format(mode))
+        super(Prefetcher, self).__init__(generator, workers, depth, keep)
+        self._mode = mode
+        self._executor = None
+        # Buffers not in use
+        self._free = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        if self._executor is not None:
+            return
+        if self._mode == 'thread':
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self._n_workers)
+        else:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self._n_workers,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_process, initargs=(self._generator,))
+
+    def _thread_batch(self, index):
+        """Prepares a batch in a free buffer (thread mode)"""
+        with self._lock:
+            buffers = self._free.pop() if self._free else None
+        if buffers is None:
+            buffers = self._generator._allocate(index)
+        try:
+            return self._generator._batch(index, *buffers), buffers
+        except BaseException:
+            self._release(buffers)
+            raise
+
+    def _release(self, buffers):
+        with self._lock:
+            self._free.append(buffers)
+
+    def _submit(self, index):
+        if index in self._pending or not 0 <= index < len(self):
+            return
+        if self._mode == 'thread':
+            future = self._executor.submit(self._thread_batch, index)
+        else:
+            future = self._executor.submit(_process_batch, index,
+                                           self._generator.epoch)
+        self._pending[index] = future
+
+    def _discard(self, future):
+        """Drops a pending batch, releasing its buffer once it is prepared"""
+        if future.cancel() or self._mode != 'thread':
+            return
+
+        def release(f):
+            if f.exception() is None:
+                self._release(f.result()[1])
+        future.add_done_callback(release)
+
+    def _get(self, index):
+        self._submit(index)
+        future = self._pending.pop(index)
+        # Batches out of the new window are not going to be requested
+        for i in [i for i in self._pending
+                  if not index < i <= index + self._depth]:
+            self._discard(self._pending.pop(i))
+        for i in range(index + 1, index + self._depth + 1):
+            self._submit(i)
+
+        self._wait(future.done, lambda: concurrent.futures.wait([future]))
+        if self._mode == 'process':
+            return future.result()
+
+        batch, buffers = future.result()
+        self._hold(buffers)
+        return batch
+
+    def _epoch_end(self):
+        # The pending batches were prepared for the previous epoch
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for future in pending:
+            self._discard(future)
+        concurrent.futures.wait(pending)
+        self._generator.on_epoch_end()
+        if self._executor is not None:
+            for i in range(self._depth):
+                self._submit(i)
+
+    def _close(self):
+        if self._executor is not None:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            self._executor.shutdown()
+            self._executor = None
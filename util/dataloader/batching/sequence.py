@@ -6,8 +6,10 @@ A good usage of this module is in the fit_generator method of Keras library.
 """
 
 from abc import abstractmethod
+import concurrent.futures
+import itertools
+import threading
 import keras
-import random
 import numpy
 
 
@@ -17,7 +19,11 @@ class Generator(keras.utils.Sequence):
     def __init__(self, paths, labels, batch_size: int,
                  loader_fn: callable = None, pre_process_fn: callable = None,
                  shuffle: bool = True, expected_shape: tuple=None,
-                 not_found_ok=False, **loader_kw):
+                 not_found_ok=False, augment_fn: callable = None,
+                 seed: int = None, loader_into_fn: callable = None,
+                 dtype=None, buffers: int = 0, validate: bool = False,
+                 shape_fn: callable = None, num_workers: int = 1,
+                 cache=None, shuffle_block: int = None, **loader_kw):
         """
         Initializes a generator.
 
@@ -39,11 +45,14 @@ class Generator(keras.utils.Sequence):
             function.
 
         :param pre_process_fn: callable(data) -> new_data
-            A function to pre process the data after it is loaded, and before
-            returning the batch. Optional.
+            A function to pre process the batch of data after it is loaded,
+            and before returning the batch. The batch is a numpy.ndarray (not
+            a list of samples), and may be a view of a reused buffer.
+            Optional.
 
         :param shuffle: bool
-            If true, shuffle the paths before loading them.
+            If true, shuffle the order of the samples at every epoch (seeded by
+            the seed and the epoch).
 
         :param expected_shape: tuple
             Check if the shape of each loaded data is in a proper format. If
@@ -53,12 +62,69 @@ class Generator(keras.utils.Sequence):
             If false, will raise a FileNotFoundError, if true,  will ignore
             not found files. Default to false.
 
+        :param augment_fn: callable(batch, rng) -> new_batch
+            A function to augment the batch of data after the pre processing,
+            e.g. util.dataloader.augmentation.WaveformAugmenter. It receives a
+            numpy.random.Generator seeded by the seed, the epoch and the batch
+            index, so the augmentation is reproducible. Optional.
+
+        :param seed: int
+            Seed of the shuffling and the augmentation. Default to None
+            (random seed).
+
+        :param loader_into_fn: callable(source_path: str, out: numpy.ndarray)
+            A function to load the data straight into a slot of the batch
+            array, e.g. util.dataloader.numpyloader.load_into. It must raise
+            ValueError if the data does not fit the slot. Optional, the
+            loader is used otherwise. Without a loader, the expected_shape and
+            dtype must be provided.
+
+        :param dtype:
+            Data type of the batches. Default to None (the data type of the
+            first loaded sample). Used with expected_shape, no sample is loaded
+            to size the batches.
+
+        :param buffers: int
+            Number of batch buffers reused in turns. Each call returns a batch
+            backed by the next buffer, so a returned batch is only valid until
+            the same buffer is reused, i.e. the consumer (e.g. the Keras
+            queue) must not hold more than buffers - 1 batches. Default to 0,
+            a new batch array is allocated on each call.
+
+        :param validate: bool
+            If true, the files are checked once at the initialization, and the
+            ones not found (not_found_ok) or not in the expected_shape are
+            removed from the dataset. The batches never have to load a random
+            instance. If expected_shape is None, all the files must have the
+            same shape (ValueError is raised otherwise). Default to false.
+
+        :param shape_fn: callable(source_path: str) -> tuple
+            A function to read the shape of the data without loading it, used
+            by the validation, e.g. util.dataloader.numpyloader.read_shape.
+            Optional, the data is loaded otherwise.
+
+        :param num_workers: int
+            Number of threads of the validation. Default to 1.
+
+        :param cache: util.dataloader.batching.cache.SampleCache
+            A cache of the loaded samples (before the pre processing), so the
+            samples are served from memory after the first epoch, up to the
+            budget of the cache. Worker processes have their own copy of the
+            cache. Optional.
+
+        :param shuffle_block: int
+            Used with shuffle. If provided, the order of blocks of
+            shuffle_block contiguous samples is shuffled, and then the samples
+            within each block, so the reads from sequential or packed storage
+            stay mostly sequential. Default to None (samples are shuffled
+            individually).
+
         :param loader_kw: Additional kwargs to be passed on to the loader
             function.
 
         Note: if a expected_shape is provided or not_found_ok is True, the
         __getitem__ method will load a random instance to avoid raising
-        exceptions.
+        exceptions (unless the files were validated).
         """
 
         self._paths = paths
@@ -68,13 +134,32 @@ class Generator(keras.utils.Sequence):
         self._loaderkw = loader_kw
         self._not_found_ok = not_found_ok
         self._expected_shape = expected_shape
+        self._augment_fn = augment_fn
+        self._seed = seed if seed is not None else \
+            numpy.random.SeedSequence().entropy
+        self._epoch = 0
+        self._dtype = dtype
+        self._spec = None
+        self._ring = [None] * buffers
+        self._ring_index = 0
+        self._lock = threading.Lock()
         if loader_fn is not None:
             self.loader = loader_fn
-
-        if shuffle:
-            dataset = list(zip(self._paths, self._labels))
-            random.shuffle(dataset)
-            self._paths, self._labels = zip(*dataset)
+        if loader_into_fn is not None:
+            self.loader_into = loader_into_fn
+        self._shape_fn = shape_fn
+        self._invalid = []
+        self._cache = cache
+
+        if validate:
+            self._validate(num_workers)
+        labels_array = numpy.asarray(self._labels)
+        # Labels may be vectors, e.g. one-hot encoded
+        self._label_dtype = labels_array.dtype
+        self._label_shape = labels_array.shape[1:]
+        self._shuffle = shuffle
+        self._shuffle_block = shuffle_block
+        self._order = self._permutation()
 
     @abstractmethod
     def loader(self, source_path: str, *args, **kwargs):
@@ -96,77 +181,219 @@ class Generator(keras.utils.Sequence):
         raise NotImplementedError('Loader not implemented. Must implement '
                                   'a loader for correct operation.')
 
+    # Optional loader which writes into an existing array (see loader_into_fn)
+    loader_into = None
+
+    def _rng(self, index) -> numpy.random.Generator:
+        """Random generator of a batch, seeded by the epoch and batch index"""
+        return numpy.random.default_rng([self._seed, self._epoch, index])
+
+    def _permutation(self) -> numpy.ndarray:
+        """Order of the samples in the current epoch"""
+        n = len(self._paths)
+        if not self._shuffle:
+            return numpy.arange(n)
+        rng = numpy.random.default_rng([self._seed, self._epoch])
+        if self._shuffle_block is None or self._shuffle_block <= 1:
+            return rng.permutation(n)
+        blocks = numpy.arange(n) // self._shuffle_block
+        block_rank = rng.permutation(blocks[-1] + 1 if n > 0 else 0)
+        # Sorted by the rank of the block, and randomly within the block
+        return numpy.lexsort((rng.random(n), block_rank[blocks]))
+
+    def _indices(self, index) -> numpy.ndarray:
+        """Indices of the samples of a batch"""
+        return self._order[(index*self._batch_size):
+                           ((index+1)*self._batch_size)]
+
+    def _read_shape(self, path):
+        """Shape of a sample, or None if it is not found (not_found_ok)"""
+        try:
+            if self._shape_fn is not None:
+                return tuple(self._shape_fn(path))
+            return numpy.shape(self.loader(path, **self._loaderkw))
+        except FileNotFoundError:
+            if not self._not_found_ok:
+                raise
+            return None
+
+    def _validate(self, num_workers: int):
+        """Removes the samples not found or not in the expected shape"""
+        with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+            shapes = list(executor.map(self._read_shape, self._paths))
+        expected_shape = self._expected_shape
+        if expected_shape is None:
+            found = {s for s in shapes if s is not None}
+            if len(found) > 1:
+                raise ValueError('The data has different shapes: {}. Provide '
+                                 'the expected_shape to ignore '
+                                 'them'.format(sorted(found)))
+            expected_shape = found.pop() if found else None
+        valid = [s is not None and s == tuple(expected_shape)
+                 for s in shapes]
+        self._invalid = [p for p, v in zip(self._paths, valid) if not v]
+        if len(self._invalid) > 0:
+            print('[WARN] {} of {} files ignored (not found or not in the '
+                  'expected shape)'.format(len(self._invalid),
+                                           len(self._paths)))
+        self._paths = [p for p, v in zip(self._paths, valid) if v]
+        self._labels = [l for l, v in zip(self._labels, valid) if v]
+        if self._expected_shape is None:
+            self._expected_shape = expected_shape
+
     def _get_random_instance(self):
         i = numpy.random.randint(0, len(self._paths))
         return self._paths[i], self._labels[i]
 
-    def __getitem__(self, index) -> (numpy.ndarray, numpy.ndarray):
+    def _load_sample(self, path, out: numpy.ndarray) -> bool:
         """
-        Gets a batch of data.
-
-        :return: (numpy.ndarray, numpy.ndarray)
-            Tuple of arrays. The first array represents the data, and the
-            second represents the labels.
+        Loads a sample into a slot of a batch, from the cache if available.
 
-        Note: in case the size of the batch is greater than the amount of
-        data available, only the read amount will be returned.
+        :return: bool
+            False if the sample does not have the expected shape.
         """
-        paths = self._paths[(index*self._batch_size):
-                            ((index+1)*self._batch_size)]
-        labels = self._labels[(index*self._batch_size):
-                              ((index+1)*self._batch_size)]
-        paths_and_labels = list(zip(paths, labels))
-        # Fill batches
-        x = []
-        y = []
-        threshold = 0
-        for path_label in paths_and_labels:
-            if self._not_found_ok:
+        if self._cache is None:
+            return self._read_sample(path, out)
+        data = self._cache.get(path)
+        if data is not None:
+            out[...] = data
+            return True
+        if not self._read_sample(path, out):
+            return False
+        self._cache.put(path, out)
+        return True
+
+    def _read_sample(self, path, out: numpy.ndarray) -> bool:
+        """Reads a sample into a slot of a batch (see _load_sample)"""
+        if self.loader_into is not None:
+            try:
+                self.loader_into(path, out, **self._loaderkw)
+            except ValueError:
+                if self._expected_shape is None:
+                    raise
+                return False
+            return True
+        data = numpy.asarray(self.loader(path, **self._loaderkw))
+        if data.shape != out.shape:
+            if self._expected_shape is None:
+                raise ValueError('Shape {} of {} differs from the shape {} of '
+                                 'the previous data. Provide the '
+                                 'expected_shape to ignore it'.
+                                 format(data.shape, path, out.shape))
+            return False
+        out[...] = data
+        return True
+
+    def _sample_spec(self, index) -> (tuple, numpy.dtype):
+        """Shape and data type of the samples, to size the batch buffers"""
+        if self._spec is None:
+            if self._expected_shape is not None and self._dtype is not None:
+                self._spec = tuple(self._expected_shape), \
+                    numpy.dtype(self._dtype)
+                return self._spec
+            paths = [self._paths[i] for i in self._indices(index)]
+            # Random instances are only drawn if the batch can not be read
+            candidates = itertools.chain(
+                paths, (self._get_random_instance()[0]
+                        for _ in range(self._batch_size)))
+            for path in candidates:
                 try:
-                    # Try to load the data
-                    x.append(self.loader(path_label[0], **self._loaderkw))
-                    y.append(path_label[1])
+                    data = numpy.asarray(self.loader(path, **self._loaderkw))
                 except FileNotFoundError:
-                    # If not found, append a new path to load
-                    p, l = self._get_random_instance()
-                    paths_and_labels.append((p, l))
-                    # Increase a threshold value to avoid infinite loops
-                    threshold += 1
-
-                    # If all data was tried to be read, raise an exception
-                    if threshold == self._batch_size:
-                        # (threshold can be any value)
-                        raise RuntimeError(
-                            'Threshold value reached. Error when '
-                            'trying to read the files provided '
-                            '(not able to fill the batch).')
+                    if not self._not_found_ok:
+                        raise
                     continue
-            else:  # Read data without handling the exception
-                y.append(path_label[1])
-                x.append(self.loader(path_label[0], **self._loaderkw))
-
-            if self._expected_shape is not None and x[-1].shape != \
-                    self._expected_shape:
-                # If the last read data is not in the expected shape
-                p, l = self._get_random_instance()
-                paths_and_labels.append((p, l))
+                if self._expected_shape is None or \
+                        data.shape == tuple(self._expected_shape):
+                    self._spec = data.shape, numpy.dtype(self._dtype or
+                                                         data.dtype)
+                    return self._spec
+            raise RuntimeError('Threshold value reached. Error when trying to '
+                               'read the files provided (not able to fill the '
+                               'batch).')
+        return self._spec
+
+    def _allocate(self, index) -> (numpy.ndarray, numpy.ndarray):
+        """Allocates the arrays of a batch"""
+        shape, dtype = self._sample_spec(index)
+        return numpy.empty((self._batch_size,) + shape, dtype), \
+            numpy.empty((self._batch_size,) + self._label_shape,
+                        self._label_dtype)
+
+    def _new_buffers(self, index) -> (numpy.ndarray, numpy.ndarray):
+        """Batch buffers, reused in turns if buffers > 0"""
+        if len(self._ring) == 0:
+            return self._allocate(index)
+        with self._lock:
+            i = self._ring_index
+            self._ring_index = (i + 1) % len(self._ring)
+            if self._ring[i] is None:
+                self._ring[i] = self._allocate(index)
+            return self._ring[i]
+
+    def _fill_batch(self, index, x: numpy.ndarray, y: numpy.ndarray) -> int:
+        """
+        Loads a batch of data into the provided arrays.
+
+        :return: int
+            The number of loaded instances.
+        """
+        paths_and_labels = [(self._paths[i], self._labels[i])
+                            for i in self._indices(index)]
+        # Fill batches
+        n = 0
+        threshold = 0
+        for path, label in paths_and_labels:
+            try:
+                loaded = self._load_sample(path, x[n, ...])
+            except FileNotFoundError:
+                if not self._not_found_ok:
+                    raise
+                loaded = False
+            if not loaded:
+                # If not found or not in the expected shape, append a new path
+                # to load
+                paths_and_labels.append(self._get_random_instance())
                 # Increase a threshold value to avoid infinite loops
                 threshold += 1
-                # Remove the last instance
-                x.pop()
-                y.pop()
 
                 # If all data was tried to be read, raise an exception
                 if threshold == self._batch_size:
+                    # (threshold can be any value)
                     raise RuntimeError('Threshold value reached. Error when '
                                        'trying to read the files provided '
                                        '(not able to fill the batch).')
                 continue
+            y[n] = label
+            n += 1
+        return n
+
+    def __getitem__(self, index) -> (numpy.ndarray, numpy.ndarray):
+        """
+        Gets a batch of data.
+
+        :return: (numpy.ndarray, numpy.ndarray)
+            Tuple of arrays. The first array represents the data, and the
+            second represents the labels.
+
+        Note: in case the size of the batch is greater than the amount of
+        data available, only the read amount will be returned.
+        """
+        return self._batch(index, *self._new_buffers(index))
+
+    def _batch(self, index, x: numpy.ndarray, y: numpy.ndarray) -> \
+            (numpy.ndarray, numpy.ndarray):
+        """Fills the provided arrays with a batch and pre processes it"""
+        n = self._fill_batch(index, x, y)
+        x, y = x[:n], y[:n]
 
         if self._pre_process_fn is not None:
             x = self._pre_process_fn(x)
 
-        return numpy.asarray(x), numpy.asarray(y)
+        if self._augment_fn is not None:
+            x = self._augment_fn(x, self._rng(index))
+
+        return numpy.asarray(x), y
 
     def __len__(self):
         """Denotes the number of batches per epoch"""
@@ -177,15 +404,62 @@ class Generator(keras.utils.Sequence):
         """Returns the total quantity of original data"""
         return len(self._paths)
 
+    @property
+    def batch_size(self) -> int:
+        """Returns the number of samples of the (complete) batches"""
+        return self._batch_size
+
     @property
     def paths(self) -> list:
         """Returns a list containing the paths of data files"""
         return self._paths
 
+    @property
+    def cache(self):
+        """Returns the cache of samples (None if disabled)"""
+        return self._cache
+
+    @property
+    def invalid(self) -> list:
+        """Returns a list containing the paths removed by the validation"""
+        return self._invalid
+
     @property
     def labels(self):
         """Returns a list containing the labels of each instance of data"""
         return self._labels
 
+    def __getstate__(self):
+        # Locks can not be pickled (e.g. by multiprocessing workers)
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def set_epoch(self, epoch: int):
+        """
+        Sets the current epoch, e.g. to resume a training. The order and the
+        augmentation of the batches only depend on the seed and the epoch.
+
+        :param epoch: int
+            Number of finished epochs.
+        """
+        if epoch != self._epoch:
+            self._epoch = epoch
+            self._order = self._permutation()
+
+    @property
+    def epoch(self) -> int:
+        """Returns the current epoch"""
+        return self._epoch
+
+    @property
+    def seed(self) -> int:
+        """Returns the seed of the shuffling and the augmentation"""
+        return self._seed
+
     def on_epoch_end(self):
-        pass
+        self.set_epoch(self._epoch + 1)
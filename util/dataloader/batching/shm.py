@@ -0,0 +1,222 @@
+"""
+This module implements a pool of worker processes writing the batches of a
+Generator into shared memory.
+
+The workers are forked, so the generator (and its loader functions) is never
+pickled, and each batch is written into a slot of shared memory. Only the
+slot indices are passed through the queues, so the batches are not
+serialized and copied back to the trainer process.
+
+Usage:
+    generator = Generator(paths, labels, 32, loader_fn=numpy.load)
+    with SharedMemoryWorkers(generator, workers=4, depth=8) as batches:
+        model.fit_generator(batches, epochs=10)
+"""
+import multiprocessing
+import queue
+import traceback
+from multiprocessing import shared_memory
+import numpy
+from util.dataloader.batching.prefetch import BackgroundSequence
+
+
+def _slot_arrays(buffers: tuple, shapes: tuple, dtypes: tuple) -> tuple:
+    return tuple(numpy.ndarray(s, dtype=d, buffer=b.buf)
+                 for b, s, d in zip(buffers, shapes, dtypes))
+
+
+def _work(generator, slots: list, tasks, results):
+    """Loop of a worker process"""
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        index, epoch, slot = task
+        try:
+            generator.set_epoch(epoch)
+            x_slot, y_slot = slots[slot]
+            x, y = generator._batch(index, x_slot, y_slot)
+            n = len(x)
+            # Batches changed by the pre processing are copied to the slot
+            if not numpy.shares_memory(x, x_slot):
+                x_slot[:n] = x
+            if not numpy.shares_memory(y, y_slot):
+                y_slot[:n] = y
+            results.put((slot, index, n, None))
+        except Exception:
+            results.put((slot, index, 0, traceback.format_exc()))
+
+
+class SharedMemoryWorkers(BackgroundSequence):
+    """A sequence of batches prepared by worker processes in shared memory"""
+
+    def __init__(self, generator, workers: int = 2, depth: int = 4,
+                 keep: int = 1, timeout: float = 60.):
+        """
+        Initializes the workers (they are started on the first batch).
+
+        :param generator: util.dataloader.batching.sequence.Generator
+            The generator of the batches.
+
+        :param workers: int
+            Number of worker processes.
+
+        :param depth: int
+            Number of batches prepared ahead of the requested one.
+
+        :param keep: int
+            Number of returned batches the consumer holds at the same time
+            (e.g. the Keras queue). A returned batch is a view of a slot of
+            shared memory, which is only reused after keep more batches are
+            returned. Default to 1.
+
+        :param timeout: float
+            Maximum time (seconds) waiting for a batch before checking if
+            the workers are alive.
+
+        Note: the slots are sized by the first batch, prepared in this
+        process. The pre processing must keep the shape of the samples.
+        """
+        super(SharedMemoryWorkers, self).__init__(generator, workers, depth,
+                                                  keep)
+        self._timeout = timeout
+        self._processes = []
+        self._buffers = []
+        self._slots = []
+        self._free = []
+        self._stale = set()
+        self._ready = dict()
+
+    def _start(self):
+        if len(self._processes) > 0:
+            return
+        x, y = self._generator[0]
+        n_slots = self._depth + self._keep + 1
+        shapes = ((self._generator._batch_size,) + x.shape[1:],
+                  (self._generator._batch_size,) + y.shape[1:])
+        dtypes = (x.dtype, y.dtype)
+        for _ in range(n_slots):
+            buffers = tuple(shared_memory.SharedMemory(
+                create=True, size=max(int(numpy.prod(s)) *
+                                      numpy.dtype(d).itemsize, 1))
+                for s, d in zip(shapes, dtypes))
+            self._buffers.append(buffers)
+            self._slots.append(_slot_arrays(buffers, shapes, dtypes))
+        self._free = list(range(n_slots))
+        context = multiprocessing.get_context('fork')
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        for _ in range(self._n_workers):
+            process = context.Process(target=_work, daemon=True,
+                                      args=(self._generator, self._slots,
+                                            self._tasks, self._results))
+            process.start()
+            self._processes.append(process)
+
+    def _submit(self, index):
+        if index in self._pending or index in self._ready or \
+                not 0 <= index < len(self) or len(self._free) == 0:
+            return
+        slot = self._free.pop()
+        self._pending[index] = slot
+        self._tasks.put((index, self._generator.epoch, slot))
+
+    def _receive(self, block: bool = True) -> bool:
+        """
+        Receives a prepared batch from the workers.
+
+        :return: bool
+            False if no batch was prepared (block=False).
+        """
+        while True:
+            try:
+                slot, index, n, error = self._results.get(
+                    block, timeout=self._timeout)
+                break
+            except queue.Empty:
+                if not block:
+                    return False
+                if not all(p.is_alive() for p in self._processes):
+                    raise RuntimeError('A worker process exited')
+        if (index, slot) in self._stale:
+            self._stale.discard((index, slot))
+            self._free.append(slot)
+            return True
+        del self._pending[index]
+        if error is not None:
+            self._free.append(slot)
+            raise RuntimeError('Error preparing the batch {}:\n{}'.
+                               format(index, error))
+        self._ready[index] = (slot, n)
+        return True
+
+    def _discard(self, index):
+        if index in self._pending:
+            self._stale.add((index, self._pending.pop(index)))
+        elif index in self._ready:
+            self._free.append(self._ready.pop(index)[0])
+
+    def _release(self, slot):
+        self._free.append(slot)
+
+    def _wait_batch(self, index):
+        if index not in self._pending:
+            # No free slot: the consumer holds more than keep batches
+            raise RuntimeError('No free slot to prepare the batch {}. '
+                               'Increase keep'.format(index))
+        self._receive()
+
+    def _get(self, index):
+        """
+        :return: (numpy.ndarray, numpy.ndarray)
+            Views of a slot of shared memory, only valid until keep more
+            batches are returned.
+        """
+        while self._receive(block=False):
+            pass
+        # Batches out of the new window are not going to be requested
+        for i in [i for i in list(self._pending) + list(self._ready)
+                  if not index <= i <= index + self._depth]:
+            self._discard(i)
+        # The requested batch first, then the next ones
+        for i in range(index, index + self._depth + 1):
+            self._submit(i)
+        self._wait(lambda: index in self._ready,
+                   lambda: self._wait_batch(index))
+        slot, n = self._ready.pop(index)
+        self._hold(slot)
+        x, y = self._slots[slot]
+        return x[:n], y[:n]
+
+    def _epoch_end(self):
+        # The pending batches were prepared for the previous epoch
+        for i in list(self._pending) + list(self._ready):
+            self._discard(i)
+        while len(self._stale) > 0:
+            self._receive()
+        self._generator.on_epoch_end()
+
+    def _close(self):
+        """Stops the workers and releases the shared memory"""
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            process.join(self._timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        self._slots = []
+        self._returned.clear()
+        self._pending.clear()
+        self._ready.clear()
+        self._stale.clear()
+        for buffers in self._buffers:
+            for b in buffers:
+                b.unlink()
+                try:
+                    b.close()
+                except BufferError:
+                    # Returned batches still reference the memory, it is
+                    # released when they are deleted
+                    pass
+        self._buffers = []
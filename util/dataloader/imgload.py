@@ -10,31 +10,121 @@ This module implements basic operations to load images for model training
 >>> im_l = img_load('test_image.png')
 >>> np.asarray(np.asarray(imarray/255)).all()  # Compare with the original array
 True
+>>> img_load('test_image.png', dtype=np.uint8).dtype
+dtype('uint8')
+>>> img_load_batch(['test_image.png'] * 4, num_workers=2).shape
+(4, 100, 100, 1)
 """
 
 
+import concurrent.futures
 import imageio
 import numpy as np
 
 
-def img_load(*params, return_channels=True):
+def _decode(*params) -> np.ndarray:
+    """Decodes the first channel of an image, without scaling it"""
+    if len(params) == 1 and isinstance(params[0], str):
+        from PIL import Image
+        with Image.open(params[0]) as im:
+            if im.mode == 'P':
+                # Palette indexes are not intensities (as read by imageio)
+                im = im.convert('RGBA' if 'transparency' in im.info else
+                                'RGB')
+            if len(im.getbands()) > 1:
+                # Only the first band is copied out of the decoded image
+                im = im.getchannel(0)
+            return np.asarray(im)
+    i = imageio.imread(*params)
+    if len(i.shape) > 2:
+        i = i[:, :, 0]
+    return i
+
+
+def _scale(i: np.ndarray, dtype, out: np.ndarray = None) -> np.ndarray:
+    """Scales an image to [0, 1] (integer types are not scaled)"""
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        if out is None:
+            return i.astype(dtype)
+        out[...] = i
+        return out
+    return np.divide(i, 255, out=out, dtype=dtype)
+
+
+def img_load(*params, return_channels=True, dtype=np.float64):
     """
     Loads an image and
 
     :param params: params
-        The parameters are passed on through the imageio.imread function.
+        The parameters are passed on through the imageio.imread function (a
+        path is decoded with PIL).
     :param return_channels: bool
         If True, will return a numpy array with shape (height, width, channels),
         (height, width) otherwise.
+    :param dtype:
+        Data type of the image. Floating types are scaled to [0, 1], integer
+        types (e.g. numpy.uint8) keep the stored values. Default to
+        numpy.float64.
 
     :return:
     """
-    i = imageio.imread(*params)
-    i = np.asarray(i/255)
-    if len(i.shape) > 2 and i.shape[2] > 1:
-        i = i[:, :, 0]
-    i = i.reshape(i.shape[0], i.shape[1], 1)
+    i = _scale(_decode(*params), dtype)
     if not return_channels:
-        return i[:, :, 0]
-    else:
         return i
+    else:
+        return i.reshape(i.shape[0], i.shape[1], 1)
+
+
+def img_load_into(path: str, out: np.ndarray):
+    """
+    Loads an image into an existing array, e.g. a slot of a batch (see the
+    loader_into_fn of util.dataloader.batching.sequence.Generator).
+
+    :param path: str
+        Path to the image.
+    :param out: numpy.ndarray, shape=(height, width, 1) or (height, width)
+        Destination. The image is scaled according to its data type (see
+        img_load).
+    """
+    i = _decode(path)
+    if i.shape != out.shape[:2] or out.ndim > 2 and out.shape[2:] != (1,):
+        raise ValueError('Shape {} of {} does not match the destination shape '
+                         '{}'.format(i.shape, path, out.shape))
+    _scale(i, out.dtype, out[:, :, 0] if out.ndim > 2 else out)
+
+
+def img_load_batch(paths, return_channels=True, dtype=np.float32,
+                   num_workers: int = 4, out: np.ndarray = None) -> np.ndarray:
+    """
+    Loads images of the same size into a single array, decoding them on a
+    thread pool.
+
+    :param paths:
+        Paths to the images.
+    :param return_channels: bool
+        If True, the shape of the array is (n, height, width, 1), (n, height,
+        width) otherwise.
+    :param dtype:
+        Data type of the images (see img_load). Default to numpy.float32.
+    :param num_workers: int
+        Number of threads decoding the images. Default to 4.
+    :param out: numpy.ndarray
+        Destination. Default to None, an array is allocated with the size of
+        the first image (ValueError is raised if an image differs).
+
+    :return: numpy.ndarray
+        The images.
+    """
+    if out is None:
+        if len(paths) == 0:
+            return np.empty((0, 0, 0, 1) if return_channels else (0, 0, 0),
+                            dtype=dtype)
+        first = _decode(paths[0])
+        out = np.empty((len(paths),) + first.shape +
+                       ((1,) if return_channels else ()), dtype=dtype)
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+        futures = [executor.submit(img_load_into, p, out[k])
+                   for k, p in enumerate(paths)]
+        for f in futures:
+            f.result()
+    return out
@@ -0,0 +1,288 @@
+"""
+This module implements a data loader backed by a memory mapped sample store.
+
+The samples are loaded once and consolidated into a single .npy file. Later
+runs map the file, and the train and test data are views holding only the
+indices of their samples, so splitting a dataset greater than the memory costs
+nothing. Data is only read when a sample or a batch is accessed.
+
+Usage:
+    loader = MemmapDataLoader(paths, labels, 'dataset.npy',
+                              loader_fn=numpy.load, test_split=0.2)
+    train = loader.get_train_data()
+    for x, y in train.batches(32):
+        ...
+"""
+import os
+import numpy
+from util.dataloader import BaseDataLoader
+from util.dataloader.numpyloader import _check_shape, _is_consolidated, \
+    _labels_path, _save_consolidated, _store_params
+from util.datasets.balance import stratified_split
+from util.hashing import sequence_digest
+
+
+class DataView:
+    """A view of some samples of a memory mapped store"""
+
+    def __init__(self, data: numpy.ndarray, labels: numpy.ndarray,
+                 indices: numpy.ndarray, pre_process_fn: callable = None):
+        """
+        Initializes a view.
+
+        :param data: numpy.ndarray
+            The (memory mapped) samples.
+        :param labels: numpy.ndarray
+            The labels of the samples.
+        :param indices: numpy.ndarray
+            Indices of the samples of the view.
+        :param pre_process_fn: callable(data) -> new_data
+            A function to pre process the data read through the view.
+            Optional.
+        """
+        self._data = data
+        self._labels = labels
+        self._indices = numpy.asarray(indices, dtype=numpy.int64)
+        self._pre_process_fn = pre_process_fn
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, item) -> (numpy.ndarray, numpy.ndarray):
+        """
+        Reads samples of the view.
+
+        :param item: int, slice or array of indices
+            Position(s) in the view.
+
+        :return: tuple (numpy.ndarray, numpy.ndarray)
+            The data and labels.
+        """
+        indices = self._indices[item]
+        if numpy.ndim(indices) == 0:
+            x = self._data[indices]
+        else:
+            # Reading the rows in file order is faster on memory maps
+            order = numpy.argsort(indices, kind='stable')
+            x = numpy.empty((len(indices),) + self._data.shape[1:],
+                            dtype=self._data.dtype)
+            x[order] = self._data[indices[order]]
+        if self._pre_process_fn is not None:
+            x = self._pre_process_fn(x)
+        return x, self._labels[indices]
+
+    def view(self, item) -> 'DataView':
+        """
+        Returns a view of some samples of this view, without reading them.
+
+        :param item: slice or array of indices
+            Positions in this view.
+        """
+        return DataView(self._data, self._labels, self._indices[item],
+                        self._pre_process_fn)
+
+    def batches(self, batch_size: int, shuffle: bool = False,
+                seed: int = None):
+        """
+        Iterates over the view in batches.
+
+        :param batch_size: int
+            Size of the batches (the last one may be smaller).
+        :param shuffle: bool
+            If true, the samples are visited in random order.
+        :param seed: int
+            Seed of the shuffling. Default to None (random seed).
+
+        :return: generator
+            Yields tuples (data, labels).
+        """
+        positions = numpy.random.default_rng(seed).permutation(len(self)) if \
+            shuffle else numpy.arange(len(self))
+        for start in range(0, len(self), batch_size):
+            yield self[positions[start:start + batch_size]]
+
+    @property
+    def indices(self) -> numpy.ndarray:
+        """Returns the indices of the samples in the store"""
+        return self._indices
+
+    @property
+    def labels(self) -> numpy.ndarray:
+        """Returns the labels of the samples of the view"""
+        return self._labels[self._indices]
+
+    @property
+    def shape(self) -> tuple:
+        """Returns the shape of the data of the view"""
+        return (len(self),) + self._data.shape[1:]
+
+
+class MemmapDataLoader(BaseDataLoader):
+    """A data loader of samples consolidated in a memory mapped file"""
+
+    def __init__(self, paths, labels, store_path: str,
+                 loader_fn: callable = None, pre_process_fn: callable = None,
+                 shuffle: bool = True, test_split: float = 0.2,
+                 stratify: bool = True, seed: int = None,
+                 expected_shape: tuple = None, not_found_ok=False,
+                 verbose=False, **loader_kw):
+        """
+        Initializes a data loader, building the store if it does not exist.
+
+        :param paths:
+            List containing the data file paths to load.
+        :param labels:
+            List containing the labels of each data.
+        :param store_path: str
+            Path of the .npy file of the samples. The labels and the loading
+            parameters are saved next to it (*_labels.npy and *_params.json).
+            If it exists and was built from the same paths and labels, with
+            the same expected_shape and not_found_ok, the files are not loaded
+            again (delete it to rebuild the store after changing the files).
+        :param loader_fn: callable(source_path: str)
+            A function to load the data, if None, must override the loader
+            function.
+        :param pre_process_fn: callable(data) -> new_data
+            A function to pre process the data read through the views.
+            Optional.
+        :param shuffle: bool
+            If true, the samples are randomly assigned to the train and test
+            data. Otherwise the last samples (of each class, if stratified)
+            are the test data.
+        :param test_split: float
+            Proportion of the test data.
+        :param stratify: bool
+            If true, each class has the same proportion of test data.
+        :param seed: int
+            Seed of the split. Default to None (random seed).
+        :param expected_shape: tuple
+            Samples not in the expected shape are ignored when building the
+            store. If None, all the samples must have the same shape.
+        :param not_found_ok: bool
+            If false, will raise a FileNotFoundError, if true, will ignore the
+            file when building the store.
+        :param verbose: bool
+            Enable/Disable verbose messages (progress).
+        :param loader_kw: Additional kwargs to be passed on to the loader
+            function.
+        """
+        super(MemmapDataLoader, self).__init__(paths, labels, loader_fn,
+                                               pre_process_fn, shuffle=False,
+                                               **loader_kw)
+        self._store_path = store_path
+        params = _store_params(expected_shape, not_found_ok)
+        params['source'] = sequence_digest(self._paths, self._labels)
+        if not _is_consolidated(store_path, params):
+            self._build(expected_shape, not_found_ok, params, verbose)
+        self._data = numpy.load(store_path, mmap_mode='r')
+        self._store_labels = numpy.load(_labels_path(store_path))
+        self._split(shuffle, test_split, stratify, seed)
+
+    def _build(self, expected_shape: tuple, not_found_ok: bool, params: dict,
+               verbose: bool):
+        """
+        Loads the samples into the store.
+
+        The store takes the data type of the first sample, and is converted
+        to the promoted type when a sample of another type is loaded.
+        """
+        data = None
+        valid = []
+        filter_shape = expected_shape is not None
+        for i, path in enumerate(self._paths):
+            if verbose and (i + 1) % 1000 == 0:
+                print('[INFO] data: {}/{}'.format(i + 1, len(self._paths)))
+            try:
+                sample = numpy.asarray(self.loader(path, **self._loaderkw))
+            except FileNotFoundError:
+                if not not_found_ok:
+                    raise
+                continue
+            if data is None:
+                expected_shape = sample.shape if expected_shape is None \
+                    else tuple(expected_shape)
+                if sample.shape != expected_shape:
+                    continue
+                # Allocated for every file, the unused rows are cut below
+                data = numpy.lib.format.open_memmap(
+                    self._store_path + '.tmp', mode='w+', dtype=sample.dtype,
+                    shape=(len(self._paths),) + expected_shape)
+            if not _check_shape((sample.shape,), path, expected_shape,
+                                filter_shape):
+                continue
+            if numpy.result_type(data.dtype, sample.dtype) != data.dtype:
+                data = self._promote(data, len(valid), numpy.result_type(
+                    data.dtype, sample.dtype))
+            data[len(valid)] = sample
+            valid.append(i)
+        if data is None:
+            raise ValueError('No data was loaded to build the store')
+        data.flush()
+        tmp_path = self._store_path + '.tmp'
+        if len(valid) < len(data):
+            # The valid rows are contiguous, they are copied to a smaller file
+            store = numpy.lib.format.open_memmap(
+                self._store_path + '.valid.tmp', mode='w+', dtype=data.dtype,
+                shape=(len(valid),) + data.shape[1:])
+            for start in range(0, len(valid), 1024):
+                end = min(start + 1024, len(valid))
+                store[start:end] = data[start:end]
+            store.flush()
+            del store
+            os.remove(tmp_path)
+            tmp_path = self._store_path + '.valid.tmp'
+        del data
+        _save_consolidated(tmp_path, self._store_path,
+                           numpy.asarray(self._labels)[numpy.asarray(
+                               valid, dtype=int)], params)
+
+    def _promote(self, data: numpy.memmap, n: int,
+                 dtype: numpy.dtype) -> numpy.memmap:
+        """Converts the store being built (its first n rows) to a data type"""
+        tmp_path = self._store_path + '.tmp'
+        promoted = numpy.lib.format.open_memmap(
+            self._store_path + '.promoted.tmp', mode='w+', dtype=dtype,
+            shape=data.shape)
+        for start in range(0, n, 1024):
+            end = min(start + 1024, n)
+            promoted[start:end] = data[start:end]
+        promoted.flush()
+        del promoted, data
+        os.replace(self._store_path + '.promoted.tmp', tmp_path)
+        return numpy.lib.format.open_memmap(tmp_path, mode='r+')
+
+    def _split(self, shuffle: bool, test_split: float, stratify: bool,
+               seed: int):
+        n = len(self._store_labels)
+        if seed is None and shuffle:
+            seed = numpy.random.SeedSequence().entropy
+        if stratify:
+            self._train, self._test = stratified_split(
+                self._store_labels, (1 - test_split, test_split),
+                seed=seed if shuffle else None)
+            return
+        order = numpy.random.default_rng(seed).permutation(n) if shuffle \
+            else numpy.arange(n)
+        n_train = int(n * (1 - test_split) + 1e-9)
+        self._train, self._test = order[:n_train], order[n_train:]
+
+    def get_train_data(self) -> DataView:
+        """Returns a view of the train data"""
+        return DataView(self._data, self._store_labels, self._train,
+                        self._pre_process_fn)
+
+    def get_test_data(self) -> DataView:
+        """Returns a view of the test data"""
+        return DataView(self._data, self._store_labels, self._test,
+                        self._pre_process_fn)
+
+    def get_data(self) -> DataView:
+        """Returns a view of all the data in the store"""
+        return DataView(self._data, self._store_labels,
+                        numpy.arange(len(self._store_labels)),
+                        self._pre_process_fn)
+
+    @property
+    def size(self) -> int:
+        """Returns the quantity of data in the store"""
+        return len(self._store_labels)
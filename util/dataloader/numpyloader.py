@@ -2,11 +2,299 @@
 This module provides a simple way to get the dataset saved in npy format.
 """
 from util.datasets.csv import CSVParser as Parser
+import concurrent.futures
+import json
+import threading
 import numpy as np
+import os
+
+
+def read_header(path: str) -> (tuple, bool, np.dtype, int):
+    """
+    Reads the header of a .npy file, without reading its data.
+
+    :param path: str
+        Path to the .npy file.
+
+    :return: tuple (tuple, bool, numpy.dtype, int)
+        The shape, fortran order, data type and the offset of the data in the
+        file.
+    """
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(f)
+        else:
+            header = np.lib.format.read_array_header_2_0(f)
+        return header + (f.tell(),)
+
+
+def read_shape(path: str) -> tuple:
+    """
+    Reads the shape of the array saved in a .npy file, without reading its
+    data.
+
+    :param path: str
+        Path to the .npy file.
+
+    :return: tuple
+        The shape of the array.
+    """
+    return read_header(path)[0]
+
+
+def load_into(path: str, out: np.ndarray, header: tuple = None):
+    """
+    Loads a .npy file into an existing array.
+
+    When the data type and memory layout match, the data is read straight
+    into the array memory, otherwise the file is loaded and copied.
+
+    :param path: str
+        Path to the .npy file.
+    :param out: numpy.ndarray
+        Destination, with the same shape of the stored array. A row of a
+        batch of scalar samples must be taken as X[n, ...] (X[n] is not an
+        array).
+    :param header: tuple
+        Header of the file (see read_header). Default to None, the header will
+        be read.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'sample.npy')
+    >>> np.save(path, np.float64(2.))
+    >>> X = np.zeros(3)
+    >>> load_into(path, X[1, ...])
+    >>> X.tolist()
+    [0.0, 2.0, 0.0]
+    """
+    if not isinstance(out, np.ndarray):
+        raise TypeError('The destination of {} is not an array: {}'.
+                        format(path, type(out).__name__))
+    shape, fortran_order, dtype, offset = header if header is not None else \
+        read_header(path)
+    if tuple(shape) != out.shape:
+        raise ValueError('Shape {} of {} does not match the destination shape '
+                         '{}'.format(shape, path, out.shape))
+    if dtype != out.dtype or fortran_order or dtype.kind not in 'biufc' or \
+            not out.flags.c_contiguous:
+        out[...] = np.load(path)
+        return
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        if f.readinto(memoryview(out).cast('B')) != out.nbytes:
+            raise ValueError('Unexpected end of file {}'.format(path))
+
+
+def _labels_path(out_path: str) -> str:
+    return os.path.splitext(out_path)[0] + '_labels.npy'
+
+
+def _params_path(out_path: str) -> str:
+    return os.path.splitext(out_path)[0] + '_params.json'
+
+
+def _store_params(expected_shape: tuple, not_found_ok: bool) -> dict:
+    """Parameters changing the content of a consolidated file"""
+    return {'expected_shape': None if expected_shape is None
+            else [int(d) for d in expected_shape],
+            'not_found_ok': bool(not_found_ok)}
+
+
+def _is_consolidated(out_path: str, params: dict,
+                     source_path: str = None) -> bool:
+    """
+    Checks if a consolidated file was built with the same parameters (and
+    after the last change of the source file).
+    """
+    if not os.path.isfile(out_path) or \
+            not os.path.isfile(_labels_path(out_path)):
+        return False
+    if source_path is not None and \
+            os.path.getmtime(out_path) < os.path.getmtime(source_path):
+        return False
+    try:
+        with open(_params_path(out_path)) as f:
+            return json.load(f) == params
+    except (OSError, ValueError):
+        return False
+
+
+def _save_consolidated(tmp_path: str, out_path: str, labels: np.ndarray,
+                       params: dict):
+    """Saves the labels and parameters of a consolidated file, and moves its
+    data file from tmp_path to out_path"""
+    # The previous data is removed first and the data file is moved last, so
+    # an interrupted run is never reused
+    if os.path.isfile(out_path):
+        os.remove(out_path)
+    np.save(_labels_path(out_path), labels)
+    with open(_params_path(out_path), 'w') as f:
+        json.dump(params, f)
+    os.replace(tmp_path, out_path)
+
+
+def _header_or_none(path: str, not_found_ok: bool):
+    try:
+        return read_header(path)
+    except FileNotFoundError:
+        if not_found_ok:
+            return None
+        raise
+
+
+def _check_shape(header: tuple, path: str, expected_shape: tuple,
+                 filter_shape: bool) -> bool:
+    """Checks the shape of a file (raises ValueError if it can not differ)"""
+    if header[0] == expected_shape:
+        return True
+    if filter_shape:
+        return False
+    raise ValueError('Shape {} of {} differs from the shape {} of the previous '
+                     'files. Provide the expected_shape to ignore '
+                     'it'.format(header[0], path, expected_shape))
+
+
+def _load_preallocated(paths, labels, expected_shape: tuple, verbose: bool,
+                       not_found_ok: bool, out_path: str,
+                       executor: concurrent.futures.Executor = None) -> \
+        (np.ndarray, np.ndarray):
+    """Loads the data into a single preallocated array (see load_dataset)"""
+    headers = []
+    valid = []
+    filter_shape = expected_shape is not None
+    if executor is not None:
+        all_headers = executor.map(_header_or_none, paths,
+                                   [not_found_ok] * len(paths))
+    else:
+        all_headers = (_header_or_none(p, not_found_ok) for p in paths)
+    for i, (path, header) in enumerate(zip(paths, all_headers)):
+        if verbose and (i + 1) % 1000 == 0:
+            print('[INFO] headers: {}/{}'.format(i + 1, len(paths)))
+        if header is None:
+            continue
+        if expected_shape is None:
+            expected_shape = header[0]
+        if _check_shape(header, path, expected_shape, filter_shape):
+            headers.append(header)
+            valid.append(i)
+
+    if len(valid) > 0:
+        dtype = np.result_type(*{h[2] for h in headers})
+    else:
+        dtype = np.float64
+    shape = (len(valid),) + tuple(expected_shape or ())
+    if out_path is not None:
+        X = np.lib.format.open_memmap(out_path + '.tmp', mode='w+',
+                                     dtype=dtype, shape=shape)
+    else:
+        X = np.empty(shape, dtype=dtype)
+
+    if executor is not None:
+        futures = [executor.submit(load_into, paths[i], X[n, ...], header)
+                   for n, (i, header) in enumerate(zip(valid, headers))]
+        for n, f in enumerate(concurrent.futures.as_completed(futures)):
+            if verbose and (n + 1) % 1000 == 0:
+                print('[INFO] data: {}/{}'.format(n + 1, len(valid)))
+            f.result()
+    else:
+        for n, (i, header) in enumerate(zip(valid, headers)):
+            if verbose and (n + 1) % 1000 == 0:
+                print('[INFO] data: {}/{}'.format(n + 1, len(valid)))
+            load_into(paths[i], X[n, ...], header)
+    y = np.asarray(labels)[np.asarray(valid, dtype=np.int64)]
+
+    if out_path is not None:
+        X.flush()
+        del X
+        _save_consolidated(out_path + '.tmp', out_path, y,
+                           _store_params(expected_shape if filter_shape
+                                         else None, not_found_ok))
+        X = np.load(out_path, mmap_mode='r')
+    return X, y
+
+
+def _load_unordered(paths, labels, expected_shape: tuple, verbose: bool,
+                    not_found_ok: bool,
+                    executor: concurrent.futures.Executor) -> \
+        (np.ndarray, np.ndarray):
+    """
+    Loads the data in a single pass, in the order the files are read.
+
+    The output has room for every file, but the rows of the ignored files are
+    never written, so their memory is not used. It takes the data type of the
+    first file; if the files have different data types, the rows of the other
+    types are read again in the promoted type (as in the ordered loading).
+
+    >>> import tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> paths = [os.path.join(folder, '{}.npy'.format(i)) for i in range(3)]
+    >>> for path, value in zip(paths, [np.int16(1), 0.5, 2.7]):
+    ...     np.save(path, value)
+    >>> with concurrent.futures.ThreadPoolExecutor(1) as executor:
+    ...     X, y = _load_unordered(paths, [0, 1, 2], None, False, False,
+    ...                            executor)
+    >>> X.dtype, sorted(X.tolist())
+    (dtype('float64'), [0.5, 1.0, 2.7])
+    """
+    filter_shape = expected_shape is not None
+    if filter_shape:
+        expected_shape = tuple(expected_shape)
+    first = None
+    for path in paths:
+        header = _header_or_none(path, not_found_ok)
+        if header is not None and (not filter_shape or
+                                   header[0] == expected_shape):
+            first = header
+            break
+    if first is None:
+        # No file in the expected shape
+        return np.empty((0,) + tuple(expected_shape or ())), \
+            np.asarray(labels)[:0]
+    if not filter_shape:
+        expected_shape = first[0]
+    X = np.empty((len(paths),) + tuple(expected_shape), dtype=first[2])
+    sources = np.empty(len(paths), dtype=np.int64)
+    dtypes = [None] * len(paths)
+    lock = threading.Lock()
+    count = [0]
+
+    def load(i: int):
+        header = _header_or_none(paths[i], not_found_ok)
+        if header is None or not _check_shape(header, paths[i], expected_shape,
+                                              filter_shape):
+            return
+        with lock:
+            n = count[0]
+            count[0] += 1
+        load_into(paths[i], X[n, ...], header)
+        sources[n] = i
+        dtypes[n] = header[2]
+
+    futures = [executor.submit(load, i) for i in range(len(paths))]
+    for n, f in enumerate(concurrent.futures.as_completed(futures)):
+        if verbose and (n + 1) % 1000 == 0:
+            print('[INFO] data: {}/{}'.format(n + 1, len(paths)))
+        f.result()
+    X, sources, dtypes = X[:count[0]], sources[:count[0]], dtypes[:count[0]]
+
+    dtype = np.result_type(*set(dtypes)) if dtypes else X.dtype
+    if dtype != X.dtype:
+        # The rows of the other types were cast to the type of the first file
+        if verbose:
+            print('[INFO] reading again the rows not in', X.dtype)
+        rows = [n for n, t in enumerate(dtypes) if t != X.dtype]
+        X = X.astype(dtype)
+        for f in [executor.submit(load_into, paths[sources[n]], X[n, ...])
+                  for n in rows]:
+            f.result()
+    return X, np.asarray(labels)[sources]
 
 
 def load_dataset(csv_dataset_path: str, expected_shape: tuple=None,
-                 verbose=False, not_found_ok=False):
+                 verbose=False, not_found_ok=False, preallocate=False,
+                 out_path: str = None, num_threads: int = 1,
+                 ordered: bool = True):
     """
     Loads a dataset saved in numpy binary files (.npy format).
 
@@ -29,10 +317,57 @@ def load_dataset(csv_dataset_path: str, expected_shape: tuple=None,
         If false, will raise a FileNotFoundError, if true, will ignore the file.
         Default to false.
 
+    :param preallocate: bool
+        If true, only the headers of the files are read first, to filter them
+        by shape and count the valid ones, and the data is read straight into
+        a single preallocated array. The peak memory is the size of the
+        dataset instead of twice its size. If expected_shape is None, all the
+        files must have the same shape (ValueError is raised otherwise).
+        Default to false.
+
+    :param out_path: str
+        Path of a .npy file where the data is consolidated (implies
+        preallocate). The data is returned as a read only memory map, and the
+        labels and the loading parameters are saved next to it (*_labels.npy
+        and *_params.json). If the file is newer than the CSV file and was
+        built with the same expected_shape and not_found_ok, it is reopened
+        instead of loading the dataset again.
+        Default to None.
+
+    :param num_threads: int
+        Number of threads reading the files (implies preallocate when greater
+        than 1). Reading releases the GIL, so the latency of the files on
+        networked storage overlaps. Default to 1.
+
+    :param ordered: bool
+        Used with num_threads. If true, the rows follow the order of the CSV
+        file. If false, the headers and data are read in a single pass and the
+        rows (and labels) are in the order the files are read. Always true
+        when out_path is provided. Default to true.
+
     :return: tuple (numpy.ndarray, numpy.ndarray)
         A tuple with the data loaded and the respective labels.
     """
+    if out_path is not None and _is_consolidated(
+            out_path, _store_params(expected_shape, not_found_ok),
+            csv_dataset_path):
+        if verbose:
+            print('[INFO] reopening consolidated data', out_path)
+        return np.load(out_path, mmap_mode='r'), \
+            np.load(_labels_path(out_path))
+
     paths, labels = Parser(csv_dataset_path)()
+    if num_threads is not None and num_threads > 1:
+        with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+            if not ordered and out_path is None:
+                return _load_unordered(paths, labels, expected_shape, verbose,
+                                       not_found_ok, executor)
+            return _load_preallocated(paths, labels, expected_shape, verbose,
+                                      not_found_ok, out_path, executor)
+    if preallocate or out_path is not None:
+        return _load_preallocated(paths, labels, expected_shape, verbose,
+                                  not_found_ok, out_path)
+
     X = []
     y = []
     i = 0
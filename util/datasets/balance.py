@@ -1,9 +1,125 @@
 """
 This module provide functions to balance data.
+
+The functions work on the labels only, and return indices of the selected
+instances, so the data (or paths) is never copied. The labels are grouped
+once (numpy.unique and a stable argsort), which scales to manifests of
+millions of rows.
 """
 import numpy
 
 
+def group_indices(y) -> (numpy.ndarray, numpy.ndarray, numpy.ndarray,
+                         numpy.ndarray):
+    """
+    Groups the instances by label.
+
+    :param y:
+        Labels/classes.
+
+    :return: tuple (numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        The sorted classes, the class index of each instance, the number of
+        instances of each class and the indices of the instances grouped by
+        class (in their original order within each class).
+    """
+    classes, inverse, counts = numpy.unique(numpy.asarray(y),
+                                            return_inverse=True,
+                                            return_counts=True)
+    inverse = inverse.ravel()
+    return classes, inverse, counts, numpy.argsort(inverse, kind='stable')
+
+
+def _ranks(inverse: numpy.ndarray, counts: numpy.ndarray,
+           order: numpy.ndarray) -> numpy.ndarray:
+    """Position of each grouped instance within its class"""
+    starts = numpy.concatenate([[0], numpy.cumsum(counts)[:-1]])
+    return numpy.arange(len(order)) - starts[inverse[order]]
+
+
+def _grouped(y, seed: int = None):
+    """Groups the instances, shuffled within each class if a seed is given"""
+    classes, inverse, counts, order = group_indices(y)
+    if seed is not None:
+        rng = numpy.random.default_rng(seed)
+        order = numpy.lexsort((rng.random(len(inverse)), inverse))
+    return classes, inverse, counts, order
+
+
+def _limits(counts: numpy.ndarray, balance: bool,
+            max_per_class: int = None) -> numpy.ndarray:
+    """Number of instances kept of each class"""
+    limits = counts.copy()
+    if balance and len(counts) > 0:
+        limits[:] = counts.min()
+    if max_per_class is not None:
+        limits = numpy.minimum(limits, max_per_class)
+    return limits
+
+
+def balance_indices(y, max_per_class: int = None, balance: bool = True,
+                    seed: int = None) -> numpy.ndarray:
+    """
+    Selects the instances of balanced (and/or capped) classes.
+
+    :param y:
+        Labels/classes.
+    :param max_per_class: int
+        Maximum number of instances of each class. Default to None (no cap).
+    :param balance: bool
+        If true, every class keeps the number of instances of the smallest
+        class. Default to true.
+    :param seed: int
+        If provided, the kept instances of each class are randomly selected.
+        Default to None (the first instances of each class are kept).
+
+    :return: numpy.ndarray
+        Indices of the selected instances, grouped by class.
+    """
+    classes, inverse, counts, order = _grouped(y, seed)
+    limits = _limits(counts, balance, max_per_class)
+    return order[_ranks(inverse, counts, order) < limits[inverse[order]]]
+
+
+def stratified_split(y, fractions, max_per_class: int = None,
+                     balance: bool = False, seed: int = None) -> list:
+    """
+    Splits the instances keeping the proportion of each class in every split.
+
+    >>> [s.tolist() for s in stratified_split(['a'] * 4 + ['b'] * 6,
+    ...                                       (0.5, 0.5))]
+    [[0, 1, 4, 5, 6], [2, 3, 7, 8, 9]]
+
+    :param y:
+        Labels/classes.
+    :param fractions:
+        Proportion of each split (e.g. train, validation and test). The
+        remainder of a class, if the fractions sum less than 1, is ignored.
+    :param max_per_class: int
+        Maximum number of instances of each class. Default to None (no cap).
+    :param balance: bool
+        If true, every class keeps the number of instances of the smallest
+        class before splitting. Default to false.
+    :param seed: int
+        If provided, the instances are randomly assigned to the splits.
+        Default to None (the splits follow the order of the instances within
+        each class).
+
+    :return: list
+        An array of indices (grouped by class) per split.
+    """
+    classes, inverse, counts, order = _grouped(y, seed)
+    limits = _limits(counts, balance, max_per_class)
+    ranks = _ranks(inverse, counts, order)
+    # First rank of each split in each class, shape=(classes, splits + 1)
+    bounds = (numpy.concatenate([[0], numpy.cumsum(fractions)])[None, :] *
+              limits[:, None] + 1e-9).astype(numpy.int64)
+    bounds[:, -1] = numpy.minimum(bounds[:, -1], limits)
+    cls = inverse[order]
+    split = (ranks[:, None] >= bounds[cls]).sum(axis=1) - 1
+    split[ranks >= bounds[cls, -1]] = -1
+    return [order[split == i] for i in range(len(fractions))]
+
+
 def balance_data(x, y):
     """
     Balance data to be representative.
@@ -19,17 +135,5 @@ def balance_data(x, y):
     :return: tuple (numpy.ndarray, numpy.ndarray)
         x, y balanced
     """
-    dataset = list(zip(x, y))
-    unique, counts = numpy.unique(y, return_counts=True)
-    max_n_instances = min(counts)
-    paths_per_label = dict()
-    for label in unique:
-        paths_per_label[label] = list(filter(lambda d: d[1] == label, dataset))
-    x = []
-    y = []
-    for label in paths_per_label:
-        for inst, lbl in paths_per_label[label][:max_n_instances]:
-            x.append(inst)
-            y.append(lbl)
-
-    return numpy.asarray(x), numpy.asarray(y)
+    indices = balance_indices(y)
+    return numpy.asarray(x)[indices], numpy.asarray(y)[indices]
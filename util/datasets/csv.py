@@ -6,6 +6,59 @@ import numpy as np
 import os
 
 
+def _parse_lines(lines) -> (list, list):
+    """Parses the paths (first column) and labels (last column) of lines"""
+    lines = [line for line in lines if line and not line.isspace()]
+    file_names = [line.partition(',')[0] for line in lines]
+    labels = [line.rpartition(',')[2].rstrip() for line in lines]
+    return file_names, labels
+
+
+def _fix_separators(file_names: list) -> list:
+    """Replaces the path separators by the separator of the system"""
+    other = '/' if os.sep == '\\' else '\\'
+    if not any(other in n for n in file_names):
+        return file_names
+    return [n.replace(other, os.sep) for n in file_names]
+
+
+def iter_rows(path: str, chunk_size: int = 100000):
+    """
+    Parses a CSV file in chunks, for files too big to be held in memory.
+
+    :param path: str
+        Path to the file to parse (see CSVParser).
+    :param chunk_size: int
+        Number of lines of each chunk.
+
+    :return: generator
+        Yields a list with the file names and a list with the respective
+        labels of each chunk.
+    """
+    with open(path) as dataset:
+        lines = []
+        for line in dataset:
+            lines.append(line)
+            if len(lines) == chunk_size:
+                file_names, labels = _parse_lines(lines)
+                yield _fix_separators(file_names), labels
+                lines = []
+        if len(lines) > 0:
+            file_names, labels = _parse_lines(lines)
+            yield _fix_separators(file_names), labels
+
+
+def encode_labels(labels: list, classes: np.ndarray) -> np.ndarray:
+    """Encodes the labels as the indexes of the (sorted) classes"""
+    labels = np.asarray(labels, dtype=str)
+    ids = np.searchsorted(classes, labels)
+    ids[ids == len(classes)] = 0
+    if not np.all(classes[ids] == labels):
+        raise ValueError('Unknown classes: {}'.format(
+            sorted(set(labels[classes[ids] != labels]))))
+    return ids.astype(np.int32)
+
+
 class CSVParser:
     """
     Parses a file containing datasets paths and labels.
@@ -18,23 +71,83 @@ class CSVParser:
 
         *ext is the file extension.
 
+    Besides the lists of file names and labels, the labels are encoded as
+    integers (label_ids) indexing the sorted classes, and the number of
+    instances of each class is counted once (class_counts).
+
     :param path: str
         Path to the file to parse.
+    :param cache: bool
+        If true, the parsed file is saved to a binary file next to it
+        (path + '.cache.npz'), which is loaded instead while the CSV file is
+        unchanged (same modification time and size). Default to false.
     """
-    def __init__(self, path: str):
+    def __init__(self, path: str, cache: bool = False):
         self.path = path
-        self.file_names = []
-        self.labels = []
+        if cache and self._load_cache():
+            return
         with open(self.path) as dataset:
-            for line in dataset:
-                data = line.split(',')
-                n = data[0]
-                if os.sep == '\\':
-                    n = n.replace('/', os.sep)
-                elif os.sep == '/':
-                    n = n.replace('\\', os.sep)
-                self.file_names.append(n)
-                self.labels.append(data[-1].rstrip())
+            file_names, labels = _parse_lines(dataset.read().splitlines())
+        self._file_names = _fix_separators(file_names)
+        self._labels = labels
+        # Encoded through a dict, faster than sorting all the label strings
+        classes = sorted(set(labels))
+        vocabulary = {c: i for i, c in enumerate(classes)}
+        self.classes = np.asarray(classes, dtype=str)
+        self.label_ids = np.fromiter((vocabulary[l] for l in labels),
+                                     dtype=np.int32, count=len(labels))
+        self.class_counts = np.bincount(self.label_ids,
+                                        minlength=len(classes))
+        if cache:
+            self._save_cache()
+
+    @property
+    def cache_path(self) -> str:
+        """Returns the path of the binary cache of the parsed file"""
+        return self.path + '.cache.npz'
+
+    def _signature(self) -> np.ndarray:
+        stat = os.stat(self.path)
+        return np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+
+    def _save_cache(self):
+        # Paths are saved as a single UTF-8 blob instead of a fixed width array
+        blob = np.frombuffer('\n'.join(self.file_names).encode('utf-8'),
+                             dtype=np.uint8)
+        tmp_path = self.cache_path + '.tmp.npz'
+        np.savez(tmp_path, signature=self._signature(), file_names=blob,
+                 classes=self.classes, label_ids=self.label_ids,
+                 class_counts=self.class_counts)
+        os.replace(tmp_path, self.cache_path)
+
+    def _load_cache(self) -> bool:
+        """Loads the binary cache if it is up to date"""
+        if not os.path.isfile(self.cache_path):
+            return False
+        with np.load(self.cache_path) as cache:
+            if not np.array_equal(cache['signature'], self._signature()):
+                return False
+            self._blob = cache['file_names']
+            self.classes = cache['classes']
+            self.label_ids = cache['label_ids']
+            self.class_counts = cache['class_counts']
+        # The lists are only built when requested
+        self._file_names = None
+        self._labels = None
+        return True
+
+    @property
+    def file_names(self) -> list:
+        if self._file_names is None:
+            blob = self._blob.tobytes().decode('utf-8')
+            self._file_names = blob.split('\n') if len(blob) > 0 else []
+        return self._file_names
+
+    @property
+    def labels(self) -> list:
+        if self._labels is None:
+            self._labels = self.classes[self.label_ids].tolist()
+        return self._labels
 
     def data_and_labels(self) -> (list, list):
         """
@@ -52,4 +165,4 @@ class CSVParser:
 
     @property
     def num_classes(self):
-        return len(np.unique(self.labels))
+        return len(self.classes)
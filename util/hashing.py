@@ -0,0 +1,45 @@
+import hashlib
+
+
+def file_digest(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Computes a digest of the whole content of a file.
+
+    :param file_path: str
+        Path of the file.
+    :param chunk_size: int
+        Number of bytes read at a time. Default to 1 MB.
+
+    :return: str
+        The hexadecimal digest.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sequence_digest(*sequences) -> str:
+    """
+    Computes a digest of the items of sequences (e.g. the paths and labels of
+    a dataset), from their text.
+
+    :param sequences: iterables
+        The sequences, hashed in order.
+
+    :return: str
+        The hexadecimal digest.
+
+    >>> sequence_digest(['a.npy', 'b.npy'], [0, 1]) == \\
+    ...     sequence_digest(('a.npy', 'b.npy'), [0, 1])
+    True
+    >>> sequence_digest(['a.npy'], [0]) == sequence_digest(['a.npy'], [1])
+    False
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for sequence in sequences:
+        for item in sequence:
+            digest.update(str(item).encode() + b'\0')
+        digest.update(b'\1')
+    return digest.hexdigest()